@@ -0,0 +1,89 @@
+"""
+ベンチマーク用の合成MP4フィクスチャ
+
+ffmpegのlavfiソース（ピンクノイズと単色映像）からオフラインで生成する。
+ノイズのシードを固定しているため、同じffmpegなら毎回同じ内容になる。
+"""
+import os
+import subprocess
+from typing import List, NamedTuple, Sequence
+
+
+class FixtureSpec(NamedTuple):
+    """生成するフィクスチャの仕様"""
+    name: str
+    codec: str
+    sample_rate: int
+    channels: int
+    duration: float
+
+
+# 音声コーデックごとのffmpegエンコード引数
+AUDIO_CODEC_ARGS = {
+    'aac': ['-c:a', 'aac', '-b:a', '128k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '96k'],
+}
+
+# 既定のフィクスチャ一式（長さ・コーデック・サンプルレート・チャンネル数を変える）
+DEFAULT_FIXTURES: List[FixtureSpec] = [
+    FixtureSpec('aac_44k_stereo_30s', 'aac', 44100, 2, 30.0),
+    FixtureSpec('aac_48k_stereo_300s', 'aac', 48000, 2, 300.0),
+    FixtureSpec('aac_22k_mono_10s', 'aac', 22050, 1, 10.0),
+    FixtureSpec('aac_48k_mono_120s', 'aac', 48000, 1, 120.0),
+    FixtureSpec('mp3_44k_stereo_60s', 'mp3', 44100, 2, 60.0),
+    FixtureSpec('opus_48k_stereo_60s', 'opus', 48000, 2, 60.0),
+]
+
+# 数秒の短いクリップ（プロセス起動のオーバーヘッドを測る用）
+SHORT_CLIP_FIXTURES: List[FixtureSpec] = [
+    FixtureSpec(f'aac_44k_stereo_{seconds}s', 'aac', 44100, 2, float(seconds))
+    for seconds in (5, 10, 20)
+]
+
+
+def fixture_args(spec: FixtureSpec, output_file: str, ffmpeg: str = 'ffmpeg') -> List[str]:
+    """フィクスチャを生成するffmpegコマンドを作る"""
+    audio = (
+        f"anoisesrc=color=pink:seed=1:amplitude=0.3"
+        f":sample_rate={spec.sample_rate}:duration={spec.duration}"
+    )
+    video = f"color=c=black:s=320x240:r=25:d={spec.duration}"
+    return [
+        ffmpeg,
+        '-hide_banner',
+        '-loglevel', 'error',
+        '-f', 'lavfi', '-i', audio,
+        '-f', 'lavfi', '-i', video,
+        '-map', '0:a', '-map', '1:v',
+        '-ac', str(spec.channels),
+        *AUDIO_CODEC_ARGS[spec.codec],
+        '-c:v', 'mpeg4', '-q:v', '10',
+        '-shortest',
+        '-f', 'mp4',
+        '-y',
+        output_file,
+    ]
+
+
+def ensure_fixtures(
+    specs: Sequence[FixtureSpec],
+    fixture_dir: str,
+    ffmpeg: str = 'ffmpeg'
+) -> List[str]:
+    """
+    フィクスチャを生成する（生成済みのものは再利用する）
+
+    Returns:
+        List[str]: specsと同じ順序のフィクスチャのパス
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    paths = []
+    for spec in specs:
+        path = os.path.join(fixture_dir, f"{spec.name}.mp4")
+        if not os.path.exists(path):
+            temp_path = f"{path}.tmp"
+            subprocess.run(fixture_args(spec, temp_path, ffmpeg), check=True)
+            os.replace(temp_path, path)
+        paths.append(path)
+    return paths
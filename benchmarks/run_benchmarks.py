@@ -0,0 +1,474 @@
+"""
+変換処理のベンチマーク
+
+合成フィクスチャを `python -m mp4_to_mp3` で変換し、
+処理ファイル数/秒、実時間比（入力の長さ÷処理時間）、ピークRSS、
+同時実行数ごとのスケーリングを測定してJSONに書き出す。
+`--presets` を付けると、エンコード設定のプリセットごとの速度と出力サイズも測定する。
+`--backends` を付けると、同じバッチを変換の方式（バックエンド）ごとに変換して比べる。
+
+使用例:
+    python -m benchmarks.run_benchmarks -o bench.json
+    python -m benchmarks.run_benchmarks -o presets.json --presets all --skip-fixtures --concurrency 1
+    python -m benchmarks.run_benchmarks -o backends.json --short-clips --backends all --copies 10
+    python -m benchmarks.run_benchmarks -o new.json --compare bench.json
+    python -m benchmarks.run_benchmarks -o new.json -- --aac-passthrough
+
+`--` 以降の引数は変換コマンドにそのまま渡される。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from mp4_to_mp3.backends import BACKENDS
+from mp4_to_mp3.profiles import PRESETS
+
+from .fixtures import (
+    DEFAULT_FIXTURES,
+    SHORT_CLIP_FIXTURES,
+    FixtureSpec,
+    ensure_fixtures,
+)
+
+RESULTS_VERSION = 1
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_FIXTURE_DIR = os.path.join(REPO_ROOT, 'benchmarks', '.fixtures')
+
+# 変換の出力として数えるファイルの拡張子
+OUTPUT_EXTENSIONS = ('.mp3', '.m4a')
+
+
+class BenchmarkError(RuntimeError):
+    """変換が失敗した（測定値は変換の速さを表さない）"""
+
+
+def _link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def run_conversion(
+    inputs: Sequence[str],
+    output_dir: str,
+    concurrency: int,
+    extra_args: Sequence[str] = ()
+) -> Dict[str, Any]:
+    """
+    変換コマンドを子プロセスで実行して測定する
+
+    CPU時間は子プロセスとその子孫（ffmpeg）を合わせた値、ピークRSSはそれらのうち
+    最も大きかった1つのプロセスの値で、wait4が使えるPOSIX環境でのみ取得できる。
+
+    入力の解析結果のキャッシュ（プローブインデックス）は出力先の中に毎回新しく作るため、
+    前の測定の解析結果は使われず、ユーザーのキャッシュにも書き込まない。
+
+    Returns:
+        Dict[str, Any]: wall_seconds、cpu_seconds、peak_rss_kb、returncode
+
+    Raises:
+        BenchmarkError: 変換コマンドが失敗した、または入力の数だけ出力ができなかった場合
+    """
+    command = [
+        sys.executable, '-m', 'mp4_to_mp3',
+        *inputs,
+        '-o', output_dir,
+        '-j', str(concurrency),
+        '--force',
+        '--no-report',
+        '--probe-index', os.path.join(output_dir, '.probe_index.sqlite3'),
+        *extra_args,
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    cpu_seconds: Optional[float] = None
+    peak_rss_kb: Optional[int] = None
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') \
+            else (status >> 8)
+        process.returncode = returncode
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        # macOSではバイト単位、Linuxではキロバイト単位
+        peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    else:
+        returncode = process.wait()
+    wall_seconds = time.perf_counter() - start
+    if returncode != 0:
+        raise BenchmarkError(
+            f"変換コマンドが終了コード {returncode} で失敗しました（追加の引数: {' '.join(extra_args) or 'なし'}）"
+        )
+    outputs = _output_files(output_dir)
+    if len(outputs) < len(inputs):
+        raise BenchmarkError(f"出力が{len(outputs)}件しかありません（入力 {len(inputs)}件）: {output_dir}")
+    return {
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': cpu_seconds,
+        'peak_rss_kb': peak_rss_kb,
+        'returncode': returncode,
+    }
+
+
+def _output_files(output_dir: str) -> List[str]:
+    return [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(output_dir)
+        for filename in filenames
+        if not filename.startswith('.') and filename.lower().endswith(OUTPUT_EXTENSIONS)
+    ]
+
+
+def _output_bytes(output_dir: str) -> int:
+    return sum(os.path.getsize(path) for path in _output_files(output_dir))
+
+
+def benchmark_fixtures(
+    specs: Sequence[FixtureSpec],
+    paths: Sequence[str],
+    work_dir: str,
+    extra_args: Sequence[str] = ()
+) -> List[Dict[str, Any]]:
+    """フィクスチャを1つずつ変換し、コーデックや長さごとの実時間比を測る"""
+    results = []
+    for spec, path in zip(specs, paths):
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        measured = run_conversion([path], output_dir, 1, extra_args)
+        results.append({
+            **spec._asdict(),
+            **measured,
+            'realtime_factor': spec.duration / measured['wall_seconds'],
+            'output_bytes': _output_bytes(output_dir),
+        })
+    return results
+
+
+def benchmark_concurrency(
+    specs: Sequence[FixtureSpec],
+    paths: Sequence[str],
+    levels: Sequence[int],
+    copies: int,
+    work_dir: str,
+    extra_args: Sequence[str] = ()
+) -> List[Dict[str, Any]]:
+    """
+    全フィクスチャをcopies回ずつ並べたバッチを同時実行数ごとに変換する
+
+    Returns:
+        List[Dict[str, Any]]: 同時実行数ごとの測定結果（speedupは同時実行数1との比）
+    """
+    batch_dir = os.path.join(work_dir, 'batch')
+    os.makedirs(batch_dir, exist_ok=True)
+    inputs = []
+    for copy in range(copies):
+        for spec, path in zip(specs, paths):
+            destination = os.path.join(batch_dir, f"{copy:03d}_{spec.name}.mp4")
+            _link_or_copy(path, destination)
+            inputs.append(destination)
+    media_seconds = sum(spec.duration for spec in specs) * copies
+
+    results = []
+    for level in levels:
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        measured = run_conversion(inputs, output_dir, level, extra_args)
+        results.append({
+            'concurrency': level,
+            'files': len(inputs),
+            'media_seconds': media_seconds,
+            **measured,
+            'files_per_second': len(inputs) / measured['wall_seconds'],
+            'realtime_factor': media_seconds / measured['wall_seconds'],
+        })
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    baseline = next((r for r in results if r['concurrency'] == 1), None)
+    for result in results:
+        result['speedup'] = (
+            baseline['wall_seconds'] / result['wall_seconds'] if baseline else None
+        )
+    return results
+
+
+def benchmark_presets(
+    specs: Sequence[FixtureSpec],
+    paths: Sequence[str],
+    presets: Sequence[str],
+    work_dir: str,
+    extra_args: Sequence[str] = ()
+) -> List[Dict[str, Any]]:
+    """
+    全フィクスチャを同時実行数1でプリセットごとに変換し、速度と出力サイズを測る
+
+    Returns:
+        List[Dict[str, Any]]: プリセットごとの測定結果（kbpsは出力の平均ビットレート）
+    """
+    media_seconds = sum(spec.duration for spec in specs)
+    results = []
+    for preset in presets:
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        measured = run_conversion(paths, output_dir, 1, ['--preset', preset, *extra_args])
+        output_bytes = _output_bytes(output_dir)
+        results.append({
+            'preset': preset,
+            'media_seconds': media_seconds,
+            **measured,
+            'realtime_factor': media_seconds / measured['wall_seconds'],
+            'output_bytes': output_bytes,
+            'kbps': output_bytes * 8 / media_seconds / 1000,
+        })
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_backends(
+    specs: Sequence[FixtureSpec],
+    paths: Sequence[str],
+    backends: Sequence[str],
+    copies: int,
+    work_dir: str,
+    extra_args: Sequence[str] = ()
+) -> List[Dict[str, Any]]:
+    """
+    全フィクスチャをcopies回ずつ並べたバッチをバックエンドごとに同時実行数1で変換する
+
+    Returns:
+        List[Dict[str, Any]]: バックエンドごとの測定結果（speedupはffmpegとの比）
+    """
+    batch_dir = os.path.join(work_dir, 'backend_batch')
+    media_seconds = sum(spec.duration for spec in specs) * copies
+    results = []
+    for backend in backends:
+        # 入力の解析結果のキャッシュが効かないよう、バックエンドごとに別のパスにする
+        inputs = []
+        os.makedirs(os.path.join(batch_dir, backend), exist_ok=True)
+        for copy in range(copies):
+            for spec, path in zip(specs, paths):
+                destination = os.path.join(batch_dir, backend, f"{copy:03d}_{spec.name}.mp4")
+                _link_or_copy(path, destination)
+                inputs.append(destination)
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        measured = run_conversion(inputs, output_dir, 1, ['--backend', backend, *extra_args])
+        results.append({
+            'backend': backend,
+            'files': len(inputs),
+            'media_seconds': media_seconds,
+            **measured,
+            'files_per_second': len(inputs) / measured['wall_seconds'],
+            'realtime_factor': media_seconds / measured['wall_seconds'],
+        })
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    baseline = next((r for r in results if r['backend'] == 'ffmpeg'), None)
+    for result in results:
+        result['speedup'] = (
+            baseline['wall_seconds'] / result['wall_seconds'] if baseline else None
+        )
+    return results
+
+
+def _command_output(command: Sequence[str]) -> Optional[str]:
+    try:
+        output = subprocess.run(
+            command, capture_output=True, text=True, cwd=REPO_ROOT, timeout=30
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.splitlines()[0].strip() if output else None
+
+
+def collect_metadata(args: argparse.Namespace) -> Dict[str, Any]:
+    """結果を比較するときに参照する実行環境の情報"""
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': _command_output(['git', 'rev-parse', 'HEAD']),
+        'ffmpeg_version': _command_output([args.ffmpeg, '-version']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'fixture_set': 'short_clips' if args.short_clips else 'default',
+        'copies': args.copies,
+        'extra_args': args.extra_args,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    tolerance: float
+) -> List[str]:
+    """
+    2つの結果を比べ、tolerance（割合）を超えて遅くなった項目を返す
+
+    同時実行数とバックエンドごとのfiles_per_second、プリセットとフィクスチャごとの
+    realtime_factorを比較する。
+    """
+    regressions = []
+
+    def check(label: str, old: Optional[float], new: Optional[float]):
+        if not old or new is None:
+            return
+        change = new / old - 1.0
+        print(f"{label:40s} {old:10.2f} -> {new:10.2f} ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(f"{label}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+
+    old_meta = baseline.get('meta', {})
+    new_meta = current.get('meta', {})
+    same_batch = all(
+        old_meta.get(key) == new_meta.get(key) for key in ('fixture_set', 'copies')
+    )
+    if not same_batch:
+        print("フィクスチャの組み合わせが異なるため、同時実行数ごとの比較は省略します")
+    old_runs = {run['concurrency']: run for run in baseline.get('runs', [])} if same_batch else {}
+    for run in current.get('runs', []):
+        old = old_runs.get(run['concurrency'])
+        if old:
+            check(f"files/sec @ -j {run['concurrency']}", old['files_per_second'], run['files_per_second'])
+
+    old_presets = {run['preset']: run for run in baseline.get('presets', [])} if same_batch else {}
+    for run in current.get('presets', []):
+        old = old_presets.get(run['preset'])
+        if old:
+            check(f"realtime x preset {run['preset']}", old['realtime_factor'], run['realtime_factor'])
+
+    old_backends = {run['backend']: run for run in baseline.get('backends', [])} if same_batch else {}
+    for run in current.get('backends', []):
+        old = old_backends.get(run['backend'])
+        if old:
+            check(f"files/sec backend {run['backend']}", old['files_per_second'], run['files_per_second'])
+
+    old_fixtures = {fixture['name']: fixture for fixture in baseline.get('fixtures', [])}
+    for fixture in current.get('fixtures', []):
+        old = old_fixtures.get(fixture['name'])
+        if old:
+            check(f"realtime x {fixture['name']}", old['realtime_factor'], fixture['realtime_factor'])
+    return regressions
+
+
+def default_levels() -> List[int]:
+    cpu_count = os.cpu_count() or 1
+    return sorted({level for level in (1, 2, 4, 8, 16) if level < cpu_count} | {cpu_count})
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run_benchmarks",
+        description="MP4→MP3変換のベンチマークを実行します。",
+    )
+    parser.add_argument("-o", "--output", default="bench_results.json", help="結果のJSONファイル")
+    parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR, help="フィクスチャの保存先")
+    parser.add_argument("--copies", type=int, default=4, help="同時実行数の測定で各フィクスチャを並べる数")
+    parser.add_argument(
+        "--concurrency", default=None,
+        help="測定する同時実行数（カンマ区切り、既定: 1,2,4,…,CPUコア数）",
+    )
+    parser.add_argument(
+        "--short-clips", action="store_true",
+        help="数秒の短いクリップだけで測定する（プロセス起動のオーバーヘッド測定用）",
+    )
+    parser.add_argument(
+        "--presets", default=None, metavar="NAMES",
+        help=f"速度と出力サイズを測定するプリセット（カンマ区切りまたはall: {','.join(PRESETS)}）",
+    )
+    parser.add_argument(
+        "--backends", default=None, metavar="NAMES",
+        help=f"変換の速度を比べるバックエンド（カンマ区切りまたはall: {','.join(BACKENDS)}）",
+    )
+    parser.add_argument("--skip-fixtures", action="store_true", help="フィクスチャごとの測定を省略する")
+    parser.add_argument("--compare", metavar="BASELINE", help="比較する過去の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="性能低下とみなす割合（既定: 0.10）")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="フィクスチャ生成に使うffmpeg")
+    parser.add_argument("extra_args", nargs=argparse.REMAINDER, help="`--` 以降は変換コマンドに渡す")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.extra_args[:1] == ['--']:
+        args.extra_args = args.extra_args[1:]
+    levels = (
+        [int(level) for level in args.concurrency.split(',')]
+        if args.concurrency else default_levels()
+    )
+    presets = list(PRESETS) if args.presets == 'all' else (args.presets.split(',') if args.presets else [])
+    unknown = [preset for preset in presets if preset not in PRESETS]
+    if unknown:
+        print(f"不明なプリセットです: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    backends = list(BACKENDS) if args.backends == 'all' else (args.backends.split(',') if args.backends else [])
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if unknown:
+        print(f"不明なバックエンドです: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    specs = SHORT_CLIP_FIXTURES if args.short_clips else DEFAULT_FIXTURES
+    paths = ensure_fixtures(specs, args.fixture_dir, args.ffmpeg)
+
+    work_dir = tempfile.mkdtemp(prefix='mp4_to_mp3_bench-')
+    try:
+        results: Dict[str, Any] = {
+            'version': RESULTS_VERSION,
+            'meta': collect_metadata(args),
+            'fixtures': [] if args.skip_fixtures else benchmark_fixtures(
+                specs, paths, work_dir, args.extra_args
+            ),
+            'runs': benchmark_concurrency(
+                specs, paths, levels, args.copies, work_dir, args.extra_args
+            ),
+            'presets': benchmark_presets(specs, paths, presets, work_dir, args.extra_args),
+            'backends': benchmark_backends(
+                specs, paths, backends, args.copies, work_dir, args.extra_args
+            ),
+        }
+    except BenchmarkError as e:
+        # 失敗した変換の時間は速さとして記録しない
+        print(f"ベンチマークを中止しました: {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    for run in results['runs']:
+        print(
+            f"-j {run['concurrency']:3d}: {run['files_per_second']:7.2f} files/s, "
+            f"x{run['realtime_factor']:7.1f} realtime, speedup {run['speedup'] or 0:.2f}, "
+            f"peak RSS {run['peak_rss_kb']} KB"
+        )
+    for run in results['presets']:
+        print(
+            f"{run['preset']:12s}: x{run['realtime_factor']:7.1f} realtime, "
+            f"{run['kbps']:6.1f} kbps, {run['output_bytes']} bytes"
+        )
+    for run in results['backends']:
+        print(
+            f"{run['backend']:12s}: {run['files_per_second']:7.2f} files/s, "
+            f"x{run['realtime_factor']:7.1f} realtime, speedup {run['speedup'] or 0:.2f}"
+        )
+    print(f"結果を {args.output} に書き込みました")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print("性能が低下しています:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+MP4からMP3への変換エンジン
+
+GUIに依存しない変換処理をまとめたパッケージ。
+コマンドラインからは ``python -m mp4_to_mp3`` で利用できる。
+"""
+from .adaptive import AdaptiveController
+from .backends import BACKENDS, PyAVBackend, make_backend
+from .dedup import ContentFingerprint, group_same_content, materialize
+from .distributed import Coordinator, Worker
+from .engine import (
+    DEFAULT_STALL_TIMEOUT,
+    ConversionEngine,
+    ConversionEvent,
+    ConversionJob,
+    EventKind,
+    JobStatus,
+    MediaInfo,
+    ProcessTuning,
+    make_jobs,
+    output_path_for,
+    probe_audio,
+)
+from .loudness import LoudnessMeasurement, LoudnessTarget
+from .manifest import ConversionManifest
+from .metrics import BatchReport, EtaEstimator, format_eta
+from .probe_index import ProbeIndex, default_index_path
+from .profiles import DEFAULT_PROFILE, PRESETS, OutputProfile, parse_profile, preset_profile
+from .streaming import StreamConversionError, iter_mp3, stream_mp3
+from .toolchain import FfmpegCapabilities, find_binary, load_capabilities
+
+__all__ = [
+    "BACKENDS",
+    "DEFAULT_PROFILE",
+    "DEFAULT_STALL_TIMEOUT",
+    "PRESETS",
+    "AdaptiveController",
+    "BatchReport",
+    "ConversionEngine",
+    "ConversionEvent",
+    "ConversionJob",
+    "ContentFingerprint",
+    "ConversionManifest",
+    "Coordinator",
+    "EtaEstimator",
+    "EventKind",
+    "FfmpegCapabilities",
+    "JobStatus",
+    "LoudnessMeasurement",
+    "LoudnessTarget",
+    "MediaInfo",
+    "OutputProfile",
+    "ProbeIndex",
+    "PyAVBackend",
+    "ProcessTuning",
+    "StreamConversionError",
+    "Worker",
+    "default_index_path",
+    "find_binary",
+    "format_eta",
+    "group_same_content",
+    "iter_mp3",
+    "load_capabilities",
+    "make_backend",
+    "make_jobs",
+    "materialize",
+    "output_path_for",
+    "parse_profile",
+    "preset_profile",
+    "probe_audio",
+    "stream_mp3",
+]
@@ -0,0 +1,197 @@
+"""
+同時実行数の自動調整
+
+バッチの実行中に一定間隔でCPU使用率、I/O待ち、ジョブごとの実時間比（ffmpegのspeed）を
+計測し、同時に変換するジョブ数を増減する。
+
+- CPUに余裕があり、すべての枠が使われていれば1つ増やす
+- 増やしても全体の処理速度（実時間比の合計）が上がらなければ元に戻し、
+  しばらくはその数を上限にする（ディスクやネットワークが先に詰まっている）
+- I/O待ちが多い場合（遅いディスクやNASの過負荷）は1つ減らす
+
+ffmpegのスレッド数はCPUコア数を同時実行数で割った数にし、nice値とI/O優先度を下げて
+対話的に使っているユーザーの操作を妨げないようにする。
+"""
+import asyncio
+import os
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from .engine import ConversionEvent, EventKind, ProcessTuning
+from .system import SystemSample, SystemSampler
+
+if TYPE_CHECKING:
+    from .engine import ConversionEngine
+
+# 計測と調整の間隔（秒）
+DEFAULT_INTERVAL = 5.0
+
+# CPU使用率がこれ未満なら同時実行数を増やす余地がある
+CPU_TARGET = 0.90
+
+# I/O待ちの割合がこれ以上ならディスクが詰まっているとみなして減らす
+IOWAIT_HIGH = 0.20
+
+# 増やしたときにこの割合以上速くならなければ元に戻す
+MIN_GAIN = 0.05
+
+# 増やしても速くならなかった数を上限として扱う調整回数
+CEILING_CYCLES = 12
+
+# 変換するffmpegのnice値（対話的な操作を優先させる）
+DEFAULT_NICE = 10
+
+
+def _parse_speed(speed: str) -> Optional[float]:
+    """ffmpegの「12.3x」形式の実時間比を数値にする"""
+    try:
+        return float(speed.strip().rstrip('x'))
+    except ValueError:
+        return None
+
+
+class AdaptiveController:
+    """
+    同時実行数とffmpegの実行設定を実行中に調整する
+
+    engine.controllerに設定すると、バッチの実行中はエンジンのリスナーとして
+    ジョブごとの実時間比を受け取り、interval秒ごとに同時実行数を見直す。
+    """
+
+    def __init__(
+        self,
+        min_workers: int = 1,
+        max_workers: Optional[int] = None,
+        interval: float = DEFAULT_INTERVAL,
+        nice: Optional[int] = DEFAULT_NICE,
+        io_class: Optional[str] = None,
+        sampler: Optional[SystemSampler] = None
+    ):
+        self.min_workers = max(1, min_workers)
+        # 同時実行数の上限（省略時はエンジンのmax_workers）
+        self.max_workers = max_workers
+        self.interval = interval
+        self.nice = nice
+        # I/O優先度（省略時はI/O待ちの状況からジョブごとに選ぶ）
+        self.io_class = io_class
+        self.sampler = sampler or SystemSampler()
+        self.limit = self.min_workers
+        # 同時実行数の変化の記録: (time.monotonic()の値, 同時実行数)
+        self.history: List[Tuple[float, int]] = []
+        self._upper = self.min_workers
+        self._engine: Optional['ConversionEngine'] = None
+        self._running: Set[int] = set()
+        self._speeds: Dict[int, float] = {}
+        self._grown_from: Optional[Tuple[int, float]] = None
+        self._ceiling: Optional[int] = None
+        self._ceiling_cycles = 0
+        self._last_sample: Optional[SystemSample] = None
+
+    def start(self, engine: 'ConversionEngine', worker_count: int) -> int:
+        """
+        バッチの開始時にエンジンから呼ばれる
+
+        Returns:
+            int: 最初の同時実行数（CPUコア数から始める）
+        """
+        self._engine = engine
+        self._upper = max(self.min_workers, min(self.max_workers or engine.max_workers, worker_count))
+        self.limit = max(self.min_workers, min(os.cpu_count() or 1, self._upper))
+        self.history = [(time.monotonic(), self.limit)]
+        self._running.clear()
+        self._speeds.clear()
+        self._grown_from = self._ceiling = None
+        engine.add_listener(self)
+        return self.limit
+
+    def stop(self):
+        if self._engine is not None:
+            self._engine.remove_listener(self)
+            self._engine = None
+
+    def __call__(self, event: ConversionEvent):
+        job = event.job
+        if job is None:
+            return
+        if event.kind == EventKind.STARTED:
+            self._running.add(job.index)
+        elif event.kind == EventKind.PROGRESS:
+            speed = _parse_speed(event.speed)
+            if speed is not None:
+                self._speeds[job.index] = speed
+        elif event.kind == EventKind.FINISHED:
+            self._running.discard(job.index)
+            self._speeds.pop(job.index, None)
+
+    @property
+    def throughput(self) -> float:
+        """実行中のジョブの実時間比の合計（1秒あたりに処理している入力の秒数）"""
+        return sum(self._speeds.values())
+
+    async def run(self):
+        """interval秒ごとに計測して同時実行数を調整し続ける（エンジンが止める）"""
+        self.sampler.sample()
+        while True:
+            await asyncio.sleep(self.interval)
+            self.adjust(self.sampler.sample())
+
+    def adjust(self, sample: Optional[SystemSample]):
+        """計測値から同時実行数を決め、エンジンに反映する"""
+        self._last_sample = sample
+        limit = self.decide(sample, self.throughput, len(self._running))
+        if limit != self.limit:
+            self.limit = limit
+            self.history.append((time.monotonic(), limit))
+            if self._engine is not None:
+                self._engine.set_concurrency(limit)
+
+    def decide(self, sample: Optional[SystemSample], throughput: float, running: int) -> int:
+        """
+        次の同時実行数を決める
+
+        Args:
+            sample: 前回からのCPU使用率とI/O待ち（計測できなければNone）
+            throughput: 実行中のジョブの実時間比の合計
+            running: 実行中のジョブ数
+        """
+        if self._ceiling is not None:
+            self._ceiling_cycles += 1
+            if self._ceiling_cycles > CEILING_CYCLES:
+                self._ceiling = None
+        if sample is None:
+            return self.limit
+
+        if sample.iowait >= IOWAIT_HIGH:
+            # ディスクが詰まっている間は、下限に達していても増やさない
+            self._grown_from = None
+            if self.limit > self.min_workers:
+                self._set_ceiling(self.limit - 1)
+                return self.limit - 1
+            return self.limit
+
+        if self._grown_from is not None:
+            previous_limit, previous_throughput = self._grown_from
+            self._grown_from = None
+            if throughput < previous_throughput * (1 + MIN_GAIN):
+                self._set_ceiling(previous_limit)
+                return previous_limit
+
+        upper = min(self._upper, self._ceiling or self._upper)
+        if sample.cpu_busy < CPU_TARGET and running >= self.limit and self.limit < upper:
+            self._grown_from = (self.limit, throughput)
+            return self.limit + 1
+        return self.limit
+
+    def _set_ceiling(self, limit: int):
+        self._ceiling = max(self.min_workers, limit)
+        self._ceiling_cycles = 0
+
+    def tuning(self) -> ProcessTuning:
+        """これから起動するffmpegの実行設定"""
+        threads = max(1, (os.cpu_count() or 1) // max(1, self.limit))
+        io_class = self.io_class
+        if io_class is None:
+            # ディスクが混み始めたら、他のプロセスのI/Oを優先させる
+            busy_disk = self._last_sample is not None and self._last_sample.iowait >= IOWAIT_HIGH / 2
+            io_class = 'idle' if busy_disk else 'best-effort'
+        return ProcessTuning(threads, self.nice, io_class)
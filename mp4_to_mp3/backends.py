@@ -0,0 +1,216 @@
+"""
+変換の実行方式（バックエンド）
+
+既定ではエンジンがファイルごとにffprobeとffmpegを起動する。PyAVBackendを渡すと、
+PyAV（FFmpegのライブラリのPythonバインディング）で入力の解析をエンジンのプロセス内で行い、
+変換は常駐のワーカープロセスへ送る。1つのワーカーが多数のファイルを順に処理するため、
+数秒の短いクリップが大量にある場合にファイルごとのプロセスの起動がかからない。
+
+PyAVのwheelに含まれるLAMEはffmpegの配布バイナリより遅いことがあるため、既定（pyav）では
+ストリームコピー（MP3の取り出しとAACの.m4aへの抽出）だけをワーカーで行い、再エンコードは
+ffmpegに任せる。pyav-encodeでは再エンコードもワーカーで行う。
+
+PyAVはオプションの依存（pip install av）。ワーカーで扱えない変換（音量の正規化や
+分割並列エンコード、パイプでの変換）は、そのジョブだけffmpegで行う。
+"""
+import asyncio
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .engine import MediaInfo, _read_lines
+from .system import set_process_priority
+
+if TYPE_CHECKING:
+    from .engine import ConversionEngine
+
+# 選べるバックエンド（ffmpegが既定）
+BACKENDS = ('ffmpeg', 'pyav', 'pyav-encode')
+
+_WORKER_MODULE = f"{__package__}.pyav_worker"
+
+
+def pyav_available() -> bool:
+    """PyAVBackendを使えるか（PyAVがインストールされているか）"""
+    return importlib.util.find_spec('av') is not None
+
+
+def make_backend(name: str) -> Optional['PyAVBackend']:
+    """
+    名前からバックエンドを作る
+
+    Returns:
+        Optional[PyAVBackend]: ffmpegの場合None（エンジンがffmpegを起動する）
+
+    Raises:
+        ValueError: 不明な名前の場合
+        RuntimeError: PyAVがインストールされていない場合
+    """
+    if name == 'ffmpeg':
+        return None
+    if name in ('pyav', 'pyav-encode'):
+        return PyAVBackend(encode=name == 'pyav-encode')
+    raise ValueError(f"不明なバックエンドです: {name}（{', '.join(BACKENDS)}）")
+
+
+def _worker_env() -> Dict[str, str]:
+    """ワーカーがこのパッケージを読み込めるようにした環境変数"""
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    return env
+
+
+async def _stop(process: asyncio.subprocess.Process):
+    """ワーカーを強制終了し、終了を待つ"""
+    if process.returncode is None:
+        process.kill()
+        # 読まれずに残った出力を捨てないとパイプが閉じず、終了を待てない
+        await asyncio.gather(process.stdout.read(), return_exceptions=True)
+    await process.wait()
+
+
+class PyAVBackend:
+    """
+    PyAVの常駐ワーカープロセスで変換するバックエンド
+
+    ワーカーは必要になったときに起動し、ジョブが終わると次のジョブに使い回す
+    （同時に使うワーカーはエンジンのffmpegの実行枠と同じ数まで）。取り消しや
+    停止の監視で止めたワーカーは捨て、次のジョブでは新しく起動する。
+    待機中のワーカーはバッチの終了時にエンジンがclose()で終了させる。
+    """
+
+    def __init__(self, encode: bool = False):
+        """
+        Args:
+            encode: 再エンコードもワーカーで行う（既定ではストリームコピーだけを行い、
+                再エンコードはffmpegに任せる）
+        """
+        if not pyav_available():
+            raise RuntimeError("PyAVがインストールされていません（pip install av）")
+        # PyAVの読み込みには時間がかかるため、使うときまで読み込まない
+        self._pyav = importlib.import_module(_WORKER_MODULE)
+        self.encode_in_process = encode
+        self._idle: List[asyncio.subprocess.Process] = []
+
+    def supports(self, outputs: Sequence[Tuple[str, Sequence[str]]]) -> bool:
+        """すべての出力をワーカーで作るか（(出力ファイル, エンコード引数)のリスト）"""
+        return all(
+            self._pyav.supported_args(codec_args) and (self.encode_in_process or 'copy' in codec_args)
+            for _, codec_args in outputs
+        )
+
+    async def probe(self, input_file: str) -> Optional[MediaInfo]:
+        """ffprobeを起動せずに先頭の音声ストリームを調べる（probe_audioと同じ結果）"""
+        loop = asyncio.get_event_loop()
+        media = await loop.run_in_executor(None, self._pyav.probe_media, input_file)
+        return MediaInfo(*media) if media is not None else None
+
+    async def encode(
+        self,
+        engine: 'ConversionEngine',
+        input_file: str,
+        outputs: Sequence[Tuple[str, Sequence[str]]],
+        on_progress: Optional[Callable[[Dict[str, str], Optional[float]], None]] = None
+    ) -> Tuple[int, List[str]]:
+        """
+        ワーカーで変換する
+
+        Args:
+            engine: 実行設定（優先度と停止の監視）と実行中のプロセスの記録に使うエンジン
+            input_file: 入力ファイル
+            outputs: (書き出すファイル, エンコード引数)のリスト
+            on_progress: 進捗の1ブロックごとに(key=valueの辞書, None)で呼ばれる
+
+        Returns:
+            Tuple[int, List[str]]: (終了コード, エラーメッセージ)
+        """
+        process = await self._acquire(engine)
+        engine._processes.add(process.pid)
+        result: Optional[Dict[str, Any]] = None
+        advanced_at = time.monotonic()
+        stalled = False
+
+        async def read_result():
+            nonlocal result, advanced_at
+            fields: Dict[str, str] = {}
+            async for line in _read_lines(process.stdout):
+                key, _, value = line.partition('=')
+                if key == 'result':
+                    result = json.loads(value)
+                    return
+                fields[key] = value
+                if key == 'progress':
+                    advanced_at = time.monotonic()
+                    if on_progress is not None:
+                        on_progress(fields, None)
+                    fields = {}
+
+        async def watchdog(timeout: float):
+            nonlocal stalled
+            while True:
+                await asyncio.sleep(min(timeout / 4, 1.0))
+                if time.monotonic() - advanced_at > timeout:
+                    stalled = True
+                    process.kill()
+                    return
+
+        watchdog_task = (
+            asyncio.ensure_future(watchdog(engine.stall_timeout)) if engine.stall_timeout else None
+        )
+        request = {'input': input_file, 'outputs': [[output, list(args)] for output, args in outputs]}
+        try:
+            try:
+                process.stdin.write((json.dumps(request) + "\n").encode('utf-8'))
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ワーカーが終了していた（結果がないので失敗として返す）
+            else:
+                await read_result()
+        finally:
+            if watchdog_task is not None:
+                watchdog_task.cancel()
+            engine._processes.discard(process.pid)
+            if result is not None:
+                self._idle.append(process)
+            else:
+                await _stop(process)
+        if result is None:
+            if stalled:
+                return process.returncode, [f"{engine.stall_timeout:g}秒間進捗がないため中止しました"]
+            return process.returncode or 1, [f"PyAVのワーカーが終了しました（終了コード {process.returncode}）"]
+        return result['returncode'], [result['error']] if 'error' in result else []
+
+    async def _acquire(self, engine: 'ConversionEngine') -> asyncio.subprocess.Process:
+        """待機中のワーカーを取り出す（なければ起動する）"""
+        process = None
+        while self._idle and process is None:
+            candidate = self._idle.pop()
+            if candidate.returncode is None:
+                process = candidate
+            else:
+                await _stop(candidate)
+        if process is None:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', _WORKER_MODULE,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                env=_worker_env()
+            )
+        # 優先度は実行中に変わることがあるため、ジョブごとに設定し直す
+        tuning = engine.controller.tuning() if engine.controller is not None else engine.tuning
+        if tuning.nice is not None or tuning.io_class is not None:
+            set_process_priority(process.pid, tuning.nice, tuning.io_class)
+        return process
+
+    async def close(self):
+        """待機中のワーカーを終了させる（標準入力を閉じると終了する）"""
+        idle, self._idle = self._idle, []
+        for process in idle:
+            process.stdin.close()
+        await asyncio.gather(*(process.wait() for process in idle))
@@ -0,0 +1,527 @@
+"""
+コマンドラインインターフェース
+
+使用例:
+    python -m mp4_to_mp3 videos/ "lectures/**/*.mp4" extra.mp4 -o out/
+"""
+import argparse
+import asyncio
+import glob
+import os
+import signal
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+from .adaptive import DEFAULT_NICE, AdaptiveController
+from .backends import BACKENDS, make_backend, pyav_available
+from .dedup import LINK_METHODS
+from .distributed import DEFAULT_LEASE_SECONDS, Coordinator, Worker
+from .engine import (
+    DEFAULT_STALL_TIMEOUT,
+    INPUT_EXTENSIONS,
+    ConversionEngine,
+    ConversionJob,
+    JobStatus,
+    ProcessTuning,
+    output_path_for,
+)
+from .loudness import DEFAULT_LRA, DEFAULT_TRUE_PEAK, LoudnessTarget
+from .manifest import ConversionManifest
+from .metrics import BatchReport, EtaEstimator, format_eta
+from .probe_index import ProbeIndex, default_index_path
+from .profiles import PRESETS, parse_profile, preset_profile, validate_profiles
+from .streaming import StreamConversionError, iter_mp3
+from .system import IO_CLASSES
+from .toolchain import find_binary
+from .watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, FolderWatcher, watch_and_convert
+
+_GLOB_CHARS = set('*?[')
+
+
+def expand_inputs(
+    patterns: Sequence[str],
+    extensions: Sequence[str] = INPUT_EXTENSIONS
+) -> List[Tuple[str, str]]:
+    """
+    ファイル・ディレクトリ・globパターンを入力ファイルの一覧に展開する
+
+    ディレクトリは再帰的に探索し、出力先でも同じ構成を保てるよう
+    ディレクトリからの相対パスを一緒に返す。同じファイルは1度だけ含める。
+
+    Returns:
+        List[Tuple[str, str]]: (入力ファイル, 出力先のサブディレクトリ)のリスト
+    """
+    found: List[Tuple[str, str]] = []
+    seen = set()
+
+    def add(path: str, subdir: str = ""):
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            found.append((path, subdir))
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                subdir = os.path.relpath(dirpath, pattern)
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(tuple(extensions)):
+                        add(os.path.join(dirpath, filename), "" if subdir == "." else subdir)
+        elif _GLOB_CHARS & set(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    add(path)
+        else:
+            add(pattern)
+    return found
+
+
+def _profile_arg(spec: str):
+    try:
+        return parse_profile(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m mp4_to_mp3",
+        description="MP4ファイルをMP3に一括変換します。",
+    )
+    parser.add_argument(
+        "inputs", nargs="*",
+        help="入力ファイル、ディレクトリ（再帰的に探索）、またはglobパターン（-は標準入力。-o -と組み合わせる）",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default=None,
+        help="出力ディレクトリ（--worker以外では必須）。-を指定すると入力1つを変換して標準出力へ書き出す",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="同時に実行する変換数（既定: CPUコア数）",
+    )
+    parser.add_argument(
+        "--ffmpeg", default=None, metavar="PATH",
+        help="使用するffmpeg（既定: 環境変数MP4_TO_MP3_FFMPEG、同梱のffmpeg、PATHの順に探す）",
+    )
+    parser.add_argument(
+        "--ffprobe", default=None, metavar="PATH",
+        help="使用するffprobe（既定: 環境変数MP4_TO_MP3_FFPROBE、同梱のffprobe、PATHの順に探す）",
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true",
+        help="CPU使用率とI/O待ちを見ながら同時実行数を自動で増減する（-jは上限。既定: CPUコア数の2倍）",
+    )
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default='ffmpeg',
+        help="変換の方式（pyavは入力の解析とストリームコピーをPyAVで行い、ファイルごとにffprobe・ffmpegを"
+             "起動しない。pyav-encodeは再エンコードもPyAVで行う。PyAVが必要。既定: ffmpeg）",
+    )
+    parser.add_argument(
+        "--ffmpeg-threads", type=int, default=None, metavar="N",
+        help="ffmpeg 1プロセスあたりのスレッド数（--adaptiveでは同時実行数から自動で決める）",
+    )
+    parser.add_argument(
+        "--nice", type=int, default=None, metavar="N",
+        help=f"ffmpegのnice値（--adaptiveの既定: {DEFAULT_NICE}）",
+    )
+    parser.add_argument(
+        "--ionice", choices=sorted(IO_CLASSES), default=None,
+        help="ffmpegのI/O優先度（Linuxのみ。--adaptiveの既定: ディスクの混み具合で選ぶ）",
+    )
+    parser.add_argument(
+        "--stall-timeout", type=float, default=DEFAULT_STALL_TIMEOUT, metavar="SECONDS",
+        help=f"進捗がこの秒数進まないffmpegを止めて失敗にする（0で無効。既定: {DEFAULT_STALL_TIMEOUT:g}）",
+    )
+    parser.add_argument(
+        "--aac-passthrough", action="store_true",
+        help="AAC音声を再エンコードせずに .m4a として抽出する",
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="変換記録を無視してすべて再変換する",
+    )
+    parser.add_argument(
+        "--hash-inputs", action="store_true",
+        help="変換記録に入力ファイルの内容ハッシュも残す",
+    )
+    parser.add_argument(
+        "--dedup", action="store_true",
+        help="同じ内容の入力は1度だけ変換し、ほかの出力はリンクで作る（以前の変換結果も使う）",
+    )
+    parser.add_argument(
+        "--link-method", choices=LINK_METHODS, default='hardlink',
+        help="--dedupで出力を作る方法（できなければ後ろの方法を使う。既定: hardlink）",
+    )
+    parser.add_argument(
+        "--preset", choices=list(PRESETS), default=None,
+        help="エンコード設定のプリセット（speechはモノラル・24kHzのVBRで講義や会議向け。既定: default）",
+    )
+    parser.add_argument(
+        "--profile", dest="profiles", action="append", type=_profile_arg, metavar="SPEC",
+        help="出力プロファイル「名前[,preset=speech][,bitrate=64k][,quality=0-9][,compression_level=0-9]"
+             "[,channels=mono][,sample_rate=44100][,template={stem}_{name}.mp3]」。"
+             "複数指定すると1回のデコードでまとめて出力する",
+    )
+    parser.add_argument(
+        "--loudnorm", type=float, default=None, metavar="LUFS",
+        help="出力の音量をこのラウドネスにそろえる（例: -16。入力を解析してから変換し、解析結果はprobe indexと出力先の変換記録に残す）",
+    )
+    parser.add_argument(
+        "--true-peak", type=float, default=DEFAULT_TRUE_PEAK, metavar="DBTP",
+        help=f"--loudnormのトゥルーピークの上限（既定: {DEFAULT_TRUE_PEAK:g}）",
+    )
+    parser.add_argument(
+        "--loudness-range", type=float, default=DEFAULT_LRA, metavar="LU",
+        help=f"--loudnormのラウドネスレンジの目標（既定: {DEFAULT_LRA:g}）",
+    )
+    parser.add_argument(
+        "--loudnorm-single-pass", action="store_true",
+        help="--loudnormで解析をせず1パスで動的に調整する（入力を1度しか読まないが、音の強弱が平らになる）",
+    )
+    parser.add_argument(
+        "--split-threshold", type=float, default=None, metavar="SECONDS",
+        help="これより長い入力は区間に分けて並列にエンコードする",
+    )
+    parser.add_argument(
+        "--segments", type=int, default=None,
+        help="分割時の区間数の上限（既定: 同時実行数）",
+    )
+    parser.add_argument(
+        "--prune-manifest", action="store_true",
+        help="出力ディレクトリの変換記録から古い記録を削除して終了する",
+    )
+    parser.add_argument(
+        "--probe-index", default=None, metavar="PATH",
+        help="ffprobeの結果をキャッシュするSQLiteファイル（既定: ユーザーのキャッシュディレクトリ）",
+    )
+    parser.add_argument(
+        "--no-probe-index", action="store_true",
+        help="ffprobeの結果をキャッシュしない",
+    )
+    parser.add_argument(
+        "--input-order", action="store_true",
+        help="長い入力から順に実行せず、指定した順に変換する",
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="入力ディレクトリを監視し、新しいファイルを変換し続ける（Ctrl+Cで終了）",
+    )
+    parser.add_argument(
+        "--settle-seconds", type=float, default=DEFAULT_SETTLE_SECONDS, metavar="SECONDS",
+        help=f"監視時、サイズと更新時刻がこの秒数変わらなければ書き込み完了とみなす（既定: {DEFAULT_SETTLE_SECONDS:g}）",
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, metavar="SECONDS",
+        help=f"inotifyが使えない場合の再走査の間隔（既定: {DEFAULT_POLL_INTERVAL:g}）",
+    )
+    parser.add_argument(
+        "--no-inotify", action="store_true",
+        help="監視にinotifyを使わず、定期的な再走査だけで検出する",
+    )
+    parser.add_argument(
+        "--coordinator", default=None, metavar="[HOST:]PORT",
+        help="ワーカーへジョブを貸し出すコーディネーターとして待ち受ける（既定のHOSTは127.0.0.1）",
+    )
+    parser.add_argument(
+        "--transfer", action="store_true",
+        help="コーディネーター時、共有ストレージを使わずに入出力をHTTPでワーカーと送受信する",
+    )
+    parser.add_argument(
+        "--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, metavar="SECONDS",
+        help=f"ワーカーからの応答がこの秒数途絶えたジョブを貸し出し直す（既定: {DEFAULT_LEASE_SECONDS:g}）",
+    )
+    parser.add_argument(
+        "--worker", default=None, metavar="URL",
+        help="コーディネーター（http://HOST:PORT）からジョブを借りて変換するワーカーとして動く（-jで並行数）",
+    )
+    parser.add_argument(
+        "--no-report", action="store_true",
+        help="出力ディレクトリに実行レポート（JSON/CSV）を書き込まない",
+    )
+    parser.add_argument(
+        "--prometheus-textfile", default=None, metavar="PATH",
+        help="node-exporterのtextfile collector用のメトリクスを書き込むファイル（.prom）",
+    )
+    return parser
+
+
+def prune_manifest(output_dir: str) -> int:
+    """出力ディレクトリの変換記録から古い記録を削除する"""
+    manifest = ConversionManifest.load(output_dir)
+    removed = manifest.prune()
+    manifest.save()
+    for input_file in removed:
+        print(f"削除: {input_file}")
+    print(f"{len(removed)}件の古い記録を削除しました（残り{len(manifest.entries)}件）")
+    return 0
+
+
+async def _convert(
+    engine: ConversionEngine,
+    jobs: List[ConversionJob],
+    report: Optional[BatchReport] = None,
+    coordinator: Optional[Coordinator] = None
+) -> int:
+    failed = 0
+    completed = 0
+    eta = EtaEstimator(jobs)
+    engine.add_listener(eta)
+    if report is not None:
+        engine.add_listener(report)
+        report.start()
+    loop = asyncio.get_event_loop()
+    try:
+        # SIGTERMでは実行中のffmpegを止めて書きかけの出力を消し、レポートを書いてから終わる
+        # （コーディネーターは未完了のジョブを取り消し、ワーカーへの貸し出しをやめる）
+        loop.add_signal_handler(signal.SIGTERM, coordinator.cancel if coordinator else engine.cancel)
+    except NotImplementedError:
+        pass
+    results = coordinator.iter_results() if coordinator else engine.iter_results(jobs)
+    async for job in results:
+        completed += 1
+        name = os.path.basename(job.input_file)
+        remaining = format_eta(eta.remaining_seconds())
+        if job.success:
+            suffix = f"（残り約 {remaining}）" if remaining and completed < len(jobs) else ""
+            if job.duplicate_of:
+                suffix = f"（{os.path.basename(job.duplicate_of)} と同じ内容）{suffix}"
+            print(f"✓ {name}{suffix}", flush=True)
+        else:
+            failed += 1
+            print(f"✗ {name}: {job.error_message}", file=sys.stderr, flush=True)
+    try:
+        loop.remove_signal_handler(signal.SIGTERM)
+    except NotImplementedError:
+        pass
+    if report is not None:
+        report.finish()
+    print(f"変換完了: {len(jobs) - failed}/{len(jobs)} ファイル")
+    return 1 if failed else 0
+
+
+async def _watch(engine: ConversionEngine, watcher: FolderWatcher, output_dir: str) -> int:
+    loop = asyncio.get_event_loop()
+    task = asyncio.current_task()
+
+    def stop():
+        # 実行中のffmpegを止めて書きかけの出力を消してから、監視を終える
+        engine.cancel()
+        task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop)
+    except NotImplementedError:
+        pass
+    results = watch_and_convert(engine, watcher, output_dir)
+    try:
+        async for job in results:
+            if job.status in (JobStatus.SKIPPED, JobStatus.CANCELLED):
+                continue
+            name = os.path.basename(job.input_file)
+            if job.success:
+                print(f"✓ {name}", flush=True)
+            else:
+                print(f"✗ {name}: {job.error_message}", file=sys.stderr, flush=True)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await results.aclose()
+    return 0
+
+
+def watch(args: argparse.Namespace, parser: argparse.ArgumentParser) -> int:
+    """入力ディレクトリを監視して変換し続ける"""
+    not_directories = [path for path in args.inputs if not os.path.isdir(path)]
+    if not_directories:
+        parser.error(f"--watch にはディレクトリを指定してください: {', '.join(not_directories)}")
+    engine = _engine_for(args)
+    watcher = FolderWatcher(
+        args.inputs,
+        settle_seconds=args.settle_seconds,
+        poll_interval=args.poll_interval,
+        use_inotify=not args.no_inotify,
+    )
+    print(f"監視中: {', '.join(args.inputs)}（Ctrl+Cで終了）", flush=True)
+    try:
+        return asyncio.run(_watch(engine, watcher, args.output_dir))
+    except KeyboardInterrupt:
+        return 0
+
+
+def _open_probe_index(args: argparse.Namespace) -> Optional[ProbeIndex]:
+    if args.no_probe_index:
+        return None
+    path = args.probe_index or default_index_path()
+    try:
+        return ProbeIndex(path)
+    except Exception as e:
+        print(f"ffprobeのキャッシュを開けません（{path}）: {e}", file=sys.stderr)
+        return None
+
+
+def _engine_for(args: argparse.Namespace) -> ConversionEngine:
+    max_workers = args.jobs
+    if args.adaptive and max_workers is None:
+        max_workers = 2 * (os.cpu_count() or 1)
+    engine = ConversionEngine(
+        max_workers=max_workers,
+        aac_passthrough=args.aac_passthrough,
+        force=args.force,
+        hash_inputs=args.hash_inputs,
+        manifest_dir=args.output_dir,
+        split_threshold=args.split_threshold,
+        segments=args.segments,
+        probe_index=_open_probe_index(args),
+        longest_first=not args.input_order,
+        profiles=args.profiles,
+        **_binaries(args),
+        ffmpeg_threads=args.ffmpeg_threads,
+        nice=args.nice,
+        io_priority=args.ionice,
+        dedup=args.dedup,
+        link_method=args.link_method,
+        stall_timeout=args.stall_timeout or None,
+        loudness=_loudness_target(args),
+        backend=make_backend(args.backend),
+    )
+    if args.adaptive:
+        engine.controller = AdaptiveController(
+            nice=DEFAULT_NICE if args.nice is None else args.nice,
+            io_class=args.ionice,
+        )
+    return engine
+
+
+def _loudness_target(args: argparse.Namespace) -> Optional[LoudnessTarget]:
+    if args.loudnorm is None:
+        return None
+    return LoudnessTarget(args.loudnorm, args.true_peak, args.loudness_range, args.loudnorm_single_pass)
+
+
+def _binaries(args: argparse.Namespace) -> dict:
+    return {
+        'ffmpeg_path': find_binary('ffmpeg', args.ffmpeg) or args.ffmpeg or 'ffmpeg',
+        'ffprobe_path': find_binary('ffprobe', args.ffprobe) or args.ffprobe or 'ffprobe',
+    }
+
+
+def _parse_listen_address(value: str) -> Tuple[str, int]:
+    """「[HOST:]PORT」を(HOST, PORT)に分ける"""
+    host, _, port = value.rpartition(':')
+    return host or "127.0.0.1", int(port)
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    """コーディネーターからジョブを借りて変換する"""
+    worker = Worker(
+        args.worker,
+        slots=args.jobs or os.cpu_count() or 1,
+        tuning=ProcessTuning(args.ffmpeg_threads, args.nice, args.ionice),
+        **_binaries(args),
+    )
+    print(f"ワーカー {worker.name}: {args.worker} からジョブを受け取ります（並行数 {worker.slots}）", flush=True)
+    try:
+        count = asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        return 0
+    print(f"{count}件のジョブを変換しました")
+    return 0
+
+
+def run_stream(args: argparse.Namespace, parser: argparse.ArgumentParser) -> int:
+    """入力1つ（-なら標準入力）を一時ファイルを使わずに変換し、MP3を標準出力へ書き出す"""
+    if len(args.inputs) != 1:
+        parser.error("-o - では入力を1つだけ指定してください")
+    if args.profiles and len(args.profiles) > 1:
+        parser.error("-o - ではプロファイルを1つだけ指定できます")
+    source = sys.stdin.buffer if args.inputs[0] == '-' else args.inputs[0]
+    engine = ConversionEngine(
+        use_manifest=False,
+        profiles=args.profiles,
+        **_binaries(args),
+        ffmpeg_threads=args.ffmpeg_threads,
+        nice=args.nice,
+        io_priority=args.ionice,
+        loudness=_loudness_target(args),
+    )
+    output = sys.stdout.buffer
+    try:
+        for chunk in iter_mp3(source, engine=engine):
+            output.write(chunk)
+        output.flush()
+    except StreamConversionError as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        return 1
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.preset:
+        if args.profiles:
+            parser.error("--preset と --profile は同時に指定できません（--profile では preset=名前 を使ってください）")
+        args.profiles = [preset_profile(args.preset)]
+    if args.backend != 'ffmpeg' and not pyav_available():
+        parser.error(f"--backend {args.backend} にはPyAVが必要です（pip install av）")
+    if args.worker:
+        return run_worker(args)
+    if args.output_dir == '-':
+        return run_stream(args, parser)
+    if args.output_dir is None:
+        parser.error("出力ディレクトリ（-o/--output-dir）を指定してください")
+    if '-' in args.inputs:
+        parser.error("標準入力（-）から変換する場合は -o - を指定してください")
+    if args.prune_manifest:
+        return prune_manifest(args.output_dir)
+
+    if not args.inputs:
+        parser.error("入力ファイルを指定してください")
+    if args.profiles:
+        try:
+            validate_profiles(args.profiles)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.watch:
+        return watch(args, parser)
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("変換対象のファイルが見つかりません", file=sys.stderr)
+        return 1
+
+    engine = _engine_for(args)
+    interrupted = engine.manifest_for(args.output_dir).interrupted
+    if interrupted and not args.force:
+        print(f"前回中断した変換が{len(interrupted)}件あります。終わっていないファイルだけを変換します")
+    jobs = [
+        ConversionJob(input_file, output_path_for(input_file, args.output_dir, subdir=subdir), index)
+        for index, (input_file, subdir) in enumerate(inputs)
+    ]
+    report = None if args.no_report and not args.prometheus_textfile else BatchReport()
+    coordinator = None
+    if args.coordinator:
+        try:
+            host, port = _parse_listen_address(args.coordinator)
+        except ValueError:
+            parser.error(f"--coordinator は [HOST:]PORT の形式で指定してください: {args.coordinator}")
+        coordinator = Coordinator(engine, jobs, lease_seconds=args.lease_seconds, transfer=args.transfer)
+        coordinator.start(host, port)
+        print(f"{coordinator.url} でワーカーを待っています", flush=True)
+    try:
+        status = asyncio.run(_convert(engine, jobs, report, coordinator))
+    except KeyboardInterrupt:
+        # 実行中のffmpegは取り消しで終了させ、書きかけの出力も削除済み
+        print("中断しました", file=sys.stderr)
+        return 130
+    if report is not None:
+        if not args.no_report:
+            os.makedirs(args.output_dir, exist_ok=True)
+            report.write_reports(args.output_dir)
+        if args.prometheus_textfile:
+            report.write_prometheus(args.prometheus_textfile)
+    return status
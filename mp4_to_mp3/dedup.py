@@ -0,0 +1,153 @@
+"""
+同じ内容の入力の検出と、変換結果の使い回し
+
+入力の同一性は安い順に段階的に確かめる。
+
+1. サイズ
+2. 先頭から末尾まで均等な位置から抜き出したブロックのハッシュ（manifest.sample_digest）
+3. サイズと抜き出しのハッシュが一致したものだけ、ファイル全体のSHA-256
+
+同じ内容の入力は1度だけエンコードし、ほかの出力はハードリンク（できなければ
+reflink、それもできなければコピー）で作る。
+"""
+import os
+import shutil
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .journal import replace_durably
+from .manifest import file_sha256, sample_digest
+
+# 出力を作る方法（指定した方法から順に試す）
+LINK_METHODS = ('hardlink', 'reflink', 'copy')
+
+# LinuxのFICLONE ioctl（btrfs、XFSなどでブロックを共有するコピーを作る）
+_FICLONE = 0x40049409
+
+
+class ContentFingerprint:
+    """
+    1つのファイルの内容の指紋
+
+    抜き出しのハッシュと全体のハッシュは、初めて参照したときに計算する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._sample: Optional[str] = None
+        self._sha256: Optional[str] = None
+
+    @property
+    def sample(self) -> str:
+        if self._sample is None:
+            self._sample = sample_digest(self.path, self.size)
+        return self._sample
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = file_sha256(self.path)
+        return self._sha256
+
+    @property
+    def known_sha256(self) -> Optional[str]:
+        """計算済みの場合だけ全体のハッシュを返す"""
+        return self._sha256
+
+
+def _split(groups: List[List[int]], key: Callable[[int], Optional[str]]) -> List[List[int]]:
+    """各グループをkeyの値で分け、2つ以上残ったものだけを返す（keyがNoneのものは除く）"""
+    refined = []
+    for group in groups:
+        buckets: Dict[str, List[int]] = {}
+        for index in group:
+            value = key(index)
+            if value is not None:
+                buckets.setdefault(value, []).append(index)
+        refined.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+    return refined
+
+
+def group_same_content(paths: Sequence[str]) -> List[List[int]]:
+    """
+    内容が同じ入力をまとめる
+
+    読めないファイルはどのグループにも入れない。
+
+    Returns:
+        List[List[int]]: 同じ内容の入力のpathsでの位置（2つ以上のグループのみ、それぞれ昇順）
+    """
+    fingerprints: Dict[int, ContentFingerprint] = {}
+    for index, path in enumerate(paths):
+        try:
+            fingerprints[index] = ContentFingerprint(path)
+        except OSError:
+            continue
+
+    def digest(attribute: str) -> Callable[[int], Optional[str]]:
+        def key(index: int) -> Optional[str]:
+            try:
+                return getattr(fingerprints[index], attribute)
+            except OSError:
+                return None
+        return key
+
+    groups = _split([sorted(fingerprints)], lambda index: str(fingerprints[index].size))
+    groups = _split(groups, digest('sample'))
+    groups = _split(groups, digest('sha256'))
+    return sorted(groups)
+
+
+def _reflink(source: str, destination: str):
+    if fcntl is None:
+        raise OSError("reflinkはこの環境では使えません")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def materialize(source: str, destination: str, method: str = 'hardlink') -> str:
+    """
+    sourceと同じ内容のファイルをdestinationに作る
+
+    methodから順にLINK_METHODSの方法を試す。一時ファイルに作ってから置き換えるため、
+    途中で失敗してもdestinationが中途半端な内容になることはない。
+
+    Args:
+        source: 変換済みのファイル
+        destination: 作るファイル（既にあれば置き換える）
+        method: 最初に試す方法（'hardlink'、'reflink'、'copy'）
+
+    Returns:
+        str: 実際に使った方法
+
+    Raises:
+        OSError: コピーもできなかった場合
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        # 前回作ったリンクがそのまま残っている（同じファイルへのrenameは何もしない）
+        return 'hardlink'
+    directory, name = os.path.split(os.path.abspath(destination))
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.link")
+    for candidate in LINK_METHODS[LINK_METHODS.index(method):]:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            if candidate == 'hardlink':
+                os.link(source, temp_path)
+            elif candidate == 'reflink':
+                _reflink(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+        except OSError:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            if candidate == LINK_METHODS[-1]:
+                raise
+            continue
+        replace_durably(temp_path, destination)
+        return candidate
@@ -0,0 +1,761 @@
+"""
+複数のワーカーノードによる分散変換
+
+コーディネーターはバッチのジョブを保持し、HTTP（JSON）でワーカーへ貸し出す。
+ワーカーは変換中にリースを延長し続け、延長が途絶えたジョブは別のワーカーへ
+貸し出し直される。入出力は共有ストレージ上の同じパスを使うか（既定）、
+transferを有効にしてコーディネーターとの間でファイルの内容を送受信する。
+
+エンドポイント:
+    POST /lease                       ジョブを1件借りる（200）。空きなし（204）、全件完了（410）
+    POST /renew                       リースを延長し、進捗を報告する（期限切れは409）
+    POST /complete                    結果を報告する
+    GET  /jobs/<番号>/input            入力ファイルの内容（transfer時）
+    PUT  /jobs/<番号>/outputs/<名前>    出力ファイルの内容（transfer時）
+
+認証はないため、信頼できるネットワーク内でのみ使うこと。
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+from .engine import (
+    CANCELLED_MESSAGE,
+    ConversionEngine,
+    ConversionEvent,
+    ConversionJob,
+    EventKind,
+    JobStatus,
+    MediaInfo,
+    ProcessTuning,
+    order_longest_first,
+    partial_path_for,
+)
+from .journal import replace_durably
+from .loudness import LoudnessTarget
+from .profiles import OutputProfile
+
+DEFAULT_PORT = 8765
+
+# ワーカーが延長しないままこの秒数が過ぎたリースは失効し、別のワーカーへ貸し出される
+DEFAULT_LEASE_SECONDS = 30.0
+
+# 1つのジョブを貸し出す回数の上限（リースの失効や転送の失敗で再試行される）
+DEFAULT_MAX_ATTEMPTS = 3
+
+# ファイルの送受信の単位
+_CHUNK_SIZE = 1024 * 1024
+
+_Response = Tuple[int, Optional[Dict[str, Any]]]
+
+
+class _Lease(NamedTuple):
+    worker: str
+    attempt: int
+    deadline: float
+
+
+def engine_settings(engine: ConversionEngine) -> Dict[str, Any]:
+    """ワーカーが同じ設定で変換するためのエンジンの設定"""
+    return {
+        'aac_passthrough': engine.aac_passthrough,
+        'split_threshold': engine.split_threshold,
+        'segments': engine.segments,
+        'profiles': [profile._asdict() for profile in engine.profiles],
+        'stall_timeout': engine.stall_timeout,
+        'loudness': engine.loudness._asdict() if engine.loudness is not None else None,
+    }
+
+
+def _job_result(job: ConversionJob) -> Dict[str, Any]:
+    return {
+        'status': job.status,
+        'error_message': job.error_message,
+        'returncode': job.returncode,
+        'stderr_tail': job.stderr_tail,
+        'timings': job.timings,
+        'output_size': job.output_size,
+    }
+
+
+def _is_plain_filename(name: str) -> bool:
+    """ディレクトリを含まない通常のファイル名か（隠しファイルも不可）"""
+    return bool(name) and os.path.basename(name) == name and not name.startswith('.')
+
+
+class Coordinator:
+    """
+    バッチのジョブをワーカーへ貸し出すコーディネーター
+
+    変換記録の照合と記録、イベントの通知はコーディネーター側のエンジンで行うため、
+    BatchReportやEtaEstimatorは単体で実行する場合と同じように使える
+    （ワーカーからの進捗はリースの延長ごとに届く）。
+    """
+
+    def __init__(
+        self,
+        engine: ConversionEngine,
+        jobs: List[ConversionJob],
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        transfer: bool = False
+    ):
+        self.engine = engine
+        self.jobs = list(jobs)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # 入出力を共有ストレージではなくHTTPで送受信する
+        self.transfer = transfer
+        self._jobs: Dict[int, ConversionJob] = {job.index: job for job in self.jobs}
+        if len(self._jobs) != len(self.jobs):
+            raise ValueError("ジョブの番号が重複しています")
+        self._pending: deque = deque()
+        self._leases: Dict[int, _Lease] = {}
+        self._attempts: Dict[int, int] = {}
+        self._unfinished: set = set()
+        self._ready = False
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._results: Optional[asyncio.Queue] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """待ち受けているアドレス（ポート0で起動した場合は割り当てられたポート）"""
+        if self._server is None:
+            raise RuntimeError("コーディネーターが起動していません")
+        host, port = self._server.server_address[:2]
+        return host, port
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        """HTTPサーバーを別スレッドで起動する"""
+        handler = type('Handler', (_CoordinatorHandler,), {'coordinator': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def cancel(self):
+        """
+        終わっていないジョブをすべて取り消し、HTTPサーバーを止める
+
+        取り消したジョブはJobStatus.CANCELLEDとしてiter_resultsから返り、iter_resultsは
+        その後に終わる。実行中のワーカーはコーディネーターに接続できなくなって終了する。
+        イベントループのスレッドから呼ぶこと。
+        """
+        with self._lock:
+            self._cancelled = True
+            cancelled = [self._jobs[index] for index in sorted(self._unfinished)]
+            self._unfinished.clear()
+            self._pending.clear()
+            self._leases.clear()
+        self.stop()
+        for job in cancelled:
+            self._cancel_job(job)
+
+    def _cancel_job(self, job: ConversionJob):
+        if job.status == JobStatus.PENDING:
+            # 貸し出し前のジョブもエンジンで取り消した場合と同じく開始と終了を通知する
+            job.started_at = time.monotonic()
+            self._notify(ConversionEvent(EventKind.STARTED, job))
+        else:
+            manifest = self._manifest(job)
+            if manifest is not None:
+                manifest.mark(job.input_file, 'cancelled')
+        job.status = JobStatus.CANCELLED
+        job.error_message = CANCELLED_MESSAGE
+        self._finish(job)
+
+    async def iter_results(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT
+    ) -> AsyncIterator[ConversionJob]:
+        """
+        ワーカーへジョブを貸し出し、完了したジョブを完了順に返す
+
+        入力の解析と変換記録の照合はコーディネーターで行い、
+        変換済みのジョブはワーカーへ渡さずにSKIPPEDとして返す。
+
+        Yields:
+            ConversionJob: 完了したジョブ
+        """
+        self._loop = asyncio.get_running_loop()
+        self._results = asyncio.Queue()
+        if self._server is None:
+            self.start(host, port)
+        try:
+            await self.engine.probe_jobs(self.jobs)
+            ordered = order_longest_first(self.jobs) if self.engine.longest_first else self.jobs
+            params = self.engine.encoding_params()
+            queued_at = time.monotonic()
+            for job in ordered:
+                job.queued_at = queued_at
+                if self._cancelled:
+                    # 入力の解析中に取り消された
+                    self._cancel_job(job)
+                elif not self._skip_converted(job, params):
+                    with self._lock:
+                        self._pending.append(job.index)
+                        self._unfinished.add(job.index)
+            with self._lock:
+                self._ready = True
+
+            for _ in self.jobs:
+                while True:
+                    try:
+                        job = await asyncio.wait_for(self._results.get(), timeout=1.0)
+                        break
+                    except asyncio.TimeoutError:
+                        # ワーカーがすべて止まっても失効したリースを片付ける
+                        with self._lock:
+                            self._expire_leases(time.monotonic())
+                yield job
+        finally:
+            self.stop()
+            self.engine.save_manifests()
+
+    async def run(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> List[ConversionJob]:
+        """すべてのジョブが終わるまで貸し出し、入力順に返す"""
+        async for _ in self.iter_results(host, port):
+            pass
+        return list(self.jobs)
+
+    def _manifest(self, job: ConversionJob):
+        if not self.engine.use_manifest:
+            return None
+        output_dir = os.path.dirname(job.output_file) or '.'
+        return self.engine.manifest_for(self.engine.manifest_dir or output_dir)
+
+    def _skip_converted(self, job: ConversionJob, params: Dict[str, Any]) -> bool:
+        manifest = self._manifest(job)
+        if manifest is None or self.engine.force:
+            return False
+        existing = manifest.lookup(job.input_file, params)
+        if not existing:
+            return False
+        job.started_at = job.finished_at = time.monotonic()
+        job.output_file = existing
+        job.extra_outputs = manifest.extra_outputs(job.input_file)
+        job.status = JobStatus.SKIPPED
+        self.engine._emit(ConversionEvent(EventKind.STARTED, job))
+        self.engine._emit(ConversionEvent(EventKind.SKIPPED, job, message="変換済みのためスキップ"))
+        self.engine._emit(ConversionEvent(EventKind.FINISHED, job))
+        self._results.put_nowait(job)
+        return True
+
+    def _notify(self, event: ConversionEvent):
+        """イベントループのスレッドでリスナーへ通知する"""
+        self._loop.call_soon_threadsafe(self.engine._emit, event)
+
+    def _finish(self, job: ConversionJob):
+        job.finished_at = time.monotonic()
+        self._notify(ConversionEvent(EventKind.FINISHED, job))
+        self._loop.call_soon_threadsafe(self._results.put_nowait, job)
+
+    def _expire_leases(self, now: float):
+        """失効したリースのジョブを貸し出し直す（ロックを取って呼ぶ）"""
+        for index, lease in list(self._leases.items()):
+            if lease.deadline >= now:
+                continue
+            del self._leases[index]
+            if self._attempts[index] >= self.max_attempts:
+                job = self._jobs[index]
+                self._unfinished.discard(index)
+                job.status = JobStatus.FAILED
+                job.error_message = f"ワーカーからの応答が途絶えました（{self._attempts[index]}回）"
+                manifest = self._manifest(job)
+                if manifest is not None:
+                    manifest.mark(job.input_file, 'failed', job.error_message)
+                self._finish(job)
+            else:
+                self._pending.appendleft(index)
+
+    def _check_lease(self, index: int, worker: str, attempt: int) -> Optional[ConversionJob]:
+        """有効なリースを持つワーカーからの要求ならジョブを返す（ロックを取って呼ぶ）"""
+        lease = self._leases.get(index)
+        if lease is None or lease.worker != worker or lease.attempt != attempt:
+            return None
+        return self._jobs[index]
+
+    def lease(self, request: Dict[str, Any]) -> _Response:
+        worker = str(request.get('worker', ''))
+        now = time.monotonic()
+        with self._lock:
+            if not self._ready:
+                return HTTPStatus.NO_CONTENT, None
+            self._expire_leases(now)
+            if not self._pending:
+                return (HTTPStatus.NO_CONTENT if self._unfinished else HTTPStatus.GONE), None
+            index = self._pending.popleft()
+            attempt = self._attempts.get(index, 0) + 1
+            self._attempts[index] = attempt
+            self._leases[index] = _Lease(worker, attempt, now + self.lease_seconds)
+            job = self._jobs[index]
+            if attempt == 1:
+                job.status = JobStatus.RUNNING
+                job.started_at = now
+                job.timings['queue_wait'] = now - job.queued_at
+                self._notify(ConversionEvent(EventKind.STARTED, job))
+        if attempt == 1:
+            os.makedirs(os.path.dirname(job.output_file) or '.', exist_ok=True)
+            manifest = self._manifest(job)
+            if manifest is not None:
+                manifest.mark(job.input_file, 'started')
+        return HTTPStatus.OK, {
+            'index': index,
+            'attempt': attempt,
+            'input_file': job.input_file,
+            'output_file': job.output_file,
+            'media': list(job.media) if job.media else None,
+            'settings': engine_settings(self.engine),
+            'transfer': self.transfer,
+            'lease_seconds': self.lease_seconds,
+        }
+
+    def renew(self, request: Dict[str, Any]) -> _Response:
+        with self._lock:
+            job = self._check_lease(request.get('index'), request.get('worker'), request.get('attempt'))
+            if job is None:
+                return HTTPStatus.CONFLICT, None
+            self._leases[job.index] = self._leases[job.index]._replace(
+                deadline=time.monotonic() + self.lease_seconds
+            )
+        if request.get('fraction') is not None:
+            self._notify(ConversionEvent(
+                EventKind.PROGRESS, job, fraction=request['fraction'], speed=request.get('speed', '')
+            ))
+        return HTTPStatus.OK, {}
+
+    def complete(self, request: Dict[str, Any]) -> _Response:
+        index = request.get('index')
+        with self._lock:
+            job = self._jobs.get(index)
+            # 貸し出し直した後に届いた古い試行の結果は受け付けない
+            if job is None or index not in self._unfinished or self._attempts.get(index) != request.get('attempt'):
+                return HTTPStatus.CONFLICT, None
+            self._leases.pop(index, None)
+            if index in self._pending:
+                self._pending.remove(index)
+            if request.get('retry') and self._attempts[index] < self.max_attempts:
+                self._pending.append(index)
+                return HTTPStatus.OK, {}
+            self._unfinished.discard(index)
+
+        result = request.get('result') or {}
+        job.status = result.get('status', JobStatus.FAILED)
+        job.error_message = result.get('error_message', "")
+        job.returncode = result.get('returncode')
+        job.stderr_tail = list(result.get('stderr_tail') or [])
+        job.timings.update(result.get('timings') or {})
+        job.output_size = result.get('output_size')
+        outputs = list(request.get('outputs') or [])
+        if self.transfer:
+            output_dir = os.path.dirname(job.output_file)
+            outputs = [os.path.join(output_dir, name) for name in outputs]
+        if job.status == JobStatus.DONE and (not outputs or not all(map(os.path.exists, outputs))):
+            job.status = JobStatus.FAILED
+            job.error_message = "出力ファイルが見つかりません"
+        if outputs:
+            job.output_file, job.extra_outputs = outputs[0], outputs[1:]
+
+        try:
+            manifest = self._manifest(job)
+            if manifest is not None:
+                if job.status == JobStatus.DONE:
+                    manifest.record(
+                        job.input_file, job.output_file, self.engine.encoding_params(), job.extra_outputs
+                    )
+                elif job.status == JobStatus.CANCELLED:
+                    manifest.mark(job.input_file, 'cancelled')
+                else:
+                    manifest.mark(job.input_file, 'failed', job.error_message)
+        except OSError as e:
+            job.status = JobStatus.FAILED
+            job.error_message = f"変換記録を更新できません: {e}"
+        self._finish(job)
+        return HTTPStatus.OK, {}
+
+    def input_for(self, index: int, worker: str, attempt: int) -> Optional[str]:
+        with self._lock:
+            job = self._check_lease(index, worker, attempt)
+        return job.input_file if job is not None and self.transfer else None
+
+    def output_destination(self, index: int, worker: str, attempt: int, name: str) -> Optional[str]:
+        """アップロードされた出力の保存先（リースがないか不正な名前ならNone）"""
+        with self._lock:
+            job = self._check_lease(index, worker, attempt)
+        if job is None or not self.transfer or not _is_plain_filename(name):
+            return None
+        output_dir = os.path.dirname(job.output_file) or '.'
+        os.makedirs(output_dir, exist_ok=True)
+        return os.path.join(output_dir, name)
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    coordinator: Coordinator
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Optional[Dict[str, Any]] = None):
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse_job_path(self) -> Tuple[List[str], int, str, int]:
+        """(パスの要素, ジョブ番号, ワーカー名, 試行番号)"""
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = parse_qs(url.query)
+        return (
+            parts,
+            int(parts[1]),
+            query.get('worker', [''])[0],
+            int(query.get('attempt', ['0'])[0]),
+        )
+
+    def do_POST(self):
+        handlers = {
+            '/lease': self.coordinator.lease,
+            '/renew': self.coordinator.renew,
+            '/complete': self.coordinator.complete,
+        }
+        handler = handlers.get(urlsplit(self.path).path)
+        if handler is None:
+            self._send_json(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(HTTPStatus.BAD_REQUEST)
+            return
+        try:
+            status, payload = handler(request)
+        except Exception:
+            # 失効したリースは貸し出し直されるため、ワーカーには再試行させる
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        self._send_json(status, payload)
+
+    def do_GET(self):
+        try:
+            parts, index, worker, attempt = self._parse_job_path()
+        except (IndexError, ValueError):
+            self._send_json(HTTPStatus.NOT_FOUND)
+            return
+        input_file = None
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'input':
+            input_file = self.coordinator.input_for(index, worker, attempt)
+        if input_file is None:
+            self._send_json(HTTPStatus.CONFLICT)
+            return
+        try:
+            source = open(input_file, 'rb')
+        except OSError:
+            self._send_json(HTTPStatus.NOT_FOUND)
+            return
+        with source:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(source.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(source, self.wfile, _CHUNK_SIZE)
+
+    def do_PUT(self):
+        try:
+            parts, index, worker, attempt = self._parse_job_path()
+            length = int(self.headers['Content-Length'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            self._send_json(HTTPStatus.BAD_REQUEST)
+            return
+        destination = None
+        if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'outputs':
+            destination = self.coordinator.output_destination(index, worker, attempt, parts[3])
+        if destination is None:
+            self._send_json(HTTPStatus.CONFLICT)
+            return
+        partial = partial_path_for(destination, f"attempt{attempt}")
+        try:
+            with open(partial, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise OSError("アップロードが途中で切れました")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            replace_durably(partial, destination)
+        except OSError:
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        self._send_json(HTTPStatus.OK, {})
+
+
+def _request(
+    url: str,
+    payload: Optional[Dict[str, Any]] = None,
+    timeout: float = 30.0
+) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    JSONをPOSTし、(ステータスコード, 応答のJSON)を返す
+
+    Raises:
+        OSError: 接続できない場合
+    """
+    data = json.dumps(payload or {}).encode('utf-8')
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            return response.status, json.loads(body) if body else None
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+class Worker:
+    """
+    コーディネーターからジョブを借りて変換するワーカー
+
+    slots個のジョブを並行して変換し、コーディネーターが全件完了を返すか
+    応答しなくなるか、cancel()（SIGTERM）で止められると終了する。
+    """
+
+    def __init__(
+        self,
+        coordinator_url: str,
+        name: Optional[str] = None,
+        slots: int = 1,
+        poll_interval: float = 1.0,
+        ffmpeg_path: str = 'ffmpeg',
+        ffprobe_path: str = 'ffprobe',
+        tuning: ProcessTuning = ProcessTuning()
+    ):
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.slots = max(1, slots)
+        self.poll_interval = poll_interval
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        # ffmpegのスレッド数と優先度（ワーカーのマシンごとに指定する）
+        self.tuning = tuning
+        self._connected = False
+        self._stopping = False
+        # 変換中のジョブのエンジン
+        self._engines: Set[ConversionEngine] = set()
+
+    async def _call(self, endpoint: str, payload: Dict[str, Any]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _request, self.coordinator_url + endpoint, payload)
+
+    async def run(self) -> int:
+        """
+        ジョブがなくなるまで変換する
+
+        SIGTERMを受け取るとcancel()する（メインスレッドのイベントループで実行した場合）。
+
+        Returns:
+            int: 変換したジョブの数
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.cancel)
+            handling_signal = True
+        except (NotImplementedError, RuntimeError, ValueError):
+            handling_signal = False
+        try:
+            counts = await asyncio.gather(*(self._slot(f"{self.name}/{n}") for n in range(self.slots)))
+        finally:
+            if handling_signal:
+                loop.remove_signal_handler(signal.SIGTERM)
+        return sum(counts)
+
+    def cancel(self):
+        """
+        実行中の変換を取り消し、新しいジョブを借りずに終了する
+
+        ffmpegは終了させて書きかけの出力を削除し、取り消したジョブはコーディネーターが
+        別のワーカーへ貸し出し直す。イベントループのスレッドから呼ぶこと。
+        """
+        self._stopping = True
+        for engine in list(self._engines):
+            engine.cancel()
+
+    async def _slot(self, worker: str) -> int:
+        processed = 0
+        failures = 0
+        while not self._stopping:
+            try:
+                status, lease = await self._call('/lease', {'worker': worker})
+            except OSError:
+                # 起動前のコーディネーターは待ち、一度つながった後に応答しなくなったら終了する
+                failures += 1
+                if self._connected and failures >= 3:
+                    return processed
+                await asyncio.sleep(self.poll_interval)
+                continue
+            self._connected = True
+            failures = 0
+            if status == HTTPStatus.GONE:
+                return processed
+            if status != HTTPStatus.OK or lease is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._process(worker, lease)
+            processed += 1
+        return processed
+
+    def _engine_for(self, settings: Dict[str, Any], attempt: int) -> ConversionEngine:
+        return ConversionEngine(
+            aac_passthrough=settings.get('aac_passthrough', False),
+            use_manifest=False,  # 変換記録はコーディネーターが管理する
+            split_threshold=settings.get('split_threshold'),
+            segments=settings.get('segments'),
+            profiles=[OutputProfile(**profile) for profile in settings.get('profiles') or []] or None,
+            ffmpeg_path=self.ffmpeg_path,
+            ffprobe_path=self.ffprobe_path,
+            ffmpeg_threads=self.tuning.threads,
+            nice=self.tuning.nice,
+            io_priority=self.tuning.io_class,
+            stall_timeout=settings.get('stall_timeout'),
+            loudness=LoudnessTarget(**settings['loudness']) if settings.get('loudness') else None,
+            # 失効したリースの試行がまだ書き込んでいても、共有ストレージ上で一時ファイルがぶつからない
+            partial_tag=f"attempt{attempt}",
+        )
+
+    async def _keep_renewing(
+        self,
+        engine: ConversionEngine,
+        ident: Dict[str, Any],
+        interval: float,
+        progress: Dict[str, Any]
+    ):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                status, _ = await self._call('/renew', {**ident, **progress})
+            except OSError:
+                continue
+            if status == HTTPStatus.CONFLICT:
+                # リースが失効して別の試行に貸し出された（このジョブの結果は受け付けられない）
+                engine.cancel()
+                return
+
+    async def _process(self, worker: str, lease: Dict[str, Any]):
+        ident = {'worker': worker, 'index': lease['index'], 'attempt': lease['attempt']}
+        engine = self._engine_for(lease['settings'], lease['attempt'])
+        progress: Dict[str, Any] = {'fraction': None, 'speed': ''}
+
+        def on_event(event: ConversionEvent):
+            if event.kind == EventKind.PROGRESS:
+                progress.update(fraction=event.fraction, speed=event.speed)
+
+        engine.add_listener(on_event)
+        self._engines.add(engine)
+        renewing = asyncio.ensure_future(
+            self._keep_renewing(engine, ident, lease['lease_seconds'] / 3, progress)
+        )
+        report: Dict[str, Any] = dict(ident)
+        try:
+            if lease['transfer']:
+                with tempfile.TemporaryDirectory(prefix="mp4_to_mp3_worker_") as temp_dir:
+                    job = await self._convert_transferred(engine, worker, lease, temp_dir)
+                    report['outputs'] = [os.path.basename(path) for path in [job.output_file, *job.extra_outputs]]
+            else:
+                job = ConversionJob(lease['input_file'], lease['output_file'], lease['index'])
+                job.media = MediaInfo(*lease['media']) if lease['media'] else None
+                await self._run_job(engine, job)
+                report['outputs'] = [job.output_file, *job.extra_outputs]
+            report['result'] = _job_result(job)
+            if job.status == JobStatus.CANCELLED:
+                # ワーカーの終了で取り消したジョブは別のワーカーが変換し直す
+                report['retry'] = True
+        except OSError as e:
+            # 転送の失敗はコーディネーターが別の試行として貸し出し直す
+            report['retry'] = True
+            report['result'] = {'status': JobStatus.FAILED, 'error_message': f"転送に失敗しました: {e}"}
+        finally:
+            renewing.cancel()
+            self._engines.discard(engine)
+        try:
+            await self._call('/complete', report)
+        except OSError:
+            pass
+
+    async def _run_job(self, engine: ConversionEngine, job: ConversionJob):
+        """ジョブを変換する（取り消し済みなら変換せずにCANCELLEDにする）"""
+        if self._stopping:
+            job.status = JobStatus.CANCELLED
+            job.error_message = CANCELLED_MESSAGE
+            return
+        await engine.run_job(job)
+
+    async def _convert_transferred(
+        self,
+        engine: ConversionEngine,
+        worker: str,
+        lease: Dict[str, Any],
+        temp_dir: str
+    ) -> ConversionJob:
+        """入力をダウンロードして変換し、成功した出力をアップロードする"""
+        loop = asyncio.get_running_loop()
+        query = urlencode({'worker': worker, 'attempt': lease['attempt']})
+        job_url = f"{self.coordinator_url}/jobs/{lease['index']}"
+        # プロファイルの出力ファイル名は入力のベース名から決まるため、名前は変えない
+        input_file = os.path.join(temp_dir, os.path.basename(lease['input_file']))
+        output_file = os.path.join(temp_dir, os.path.basename(lease['output_file']))
+
+        def download():
+            with urllib.request.urlopen(f"{job_url}/input?{query}", timeout=60) as response, \
+                 open(input_file, 'wb') as f:
+                shutil.copyfileobj(response, f, _CHUNK_SIZE)
+
+        def upload(path: str):
+            with open(path, 'rb') as f:
+                request = urllib.request.Request(
+                    f"{job_url}/outputs/{quote(os.path.basename(path))}?{query}",
+                    data=f,
+                    method='PUT',
+                    headers={'Content-Length': str(os.path.getsize(path))}
+                )
+                with urllib.request.urlopen(request, timeout=60):
+                    pass
+
+        await loop.run_in_executor(None, download)
+        job = ConversionJob(input_file, output_file, lease['index'])
+        job.media = MediaInfo(*lease['media']) if lease['media'] else None
+        await self._run_job(engine, job)
+        if job.status == JobStatus.DONE:
+            for path in [job.output_file, *job.extra_outputs]:
+                await loop.run_in_executor(None, upload, path)
+        return job
@@ -0,0 +1,1323 @@
+"""
+変換エンジン
+
+ジョブモデル、上限付きワーカープールによるスケジューラ、ffmpegの実行、
+進捗・結果のイベント通知をまとめたモジュール。Tkinterには依存しない。
+"""
+import asyncio
+import contextlib
+import json
+import os
+import re
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from .dedup import ContentFingerprint, group_same_content, materialize
+from .journal import replace_durably
+from .loudness import LoudnessMeasurement, LoudnessTarget, analysis_args, loudness_args, parse_measurement
+from .manifest import ConversionManifest
+from .profiles import DEFAULT_PROFILE, OutputProfile, validate_profiles
+from .segmented import (
+    Segment,
+    plan_segments,
+    segment_args,
+    segment_count_for,
+    total_samples_for,
+    trim_segment,
+    write_concat_list,
+)
+from .system import set_process_priority
+
+if TYPE_CHECKING:
+    from .adaptive import AdaptiveController
+    from .backends import PyAVBackend
+    from .probe_index import ProbeIndex
+
+# エラー報告用に保持するffmpeg標準エラー出力の行数
+STDERR_TAIL_LINES = 30
+
+# ディレクトリ指定時に変換対象とする拡張子
+INPUT_EXTENSIONS = ('.mp4',)
+
+# 事前解析で同時に起動するffprobeの数の下限
+PROBE_CONCURRENCY = 8
+
+# 進捗がこの秒数進まないffmpegを止める（コマンドラインとGUIの既定値）
+DEFAULT_STALL_TIMEOUT = 300.0
+
+# 取り消されたジョブのエラーメッセージ
+CANCELLED_MESSAGE = "取り消されました"
+
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+class MediaInfo(NamedTuple):
+    """ffprobeで取得した入力の音声ストリーム情報"""
+    codec: str
+    sample_rate: Optional[int]
+    channels: Optional[int]
+    duration: Optional[float]
+
+
+class JobStatus:
+    """ジョブの状態"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class ConversionJob:
+    """1つの入力ファイルの変換ジョブ"""
+    input_file: str
+    output_file: str
+    index: int = 0
+    status: str = JobStatus.PENDING
+    error_message: str = ""
+    media: Optional[MediaInfo] = None
+    # 以下は計測値（時刻はtime.monotonic()の値）
+    queued_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # 段階ごとの所要時間（秒）: queue_wait, probe, analyze, encode, finalize
+    timings: Dict[str, float] = field(default_factory=dict)
+    returncode: Optional[int] = None
+    stderr_tail: List[str] = field(default_factory=list)
+    output_size: Optional[int] = None
+    # 2つ目以降のプロファイルの出力ファイル（output_fileは1つ目のプロファイルの出力）
+    extra_outputs: List[str] = field(default_factory=list)
+    # エンコードせずに出力を作った場合、同じ内容でエンコードした入力
+    duplicate_of: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.SKIPPED)
+
+    @property
+    def latency(self) -> Optional[float]:
+        """キューに積まれてから完了するまでの時間（秒）"""
+        start = self.queued_at if self.queued_at is not None else self.started_at
+        if start is None or self.finished_at is None:
+            return None
+        return self.finished_at - start
+
+    def as_tuple(self) -> Tuple[str, bool, str]:
+        """(入力ファイル, 成功フラグ, エラーメッセージ)を返す"""
+        return self.input_file, self.success, self.error_message
+
+
+class EventKind:
+    """ConversionEventの種類"""
+    STARTED = "started"
+    PROGRESS = "progress"
+    SKIPPED = "skipped"
+    FINISHED = "finished"
+    WARNING = "warning"
+
+
+@dataclass
+class ConversionEvent:
+    """
+    エンジンから通知されるイベント
+
+    PROGRESSではfraction（0.0〜1.0、長さ不明の場合None）とspeedが、
+    FINISHEDではjob.statusとjob.error_messageが結果を表す。
+    """
+    kind: str
+    job: Optional[ConversionJob] = None
+    fraction: Optional[float] = None
+    speed: str = ""
+    message: str = ""
+
+
+class ProcessTuning(NamedTuple):
+    """
+    ffmpegプロセスごとの実行設定
+
+    threads: ffmpegのデコードのスレッド数（Noneならffmpegの既定）
+    nice: nice値（Noneなら変更しない）
+    io_class: I/O優先度のクラス'best-effort'または'idle'（Noneなら変更しない、Linuxのみ）
+    """
+    threads: Optional[int] = None
+    nice: Optional[int] = None
+    io_class: Optional[str] = None
+
+
+class ConcurrencyLimit:
+    """実行中に上限を変更できるセマフォ（同時に変換するジョブ数の制限に使う）"""
+
+    def __init__(self, limit: int):
+        self._limit = max(1, limit)
+        self.active = 0
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def set_limit(self, limit: int):
+        self._limit = max(1, limit)
+        self._wake()
+
+    def _wake(self):
+        # 待っているものをすべて起こし、それぞれ空きを確認させる
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def __aenter__(self):
+        while self.active >= self._limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._wake()
+
+
+def output_path_for(
+    input_file: str,
+    output_dir: str,
+    extension: str = ".mp3",
+    subdir: str = ""
+) -> str:
+    """入力ファイルのベース名から出力ファイルのパスを作る"""
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return os.path.join(output_dir, subdir, f"{base_name}{extension}")
+
+
+def make_jobs(input_files: Iterable[str], output_dir: str) -> List[ConversionJob]:
+    """入力ファイルごとに出力ディレクトリ直下へ変換するジョブを作る"""
+    return [
+        ConversionJob(input_file, output_path_for(input_file, output_dir), index)
+        for index, input_file in enumerate(input_files)
+    ]
+
+
+def partial_path_for(output_file: str, tag: Optional[str] = None) -> str:
+    """
+    エンコード中に書き込む一時ファイルのパス
+
+    出力と同じディレクトリの隠しファイルにし、拡張子（ffmpegが形式の判定に使う）は保つ。
+
+    Args:
+        output_file: 出力ファイル
+        tag: 同じ出力を同時に書き込むことがある場合に、書き込む側ごとに変える名前
+    """
+    directory, name = os.path.split(output_file)
+    stem, extension = os.path.splitext(name)
+    if tag:
+        return os.path.join(directory, f".{stem}.{tag}.partial{extension}")
+    return os.path.join(directory, f".{stem}.partial{extension}")
+
+
+def order_longest_first(jobs: Iterable[ConversionJob]) -> List[ConversionJob]:
+    """
+    入力の長いジョブから順に並べる
+
+    長いファイルがバッチの最後に1つだけ残って全体の完了が遅れるのを防ぐ。
+    長さが分からないジョブは元の順序のまま最後に回す。
+    """
+    return sorted(
+        jobs,
+        key=lambda job: -(job.media.duration or 0.0) if job.media else 0.0
+    )
+
+
+def _parse_probe_output(output: str) -> Optional[MediaInfo]:
+    """
+    ffprobeのJSON出力から先頭の音声ストリーム情報を取り出す
+
+    Returns:
+        Optional[MediaInfo]: 音声ストリームがない、または解析できない場合None
+    """
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return None
+    streams = data.get('streams') or []
+    if not streams:
+        return None
+    stream = streams[0]
+
+    def to_number(value, kind):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return None
+
+    duration = to_number(stream.get('duration'), float)
+    if duration is None:
+        duration = to_number((data.get('format') or {}).get('duration'), float)
+    return MediaInfo(
+        codec=stream.get('codec_name', ''),
+        sample_rate=to_number(stream.get('sample_rate'), int),
+        channels=to_number(stream.get('channels'), int),
+        duration=duration,
+    )
+
+
+def _parse_duration(line: str) -> Optional[float]:
+    """
+    ffmpegのログ行から入力の長さ（秒）を取り出す
+
+    Returns:
+        Optional[float]: 長さ（秒）。該当しない行の場合None
+    """
+    match = _DURATION_PATTERN.search(line)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _parse_out_time(fields: Dict[str, str]) -> Optional[float]:
+    """
+    -progress出力のブロックから出力済みの時間（秒）を取り出す
+
+    Returns:
+        Optional[float]: 出力済みの時間（秒）。取得できない場合None
+    """
+    # out_time_msも実際にはマイクロ秒単位で出力される
+    for key in ('out_time_us', 'out_time_ms'):
+        value = fields.get(key, '')
+        if value.lstrip('-').isdigit():
+            return max(0, int(value)) / 1_000_000
+    return None
+
+
+async def _read_lines(stream: asyncio.StreamReader) -> AsyncIterator[str]:
+    """ストリームを1行ずつデコードして返す（長すぎる行は読み飛ばす）"""
+    while True:
+        try:
+            raw = await stream.readline()
+        except ValueError:
+            # バッファ上限を超える行は破棄して続行する
+            continue
+        if not raw:
+            return
+        yield raw.decode('utf-8', errors='ignore').rstrip()
+
+
+async def probe_audio(input_file: str, ffprobe: str = 'ffprobe') -> Optional[MediaInfo]:
+    """
+    ffprobeで入力の先頭の音声ストリームを調べる
+
+    ffprobeが利用できない場合や解析に失敗した場合は、
+    通常の再エンコードにフォールバックできるようNoneを返す。
+
+    Args:
+        input_file: 入力ファイル
+        ffprobe: ffprobeのパスまたはコマンド名
+
+    Returns:
+        Optional[MediaInfo]: 音声ストリーム情報
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            ffprobe,
+            '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name,sample_rate,channels,duration:format=duration',
+            '-of', 'json',
+            input_file,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await process.communicate()
+    except Exception:
+        return None
+    if process.returncode != 0:
+        return None
+    return _parse_probe_output(stdout.decode('utf-8', errors='ignore'))
+
+
+class ConversionEngine:
+    """
+    MP4からMP3への一括変換エンジン
+
+    ジョブはFIFOキューに積まれ、最大max_workers個のワーカーが順に取り出して
+    変換する。進捗と結果はadd_listenerで登録したコールバックへ
+    ConversionEventとして通知される（イベントループのスレッドから呼ばれる）。
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        aac_passthrough: bool = False,
+        force: bool = False,
+        hash_inputs: bool = False,
+        use_manifest: bool = True,
+        manifest_dir: Optional[str] = None,
+        split_threshold: Optional[float] = None,
+        segments: Optional[int] = None,
+        probe_index: Optional['ProbeIndex'] = None,
+        longest_first: bool = True,
+        profiles: Optional[Sequence[OutputProfile]] = None,
+        ffmpeg_path: str = 'ffmpeg',
+        ffprobe_path: str = 'ffprobe',
+        ffmpeg_threads: Optional[int] = None,
+        nice: Optional[int] = None,
+        io_priority: Optional[str] = None,
+        dedup: bool = False,
+        link_method: str = 'hardlink',
+        stall_timeout: Optional[float] = None,
+        loudness: Optional[LoudnessTarget] = None,
+        backend: Optional['PyAVBackend'] = None,
+        partial_tag: Optional[str] = None
+    ):
+        # 同時に実行するffmpegプロセスの上限（既定はCPUコア数）
+        self.max_workers: int = max_workers or os.cpu_count() or 1
+        # AAC音声を再エンコードせずに.m4aとして抽出する（オプトイン）
+        self.aac_passthrough = aac_passthrough
+        # 変換記録を無視してすべて再変換する
+        self.force = force
+        # 変換記録に入力ファイルの内容ハッシュも残す
+        self.hash_inputs = hash_inputs
+        self.use_manifest = use_manifest
+        # 変換記録を置くディレクトリ（省略時は各出力ファイルのディレクトリ）
+        self.manifest_dir = manifest_dir
+        # これより長い（秒）入力は区間に分けて並列にエンコードする（Noneで無効）
+        self.split_threshold = split_threshold
+        # 分割時の区間数の上限（省略時はmax_workers）
+        self.segments = segments
+        # ffprobeの結果のキャッシュ（Noneなら毎回解析する）
+        self.probe_index = probe_index
+        # 入力の長いものから実行する
+        self.longest_first = longest_first
+        # 1つの入力から作る出力ファイルの設定（1回のffmpeg実行でまとめて書き出す）
+        self.profiles: List[OutputProfile] = list(profiles or [DEFAULT_PROFILE])
+        validate_profiles(self.profiles)
+        # 実行するffmpeg/ffprobe（パスまたはコマンド名）
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        # ffmpegプロセスのスレッド数と優先度（controllerがある場合はそちらが決める）
+        self.tuning = ProcessTuning(ffmpeg_threads, nice, io_priority)
+        # 実行中に同時実行数と実行設定を調整するもの（AdaptiveController）
+        self.controller: Optional['AdaptiveController'] = None
+        # 同じ内容の入力は1度だけエンコードし、ほかの出力はlink_methodで作る
+        # （変換記録にある以前のバッチの出力も使う）
+        self.dedup = dedup
+        self.link_method = link_method
+        # 進捗（出力した時間とサイズ）がこの秒数進まないffmpegを止めて失敗にする（Noneで無効）
+        self.stall_timeout = stall_timeout
+        # 出力の音量をそろえる目標（Noneなら正規化しない）。2パスの解析結果はprobe_indexに保存する
+        self.loudness = loudness
+        # ffprobe・ffmpegをファイルごとに起動する代わりに使う変換の方式（Noneならffmpeg）。
+        # 扱えない変換のジョブはffmpegで行う
+        self.backend = backend
+        # 書き込み中の一時ファイルの名前に加える文字列（分散変換で同じ出力を
+        # 複数の試行が書き込んでも一時ファイルがぶつからないようにする）
+        self.partial_tag = partial_tag
+        # 実行中のバッチの数と、取り消しの要求（バッチが終わると消える）
+        self._active_batches = 0
+        self._cancel_all = False
+        self._cancelled_jobs: Set[int] = set()
+        self._job_tasks: Dict[int, asyncio.Task] = {}
+        self._processes: Set[int] = set()
+        self._job_slots: Optional[ConcurrencyLimit] = None
+        self._duplicate_sources: Dict[int, ConversionJob] = {}
+        self.listeners: List[Callable[[ConversionEvent], None]] = []
+        self._process_slots: Optional[asyncio.Semaphore] = None
+        self._manifests: Dict[str, ConversionManifest] = {}
+
+    def add_listener(self, listener: Callable[[ConversionEvent], None]):
+        """イベントを受け取るコールバックを登録する"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[ConversionEvent], None]):
+        """登録したコールバックを解除する"""
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _emit(self, event: ConversionEvent):
+        """
+        イベントを登録済みのリスナーへ渡す
+
+        リスナーの例外はバッチ全体を止めないよう警告イベントに変える。
+        """
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                if event.kind == EventKind.WARNING:
+                    continue
+                self._emit(ConversionEvent(
+                    EventKind.WARNING, event.job,
+                    message=f"結果の後処理に失敗しました: {e}"
+                ))
+
+    def manifest_for(self, output_dir: str) -> ConversionManifest:
+        """出力ディレクトリの変換記録を返す（初回のみ読み込む）"""
+        key = os.path.abspath(output_dir)
+        manifest = self._manifests.get(key)
+        if manifest is None:
+            manifest = ConversionManifest.load(output_dir, self.hash_inputs)
+            self._manifests[key] = manifest
+        return manifest
+
+    def save_manifests(self):
+        """読み込んだ変換記録をすべて保存する"""
+        for manifest in self._manifests.values():
+            manifest.save()
+
+    def encoding_params(self) -> Dict[str, Any]:
+        """変換記録と照合するエンコード設定を返す"""
+        params: Dict[str, Any] = {
+            'codec': 'libmp3lame',
+            'bitrate': '192k',
+            'aac_passthrough': self.aac_passthrough,
+        }
+        if self.profiles != [DEFAULT_PROFILE]:
+            params['profiles'] = [profile.params() for profile in self.profiles]
+        if self.loudness is not None:
+            params['loudness'] = self.loudness._asdict()
+        return params
+
+    def plan_output(
+        self,
+        output_file: str,
+        media: Optional[MediaInfo],
+        profile: Optional[OutputProfile] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        音声コーデックに応じて出力ファイルとエンコード引数を決める
+
+        プロファイルでstream_copyが有効な場合（既定のプロファイルなど）:
+        - 音声が既にMP3の場合は再エンコードせずにストリームコピーする
+        - aac_passthroughが有効でAAC音声の場合は.m4aへそのまま抽出する
+
+        それ以外と、音量を正規化する場合はプロファイルの設定でlibmp3lameにより再エンコードする。
+
+        Returns:
+            Tuple[str, List[str]]: (出力ファイル, ffmpegの音声エンコード引数)
+        """
+        profile = profile or self.profiles[0]
+        codec = media.codec if media and profile.stream_copy and self.loudness is None else ''
+        if codec == 'mp3':
+            return output_file, ['-c:a', 'copy']
+        if codec == 'aac' and self.aac_passthrough:
+            return os.path.splitext(output_file)[0] + '.m4a', ['-c:a', 'copy']
+        return output_file, profile.codec_args()
+
+    def plan_outputs(self, job: ConversionJob) -> List[Tuple[str, List[str]]]:
+        """
+        プロファイルごとの出力ファイルとエンコード引数を決める
+
+        出力ファイルはjob.output_fileと同じディレクトリに、プロファイルの
+        テンプレートで名前を付ける（既定のプロファイルはjob.output_fileそのもの）。
+
+        Returns:
+            List[Tuple[str, List[str]]]: self.profilesと同じ順序の(出力ファイル, エンコード引数)
+        """
+        output_dir = os.path.dirname(job.output_file)
+        plans = []
+        for profile in self.profiles:
+            if profile == DEFAULT_PROFILE:
+                output_file = job.output_file
+            else:
+                output_file = os.path.join(output_dir, profile.filename(job.input_file))
+            plans.append(self.plan_output(output_file, job.media, profile))
+        return plans
+
+    async def convert_file(self, input_file: str, output_file: str) -> Tuple[str, bool, str]:
+        """
+        ファイル変換を実行する
+
+        Returns:
+            Tuple[str, bool, str]: (入力ファイル名, 成功フラグ, エラーメッセージ)
+        """
+        job = ConversionJob(input_file, output_file)
+        await self.run_job(job)
+        return job.as_tuple()
+
+    async def run_job(self, job: ConversionJob) -> ConversionJob:
+        """
+        1つのジョブを変換し、結果をjobに書き込む
+
+        例外は送出せず、失敗はjob.statusとjob.error_messageで表す。
+        """
+        job.status = JobStatus.RUNNING
+        job.started_at = time.monotonic()
+        if job.queued_at is not None:
+            job.timings['queue_wait'] = job.started_at - job.queued_at
+        self._emit(ConversionEvent(EventKind.STARTED, job))
+        if self._cancel_all or id(job) in self._cancelled_jobs:
+            job.status = JobStatus.CANCELLED
+            job.error_message = CANCELLED_MESSAGE
+        else:
+            task = asyncio.ensure_future(self._run_job(job))
+            self._job_tasks[id(job)] = task
+            try:
+                # cancel()はtaskだけを取り消す（asyncio.waitは待つ側が取り消されてもtaskを取り消さない）
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                # 呼び出し側ごと止められた場合もffmpegと書きかけの出力を片付けてから抜ける
+                task.cancel()
+                await asyncio.wait([task])
+                job.status = JobStatus.CANCELLED
+                job.error_message = CANCELLED_MESSAGE
+                raise
+            finally:
+                self._job_tasks.pop(id(job), None)
+            if task.cancelled():
+                job.status = JobStatus.CANCELLED
+                job.error_message = CANCELLED_MESSAGE
+            elif task.exception() is not None:
+                job.status = JobStatus.FAILED
+                job.error_message = str(task.exception())
+        job.finished_at = time.monotonic()
+        self._emit(ConversionEvent(EventKind.FINISHED, job))
+        return job
+
+    def set_concurrency(self, limit: int):
+        """
+        実行中のバッチで同時に変換するジョブ数の上限を変える
+
+        実行中のジョブは止めず、上限を超えている間は新しいジョブを始めない。
+        バッチを実行していなければ何もしない。
+        """
+        if self._job_slots is not None:
+            self._job_slots.set_limit(limit)
+
+    def cancel(self, job: Optional[ConversionJob] = None):
+        """
+        実行中のバッチ全体、または1つのジョブの変換を取り消す
+
+        実行中のジョブはffmpegを終了させて書きかけの出力を削除し、まだ始まっていない
+        ジョブは実行せずに、どちらもJobStatus.CANCELLEDとして結果を返す。
+        バッチの外でrun_job()が実行中のジョブも取り消すが、取り消しの要求は残さない
+        （実行中のものがなければ何もしない）。イベントループのスレッドから呼ぶこと
+        （ほかのスレッドからはloop.call_soon_threadsafeを使う）。
+
+        Args:
+            job: 取り消すジョブ（省略時はバッチ全体）
+        """
+        if job is None:
+            if self._active_batches:
+                self._cancel_all = True
+            tasks = list(self._job_tasks.values())
+        else:
+            if self._active_batches:
+                self._cancelled_jobs.add(id(job))
+            tasks = [self._job_tasks[id(job)]] if id(job) in self._job_tasks else []
+        for task in tasks:
+            task.cancel()
+
+    def kill_processes(self):
+        """
+        実行中のffmpegをすべて強制終了する
+
+        終了時に変換のスレッドが止まらない場合の最後の手段で、どのスレッドからでも呼べる。
+        通常はcancel()を使う（書きかけの出力も削除される）。
+        """
+        for pid in list(self._processes):
+            try:
+                os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            except OSError:
+                pass
+
+    async def _run_job(self, job: ConversionJob):
+        loop = asyncio.get_event_loop()
+        # 同じ内容の入力の完了したジョブ（あればその出力から出力を作る）
+        duplicate_of = self._duplicate_sources.pop(id(job), None)
+        stage_started = time.monotonic()
+
+        def end_stage(name: str):
+            nonlocal stage_started
+            now = time.monotonic()
+            job.timings[name] = now - stage_started
+            stage_started = now
+
+        params = self.encoding_params()
+        output_dir = os.path.dirname(job.output_file) or '.'
+        manifest = None
+        if self.use_manifest:
+            manifest = self.manifest_for(self.manifest_dir or output_dir)
+
+        if manifest is not None and not self.force:
+            existing = await loop.run_in_executor(
+                None, manifest.lookup, job.input_file, params
+            )
+            if existing:
+                end_stage('probe')
+                job.output_file = existing
+                job.extra_outputs = manifest.extra_outputs(job.input_file)
+                job.status = JobStatus.SKIPPED
+                self._emit(ConversionEvent(
+                    EventKind.SKIPPED, job, message="変換済みのためスキップ"
+                ))
+                return
+
+        if duplicate_of is not None and duplicate_of.status == JobStatus.CANCELLED:
+            # 取り消しは失敗として数えない
+            raise asyncio.CancelledError()
+        if duplicate_of is not None and not duplicate_of.success:
+            raise RuntimeError(
+                f"同じ内容の {os.path.basename(duplicate_of.input_file)} の変換に失敗しました"
+            )
+        if job.media is None and duplicate_of is not None:
+            job.media = duplicate_of.media
+        if job.media is None:
+            job.media = await self._probe(job.input_file)
+        outputs = self.plan_outputs(job)
+        job.output_file = outputs[0][0]
+        job.extra_outputs = [output_file for output_file, _ in outputs[1:]]
+        # 一時ファイルへ書き出し、完成してから出力ファイルへ置き換える
+        # （途中で落ちても書きかけのファイルが出力の名前で残らない）
+        partials = [partial_path_for(output_file, self.partial_tag) for output_file, _ in outputs]
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        fingerprint = None
+        if self.dedup:
+            fingerprint = ContentFingerprint(job.input_file)
+            if duplicate_of is not None:
+                source: Optional[Tuple[str, List[str]]] = (
+                    duplicate_of.input_file, [duplicate_of.output_file, *duplicate_of.extra_outputs]
+                )
+            else:
+                source = await loop.run_in_executor(
+                    None, self._find_converted_copy, fingerprint, params
+                )
+            if source is not None and len(source[1]) == len(outputs):
+                end_stage('probe')
+                await loop.run_in_executor(
+                    None, self._link_outputs, job, source, manifest, params, fingerprint
+                )
+                end_stage('finalize')
+                return
+
+        if manifest is not None:
+            manifest.mark(job.input_file, 'started', partials=partials)
+
+        end_stage('probe')
+
+        measurement = None
+        try:
+            if self.loudness is not None:
+                try:
+                    if not self.loudness.single_pass:
+                        measurement = await self._measure_loudness(job, manifest)
+                except RuntimeError as e:
+                    if manifest is not None:
+                        manifest.mark(job.input_file, 'failed', str(e))
+                    raise
+                sample_rate = job.media.sample_rate if job.media else None
+                outputs = [
+                    (output_file, [*codec_args, *loudness_args(self.loudness, measurement, codec_args, sample_rate)])
+                    for output_file, codec_args in outputs
+                ]
+                end_stage('analyze')
+            returncode, stderr_tail = await self._encode(job, outputs, partials)
+        except asyncio.CancelledError:
+            for partial in partials:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            if manifest is not None:
+                manifest.mark(job.input_file, 'cancelled')
+            raise
+
+        end_stage('encode')
+        job.returncode = returncode
+        job.stderr_tail = stderr_tail
+
+        if returncode == 0 and all(os.path.exists(partial) for partial in partials):
+            for (output_file, _), partial in zip(outputs, partials):
+                await loop.run_in_executor(None, replace_durably, partial, output_file)
+            job.output_size = sum(os.path.getsize(output_file) for output_file, _ in outputs)
+            if manifest is not None:
+                await loop.run_in_executor(
+                    None, manifest.record, job.input_file, job.output_file, params,
+                    job.extra_outputs, fingerprint, measurement
+                )
+            job.status = JobStatus.DONE
+        else:
+            job.status = JobStatus.FAILED
+            job.error_message = "\n".join(stderr_tail) if stderr_tail else "不明なエラー"
+            for partial in partials:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            if manifest is not None:
+                manifest.mark(job.input_file, 'failed', job.error_message)
+        end_stage('finalize')
+
+    async def _measure_loudness(
+        self,
+        job: ConversionJob,
+        manifest: Optional[ConversionManifest] = None
+    ) -> Optional[LoudnessMeasurement]:
+        """
+        入力のラウドネスを測る
+
+        probe_indexか変換記録に変更のない入力の結果があればそれを使う（probe_indexを
+        使わない場合も、記録の残る出力先への再変換では解析を繰り返さない）。
+
+        Returns:
+            Optional[LoudnessMeasurement]: 測定値。無音などで測れなかった場合None
+            （その場合は1パスの動的な調整になる）
+
+        Raises:
+            RuntimeError: 解析のffmpegが失敗した場合
+        """
+        if self.probe_index is not None:
+            cached = self.probe_index.lookup_loudness(job.input_file)
+            if cached is not None:
+                return cached
+        if manifest is not None:
+            cached = await asyncio.get_running_loop().run_in_executor(
+                None, manifest.lookup_loudness, job.input_file
+            )
+            if cached is not None:
+                return cached
+        duration = job.media.duration if job.media else None
+
+        def on_progress(fields: Dict[str, str], logged: Optional[float]):
+            out_time = _parse_out_time(fields)
+            total = duration or logged
+            self._emit(ConversionEvent(
+                EventKind.PROGRESS, job,
+                fraction=min(1.0, out_time / total) if out_time is not None and total else None,
+                speed="音量を解析中"
+            ))
+
+        returncode, stderr_tail = await self._run_ffmpeg(
+            analysis_args(job.input_file, self.loudness), on_progress
+        )
+        if returncode != 0:
+            job.returncode = returncode
+            job.stderr_tail = stderr_tail
+            raise RuntimeError("\n".join(stderr_tail) if stderr_tail else "音量の解析に失敗しました")
+        measurement = parse_measurement(stderr_tail)
+        if measurement is not None and self.probe_index is not None:
+            self.probe_index.store_loudness(job.input_file, measurement)
+        return measurement
+
+    async def _encode(
+        self,
+        job: ConversionJob,
+        outputs: List[Tuple[str, List[str]]],
+        partials: List[str]
+    ) -> Tuple[int, List[str]]:
+        """
+        jobの入力をエンコードしてpartialsへ書き出す
+
+        Returns:
+            Tuple[int, List[str]]: (終了コード, 標準エラー出力の末尾)
+        """
+        segments = self._plan_segments(job.media, outputs[0][1]) if len(outputs) == 1 else []
+        if len(segments) > 1:
+            return await self._encode_segmented(job, segments, outputs[0][1], partials[0])
+        duration = job.media.duration if job.media else None
+
+        def on_progress(fields: Dict[str, str], logged: Optional[float]):
+            self._report_progress(job, fields, duration or logged)
+
+        if self.backend is not None and self.backend.supports(outputs):
+            async with self._process_slot():
+                return await self.backend.encode(
+                    self, job.input_file, list(zip(partials, (codec_args for _, codec_args in outputs))),
+                    on_progress
+                )
+        # 出力ごとに音声を割り当てる（入力の読み込みとデコードは1度だけ行われる）
+        args = ['-i', job.input_file]
+        for (_, codec_args), partial in zip(outputs, partials):
+            args += [
+                '-map', '0:a:0',  # 先頭の音声ストリームのみ
+                '-vn',  # 映像を無視
+                *codec_args,
+                '-y',  # 上書きを自動で許可
+                partial,
+            ]
+        return await self._run_ffmpeg(args, on_progress)
+
+    async def _probe(self, input_file: str) -> Optional[MediaInfo]:
+        """入力の先頭の音声ストリームを調べる（backendがあればffprobeを起動しない）"""
+        if self.backend is not None:
+            return await self.backend.probe(input_file)
+        return await probe_audio(input_file, self.ffprobe_path)
+
+    def _find_converted_copy(
+        self,
+        fingerprint: ContentFingerprint,
+        params: Dict[str, Any]
+    ) -> Optional[Tuple[str, List[str]]]:
+        """読み込んだ変換記録から、同じ内容の入力を同じ設定で変換した出力を探す"""
+        for manifest in list(self._manifests.values()):
+            found = manifest.find_same_content(fingerprint, params)
+            if found is not None:
+                return found
+        return None
+
+    def _link_outputs(
+        self,
+        job: ConversionJob,
+        source: Tuple[str, List[str]],
+        manifest: Optional[ConversionManifest],
+        params: Dict[str, Any],
+        fingerprint: Optional[ContentFingerprint]
+    ):
+        """
+        同じ内容の入力の出力から、エンコードせずにjobの出力を作る
+
+        Args:
+            source: (同じ内容の入力, その出力ファイル（プロファイルの順）)
+        """
+        source_input, source_outputs = source
+        outputs = [job.output_file, *job.extra_outputs]
+        for source_output, output_file in zip(source_outputs, outputs):
+            if os.path.abspath(source_output) != os.path.abspath(output_file):
+                materialize(source_output, output_file, self.link_method)
+        job.output_size = sum(os.path.getsize(output_file) for output_file in outputs)
+        job.duplicate_of = source_input
+        if manifest is not None:
+            manifest.record(job.input_file, job.output_file, params, job.extra_outputs, fingerprint)
+        job.status = JobStatus.DONE
+
+    async def _run_ffmpeg(
+        self,
+        args: List[str],
+        on_progress: Optional[Callable[[Dict[str, str], Optional[float]], None]] = None
+    ) -> Tuple[int, List[str]]:
+        """
+        ffmpegを実行し、進捗を逐次読み取る
+
+        同時に実行するffmpegプロセスはバッチ実行中はmax_workers個までに制限される。
+        stall_timeoutが設定されている場合、出力した時間とサイズがその秒数進まなければ
+        ffmpegを終了させて失敗として返す。取り消された場合もffmpegを終了させる。
+
+        Args:
+            args: 入力以降のffmpeg引数
+            on_progress: -progress出力の1ブロックごとに
+                (key=valueの辞書, ログから読み取った入力の長さ)で呼ばれる
+
+        Returns:
+            Tuple[int, List[str]]: (終了コード, 標準エラー出力の末尾)
+        """
+        tuning = self.controller.tuning() if self.controller is not None else self.tuning
+        threads = ['-threads', str(tuning.threads)] if tuning.threads else []
+        async with self._process_slot():
+            process = await asyncio.create_subprocess_exec(
+                self.ffmpeg_path,
+                '-hide_banner',
+                '-nostats',
+                '-progress', 'pipe:1',  # 進捗をkey=value形式で標準出力へ
+                *threads,
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            self._processes.add(process.pid)
+            if tuning.nice is not None or tuning.io_class is not None:
+                set_process_priority(process.pid, tuning.nice, tuning.io_class)
+
+            duration: Optional[float] = None
+            # 標準エラー出力は末尾の一定行数だけを保持する
+            stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+            last_position: Optional[Tuple[Optional[str], Optional[str]]] = None
+            advanced_at = time.monotonic()
+            stalled = False
+
+            async def read_stderr():
+                nonlocal duration
+                async for line in _read_lines(process.stderr):
+                    stderr_tail.append(line)
+                    if duration is None:
+                        duration = _parse_duration(line)
+
+            async def read_progress():
+                nonlocal last_position, advanced_at
+                fields: Dict[str, str] = {}
+                async for line in _read_lines(process.stdout):
+                    key, _, value = line.partition('=')
+                    fields[key.strip()] = value.strip()
+                    if key.strip() == 'progress':
+                        position = (fields.get('out_time_us'), fields.get('total_size'))
+                        if position != last_position:
+                            last_position = position
+                            advanced_at = time.monotonic()
+                        if on_progress is not None:
+                            on_progress(fields, duration)
+                        fields = {}
+
+            async def watchdog(timeout: float):
+                nonlocal stalled
+                while True:
+                    await asyncio.sleep(min(timeout / 4, 1.0))
+                    if time.monotonic() - advanced_at > timeout:
+                        stalled = True
+                        process.kill()
+                        return
+
+            watchdog_task = (
+                asyncio.ensure_future(watchdog(self.stall_timeout)) if self.stall_timeout else None
+            )
+            try:
+                await asyncio.gather(read_stderr(), read_progress())
+                await process.wait()
+            finally:
+                if watchdog_task is not None:
+                    watchdog_task.cancel()
+                if process.returncode is None:
+                    process.kill()
+                    # 読まれずに残った出力を捨てないとパイプが閉じず、終了を待てない
+                    await asyncio.gather(process.stdout.read(), process.stderr.read(), return_exceptions=True)
+                    await process.wait()
+                self._processes.discard(process.pid)
+        if stalled:
+            stderr_tail.append(f"{self.stall_timeout:g}秒間進捗がないため中止しました")
+        return process.returncode, list(stderr_tail)
+
+    @contextlib.asynccontextmanager
+    async def _process_slot(self):
+        """ffmpegプロセス1つ分の実行枠（バッチ実行中以外は制限しない）"""
+        if self._process_slots is None:
+            yield
+        else:
+            async with self._process_slots:
+                yield
+
+    def _plan_segments(
+        self,
+        media: Optional[MediaInfo],
+        codec_args: List[str]
+    ) -> List[Segment]:
+        """
+        分割並列エンコードの区間を決める
+
+        split_thresholdが設定され、入力がそれより長く、再エンコードが必要な
+        場合だけ複数の区間を返す。区間の境界は入力のサンプルレートのフレームに合わせるため
+        リサンプリングする場合は分割せず、VBRも長さの情報（Xingヘッダー）を書けないため分割しない。
+        音量の正規化（-af）も区間ごとに調整されてしまうため分割しない。
+        """
+        if (
+            self.split_threshold is None
+            or media is None
+            or not media.duration
+            or not media.sample_rate
+            or media.duration < self.split_threshold
+            or 'copy' in codec_args
+            or '-ar' in codec_args
+            or '-q:a' in codec_args
+            or '-af' in codec_args
+        ):
+            return []
+        count = segment_count_for(media.duration, self.segments or self.max_workers)
+        return plan_segments(
+            total_samples_for(media.duration, media.sample_rate),
+            media.sample_rate,
+            count
+        )
+
+    async def _encode_segmented(
+        self,
+        job: ConversionJob,
+        segments: List[Segment],
+        codec_args: List[str],
+        output_file: str
+    ) -> Tuple[int, List[str]]:
+        """
+        区間ごとに並列でエンコードし、output_fileに1つのMP3として結合する
+
+        Returns:
+            Tuple[int, List[str]]: (終了コード, 標準エラー出力の末尾)
+        """
+        loop = asyncio.get_event_loop()
+        media = job.media
+        sample_rate = media.sample_rate
+        output_dir = os.path.dirname(output_file) or '.'
+        work_dir = tempfile.mkdtemp(
+            prefix=f".{os.path.basename(job.output_file)}.segments-", dir=output_dir
+        )
+        done = [0.0] * len(segments)
+
+        def on_progress(index: int, fields: Dict[str, str]):
+            out_time = _parse_out_time(fields)
+            if out_time is not None:
+                done[index] = out_time
+            fraction = min(1.0, sum(done) / media.duration)
+            self._emit(ConversionEvent(
+                EventKind.PROGRESS, job,
+                fraction=fraction, speed=f"{len(segments)}分割"
+            ))
+
+        async def encode(segment: Segment) -> Tuple[int, List[str], str]:
+            segment_file = os.path.join(work_dir, f"{segment.index:04d}.mp3")
+            returncode, stderr_tail = await self._run_ffmpeg(
+                segment_args(job.input_file, segment, sample_rate, codec_args, segment_file),
+                lambda fields, _: on_progress(segment.index, fields)
+            )
+            if returncode == 0:
+                await loop.run_in_executor(
+                    None, trim_segment, segment_file, segment.drop_frames, segment.keep_frames
+                )
+            return returncode, stderr_tail, segment_file
+
+        try:
+            results = await asyncio.gather(*(encode(segment) for segment in segments))
+            for returncode, stderr_tail, _ in results:
+                if returncode != 0:
+                    return returncode, stderr_tail
+
+            list_file = os.path.join(work_dir, "segments.txt")
+            write_concat_list(list_file, [segment_file for _, _, segment_file in results])
+            return await self._run_ffmpeg([
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', list_file,
+                '-c', 'copy',
+                '-y',
+                output_file,
+            ])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _report_progress(
+        self,
+        job: ConversionJob,
+        fields: Dict[str, str],
+        duration: Optional[float]
+    ):
+        """ffmpegの進捗ブロックをPROGRESSイベントとして通知する"""
+        out_time = _parse_out_time(fields)
+        if fields.get('progress') == 'end':
+            fraction: Optional[float] = 1.0
+        elif out_time is not None and duration:
+            fraction = min(1.0, out_time / duration)
+        else:
+            fraction = None
+        self._emit(ConversionEvent(
+            EventKind.PROGRESS, job,
+            fraction=fraction, speed=fields.get('speed', 'N/A')
+        ))
+
+    async def probe_jobs(self, jobs: List[ConversionJob]):
+        """
+        ジョブの入力をまとめて解析し、job.mediaに設定する
+
+        インデックスにある変更のないファイルはffprobeを起動せず、
+        それ以外は並行して解析してインデックスに追加する。
+        """
+        pending = [job for job in jobs if job.media is None]
+        if self.probe_index is not None and pending:
+            cached = self.probe_index.lookup_many([job.input_file for job in pending])
+            for job in pending:
+                job.media = cached[job.input_file]
+            pending = [job for job in pending if job.media is None]
+        pending = [job for job in pending if os.path.isfile(job.input_file)]
+        if not pending:
+            return
+
+        slots = asyncio.Semaphore(max(self.max_workers, PROBE_CONCURRENCY))
+
+        async def probe(job: ConversionJob):
+            async with slots:
+                job.media = await self._probe(job.input_file)
+
+        await asyncio.gather(*(probe(job) for job in pending))
+        if self.probe_index is not None:
+            self.probe_index.store_many({
+                job.input_file: job.media for job in pending if job.media is not None
+            })
+
+    async def iter_results(
+        self,
+        jobs: List[ConversionJob],
+        max_workers: Optional[int] = None
+    ) -> AsyncIterator[ConversionJob]:
+        """
+        上限付きのワーカープールでジョブを実行し、完了順に返す
+
+        同時に起動するffmpegプロセス数はワーカー数を超えない。
+        先に全入力を解析し、longest_firstが有効な場合は長いものから実行する。
+        変換記録は最後（途中で止めた場合も）に保存される。
+
+        Args:
+            jobs: 変換ジョブのリスト
+            max_workers: 同時実行数の上限（省略時はself.max_workers）
+
+        Yields:
+            ConversionJob: 完了したジョブ
+        """
+        if not jobs:
+            return
+
+        # 解析中の取り消しも受け付けるよう、ここからバッチの実行中とする
+        self._active_batches += 1
+        try:
+            # 残り時間の見積もりにも使うため、順序に関わらず先に解析する
+            await self.probe_jobs(jobs)
+            if self.longest_first:
+                jobs = order_longest_first(jobs)
+            # 同じ内容の入力は先頭の1つだけをワーカーに渡し、残りはその完了後に出力を作る
+            duplicates: Dict[int, List[ConversionJob]] = {}
+            if self.dedup:
+                jobs, duplicates = await self._group_duplicates(jobs)
+
+            worker_count = max(1, min(max_workers or self.max_workers, len(jobs)))
+            job_queue: asyncio.Queue = asyncio.Queue()
+            queued_at = time.monotonic()
+            for job in jobs:
+                job.queued_at = queued_at
+                job_queue.put_nowait(job)
+            for group in duplicates.values():
+                for job in group:
+                    job.queued_at = queued_at
+            for _ in range(worker_count):
+                job_queue.put_nowait(None)
+
+            results = self.iter_queue(job_queue, worker_count, max_workers or self.max_workers)
+            try:
+                async for job in results:
+                    yield job
+                    for duplicate in duplicates.pop(id(job), []):
+                        self._duplicate_sources[id(duplicate)] = job
+                        yield await self.run_job(duplicate)
+            finally:
+                await results.aclose()
+        finally:
+            await self._end_batch()
+
+    async def _end_batch(self):
+        """
+        バッチの終了を記録する
+
+        すべて終わったら取り消しの要求を消し、backendの待機中のワーカーを終了させる。
+        """
+        self._active_batches -= 1
+        if not self._active_batches:
+            self._cancel_all = False
+            self._cancelled_jobs.clear()
+            if self.backend is not None:
+                await self.backend.close()
+
+    async def _group_duplicates(
+        self,
+        jobs: List[ConversionJob]
+    ) -> Tuple[List[ConversionJob], Dict[int, List[ConversionJob]]]:
+        """
+        同じ内容の入力のジョブをまとめる
+
+        Returns:
+            Tuple[List[ConversionJob], Dict[int, List[ConversionJob]]]:
+                (エンコードするジョブ, エンコードするジョブのidごとの同じ内容のジョブ)
+        """
+        loop = asyncio.get_event_loop()
+        groups = await loop.run_in_executor(
+            None, group_same_content, [job.input_file for job in jobs]
+        )
+        duplicates: Dict[int, List[ConversionJob]] = {}
+        linked = set()
+        for group in groups:
+            first, *rest = group
+            duplicates[id(jobs[first])] = [jobs[index] for index in rest]
+            linked.update(rest)
+        return [job for index, job in enumerate(jobs) if index not in linked], duplicates
+
+    async def iter_queue(
+        self,
+        job_queue: asyncio.Queue,
+        worker_count: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        save_each: bool = False
+    ) -> AsyncIterator[ConversionJob]:
+        """
+        キューに積まれるジョブを順に実行し、完了順に返す
+
+        ジョブが後から追加される場合（フォルダー監視など）に使う。
+        Noneを受け取ったワーカーは終了し、すべてのワーカーが終了すると返り終わる。
+
+        Args:
+            job_queue: ConversionJobまたは終了を表すNoneを積むキュー
+            worker_count: ワーカー数（省略時はself.max_workers）
+            max_processes: 同時に起動するffmpegプロセス数の上限（省略時はワーカー数）
+            save_each: ジョブが終わるたびに変換記録を保存する
+
+        Yields:
+            ConversionJob: 完了したジョブ
+        """
+        worker_count = worker_count or self.max_workers
+        result_queue: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            while True:
+                # 同時に変換するジョブ数はcontrollerが実行中に変えることがある
+                async with self._job_slots:
+                    job = await job_queue.get()
+                    if job is None:
+                        result_queue.put_nowait(None)
+                        return
+                    if job.queued_at is None:
+                        job.queued_at = time.monotonic()
+                    result_queue.put_nowait(await self.run_job(job))
+
+        self._process_slots = asyncio.Semaphore(max_processes or worker_count)
+        self._active_batches += 1
+        controller = self.controller
+        self._job_slots = ConcurrencyLimit(
+            controller.start(self, worker_count) if controller is not None else worker_count
+        )
+        workers = [asyncio.ensure_future(worker()) for _ in range(worker_count)]
+        if controller is not None:
+            workers.append(asyncio.ensure_future(controller.run()))
+        running = worker_count
+        try:
+            while running:
+                job = await result_queue.get()
+                if job is None:
+                    running -= 1
+                    continue
+                if save_each:
+                    self.save_manifests()
+                yield job
+        finally:
+            # 呼び出し側が途中で止めた場合も残りのワーカーを片付ける
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if controller is not None:
+                controller.stop()
+            self._process_slots = None
+            self._job_slots = None
+            await self._end_batch()
+            self.save_manifests()
+
+    async def run(
+        self,
+        jobs: List[ConversionJob],
+        max_workers: Optional[int] = None
+    ) -> List[ConversionJob]:
+        """
+        すべてのジョブを実行し、入力順に返す
+
+        Returns:
+            List[ConversionJob]: jobsと同じ順序の完了済みジョブ
+        """
+        async for _ in self.iter_results(jobs, max_workers):
+            pass
+        return list(jobs)
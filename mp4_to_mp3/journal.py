@@ -0,0 +1,97 @@
+"""
+ジョブの状態遷移の追記型ジャーナル
+
+変換記録（マニフェスト）はバッチの終わりにまとめて保存されるため、
+途中でアプリやマシンが落ちると何が終わったかが失われる。
+ジャーナルにはジョブの状態が変わるたびに1行ずつ追記し、
+完了の行は書き込みをディスクへ同期してから次へ進む。
+次回の起動時にマニフェストへ反映し、マニフェストの保存後に空にする。
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator
+
+# 出力ディレクトリ（マニフェストと同じ場所）に置くジャーナル
+JOURNAL_FILENAME = ".mp4_to_mp3_journal.jsonl"
+
+
+def fsync_path(path: str):
+    """
+    ファイルまたはディレクトリの内容をディスクへ同期する
+
+    ディレクトリを開けない環境（Windows）では何もしない。
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_durably(source: str, destination: str):
+    """
+    sourceを同期してからdestinationへ置き換え、ディレクトリも同期する
+
+    途中で電源が落ちても、destinationは以前の内容か完全な新しい内容のどちらかになる。
+    """
+    fsync_path(source)
+    os.replace(source, destination)
+    fsync_path(os.path.dirname(os.path.abspath(destination)))
+
+
+class JobJournal:
+    """ジョブの状態遷移を1行1件のJSONで追記するジャーナル"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict[str, Any], durable: bool = False):
+        """
+        1件追記する
+
+        Args:
+            record: 書き込む内容（'time'は自動で付ける）
+            durable: ディスクへの書き込みを待つ場合True（完了の記録に使う）
+        """
+        line = json.dumps({**record, 'time': time.time()}, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        記録を古い順に返す
+
+        書き込み途中で落ちた最後の行など、読めない行は無視する。
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                yield record
+
+    def clear(self):
+        """マニフェストへ反映し終えた記録を消す"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,125 @@
+"""
+ラウドネスの正規化
+
+ffmpegのloudnormフィルターで出力の音量を目標のラウドネス（LUFS）にそろえる。
+
+2パス（既定）では、まず入力全体を解析して入力のラウドネス・トゥルーピーク・ラウドネスレンジを
+測り、その値を渡してエンコードする。条件が合えば音声全体に同じゲインをかける（linearモード）ため、
+音の強弱が変わらない。測定値は入力だけで決まるため、入力のパス・サイズ・更新時刻をキーに
+保存しておけば、ビットレートやプロファイルを変えて変換し直すときに解析を省ける。
+
+1パスでは解析をせず、エンコードしながら音量を動的に調整する。入力を1度しか読まずに済むが、
+動的な調整は解析と同じくらい重く、音の強弱も平らになる。
+"""
+import json
+import math
+from typing import List, NamedTuple, Optional, Sequence
+
+# ポッドキャストで一般的な目標値
+DEFAULT_INTEGRATED = -16.0
+DEFAULT_TRUE_PEAK = -1.5
+DEFAULT_LRA = 11.0
+
+
+class LoudnessTarget(NamedTuple):
+    """
+    正規化の目標
+
+    integrated: 目標の統合ラウドネス（LUFS）
+    true_peak: トゥルーピークの上限（dBTP）
+    lra: ラウドネスレンジの目標（LU）
+    single_pass: 解析をせず1パスで動的に調整する
+    """
+    integrated: float = DEFAULT_INTEGRATED
+    true_peak: float = DEFAULT_TRUE_PEAK
+    lra: float = DEFAULT_LRA
+    single_pass: bool = False
+
+    def filter(self, measurement: Optional['LoudnessMeasurement'] = None) -> str:
+        """
+        loudnormフィルターの指定
+
+        Args:
+            measurement: 解析結果（Noneなら1パスの動的な調整）
+        """
+        options = f"I={self.integrated:g}:TP={self.true_peak:g}:LRA={self.lra:g}"
+        if measurement is None:
+            return f"loudnorm={options}"
+        return (
+            f"loudnorm={options}"
+            f":measured_I={measurement.input_i:g}"
+            f":measured_TP={measurement.input_tp:g}"
+            f":measured_LRA={measurement.input_lra:g}"
+            f":measured_thresh={measurement.input_thresh:g}"
+            ":linear=true"
+        )
+
+
+class LoudnessMeasurement(NamedTuple):
+    """1パス目の解析で測った入力の値（目標によらない）"""
+    input_i: float
+    input_tp: float
+    input_lra: float
+    input_thresh: float
+
+
+def analysis_args(input_file: str, target: LoudnessTarget) -> List[str]:
+    """入力を解析して測定値を標準エラー出力に書き出すffmpegの引数（入力〜出力）"""
+    return [
+        '-i', input_file,
+        '-map', '0:a:0',
+        '-vn',
+        '-af', f"{target.filter()}:print_format=json",
+        '-f', 'null',
+        '-',
+    ]
+
+
+def parse_measurement(stderr_lines: Sequence[str]) -> Optional[LoudnessMeasurement]:
+    """
+    解析の標準エラー出力から測定値を取り出す
+
+    Returns:
+        Optional[LoudnessMeasurement]: 測定値。見つからない場合や、無音などで
+        測れなかった場合（値が有限でない）はNone
+    """
+    lines = [line.strip() for line in stderr_lines]
+    try:
+        end = len(lines) - 1 - lines[::-1].index('}')
+        start = end - lines[end::-1].index('{')
+        values = json.loads("\n".join(lines[start:end + 1]))
+        measurement = LoudnessMeasurement(
+            float(values['input_i']),
+            float(values['input_tp']),
+            float(values['input_lra']),
+            float(values['input_thresh']),
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not all(math.isfinite(value) for value in measurement):
+        return None
+    return measurement
+
+
+def loudness_args(
+    target: LoudnessTarget,
+    measurement: Optional[LoudnessMeasurement],
+    codec_args: Sequence[str],
+    sample_rate: Optional[int]
+) -> List[str]:
+    """
+    エンコード引数に加える正規化の引数
+
+    loudnormは192kHzで出力するため、プロファイルがサンプルレートを指定していなければ
+    入力のサンプルレートに戻す。
+
+    Args:
+        target: 正規化の目標
+        measurement: 解析結果（Noneなら1パスの動的な調整）
+        codec_args: プロファイルのエンコード引数
+        sample_rate: 入力のサンプルレート
+    """
+    args = ['-af', target.filter(measurement)]
+    if '-ar' not in codec_args and sample_rate:
+        args += ['-ar', str(sample_rate)]
+    return args
@@ -0,0 +1,367 @@
+"""出力ディレクトリごとの変換記録（再変換の省略に使う）"""
+import hashlib
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+from .journal import JOURNAL_FILENAME, JobJournal, replace_durably
+from .loudness import LoudnessMeasurement
+
+if TYPE_CHECKING:
+    from .dedup import ContentFingerprint
+
+# 出力ディレクトリに置く変換済みファイルの記録
+MANIFEST_FILENAME = ".mp4_to_mp3_manifest.json"
+MANIFEST_VERSION = 1
+
+# 抜き出しのハッシュに使うブロックの大きさと数
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 4
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル内容のSHA-256を計算する"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sample_digest(path: str, size: Optional[int] = None) -> str:
+    """
+    ファイルのサイズと、均等な位置から抜き出したブロックのハッシュ
+
+    小さいファイルは全体を読む。
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_BLOCK_SIZE * SAMPLE_BLOCKS:
+            digest.update(f.read())
+        else:
+            last = size - SAMPLE_BLOCK_SIZE
+            for block in range(SAMPLE_BLOCKS):
+                f.seek(last * block // (SAMPLE_BLOCKS - 1))
+                digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """
+    出力ディレクトリごとの変換記録
+
+    入力ファイルの同一性（パス・サイズ・更新日時、任意で内容ハッシュ）、
+    エンコード設定、出力ファイルのチェックサムを記録し、
+    変更のない入力の再変換を省略するために使う。
+
+    記録はsave()までメモリ上にあるが、ジョブの状態遷移はその都度
+    ジャーナルに追記されるため、途中で落ちても次回の読み込み時に復元される。
+    """
+
+    def __init__(self, output_dir: str, hash_inputs: bool = False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.hash_inputs = hash_inputs
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        self.journal = JobJournal(os.path.join(output_dir, JOURNAL_FILENAME))
+        # 前回の実行で開始したまま終わらなかった入力（ジャーナルから復元）
+        self.interrupted: List[str] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir: str, hash_inputs: bool = False) -> 'ConversionManifest':
+        """
+        出力ディレクトリから記録を読み込む
+
+        ファイルがない、または壊れている場合は空の記録を返す。
+        前回の実行のジャーナルが残っていれば、その内容も反映し、
+        中断したジョブが書きかけていた一時ファイルを削除する。
+        """
+        manifest = cls(output_dir, hash_inputs)
+        try:
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION:
+            manifest.entries = data.get('entries') or {}
+        manifest._replay_journal()
+        return manifest
+
+    def _replay_journal(self):
+        states: Dict[str, str] = {}
+        partials: Dict[str, List[str]] = {}
+        for record in self.journal.replay():
+            key = record.get('input')
+            state = record.get('state')
+            if not key or not state:
+                continue
+            states[key] = state
+            if state == 'started':
+                partials[key] = record.get('partials') or []
+            if state == 'done' and isinstance(record.get('entry'), dict):
+                self.entries[key] = record['entry']
+                self.dirty = True
+        self.interrupted = [key for key, state in states.items() if state == 'started']
+        # 落ちたときに書きかけだった一時ファイルは、次の変換でも使われないことがあるため消す
+        for key in self.interrupted:
+            for partial in partials.get(key, []):
+                try:
+                    os.remove(os.path.join(self.output_dir, partial))
+                except OSError:
+                    pass
+
+    def save(self):
+        """記録を一時ファイル経由で書き込んで置き換え、反映済みのジャーナルを消す"""
+        with self._lock:
+            if self.dirty:
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(
+                        {'version': MANIFEST_VERSION, 'entries': self.entries},
+                        f, ensure_ascii=False, indent=1
+                    )
+                replace_durably(temp_path, self.path)
+                self.dirty = False
+            self.journal.clear()
+
+    def mark(self, input_file: str, state: str, message: str = "", partials: Sequence[str] = ()):
+        """
+        ジョブの状態遷移（started/failed/cancelled）をジャーナルに追記する
+
+        完了はrecord()が記録する。
+
+        Args:
+            input_file: 入力ファイル
+            state: 状態
+            message: 失敗の理由など
+            partials: ジョブが書き込む一時ファイル（中断した場合に次回の読み込みで削除する）
+        """
+        record: Dict[str, Any] = {'state': state, 'input': self._key(input_file)}
+        if message:
+            record['message'] = message
+        if partials:
+            record['partials'] = [os.path.relpath(partial, self.output_dir) for partial in partials]
+        self.journal.append(record)
+
+    @staticmethod
+    def _key(input_file: str) -> str:
+        return os.path.abspath(input_file)
+
+    def lookup(
+        self,
+        input_file: str,
+        params: Dict[str, Any],
+        verify_output: bool = False
+    ) -> Optional[str]:
+        """
+        変換済みで再変換が不要な場合、その出力ファイルを返す
+
+        Args:
+            input_file: 入力ファイル
+            params: 今回のエンコード設定
+            verify_output: 出力ファイルのチェックサムまで照合する場合True
+
+        Returns:
+            Optional[str]: 有効な出力ファイル。再変換が必要な場合None
+        """
+        entry = self.entries.get(self._key(input_file))
+        if not entry or entry.get('params') != params:
+            return None
+        try:
+            stat = os.stat(input_file)
+        except OSError:
+            return None
+
+        if not self._input_unchanged(input_file, stat, entry['input']):
+            return None
+
+        outputs = self._valid_outputs(entry, verify_output)
+        return outputs[0] if outputs else None
+
+    def lookup_loudness(self, input_file: str) -> Optional[LoudnessMeasurement]:
+        """
+        記録したときから変更のない入力のラウドネスの測定値
+
+        測定値は目標や設定によらないため、設定が変わった記録のものも使う。
+
+        Returns:
+            Optional[LoudnessMeasurement]: 測定値。記録がないか入力が変更された場合None
+        """
+        entry = self.entries.get(self._key(input_file))
+        if not entry or not entry['input'].get('loudness'):
+            return None
+        try:
+            stat = os.stat(input_file)
+        except OSError:
+            return None
+        if not self._input_unchanged(input_file, stat, entry['input']):
+            return None
+        return LoudnessMeasurement(*entry['input']['loudness'])
+
+    def _input_unchanged(self, input_file: str, stat: os.stat_result, source: Dict[str, Any]) -> bool:
+        """入力が記録したときから変わっていないか"""
+        if stat.st_size != source['size']:
+            return False
+        if stat.st_mtime_ns != source['mtime_ns']:
+            # 更新日時だけが変わった場合は内容ハッシュで同一性を確認する
+            if not source.get('sha256') or file_sha256(input_file) != source['sha256']:
+                return False
+            source['mtime_ns'] = stat.st_mtime_ns
+            self.dirty = True
+        return True
+
+    def _valid_outputs(self, entry: Dict[str, Any], verify_output: bool = False) -> Optional[List[str]]:
+        """記録どおりに残っている場合、記録の出力ファイルを返す"""
+        outputs = []
+        for output in [entry['output'], *entry.get('extra_outputs', [])]:
+            output_file = os.path.join(self.output_dir, output['path'])
+            try:
+                if os.path.getsize(output_file) != output['size']:
+                    return None
+            except OSError:
+                return None
+            if verify_output and file_sha256(output_file) != output['sha256']:
+                return None
+            outputs.append(output_file)
+        return outputs
+
+    def find_same_content(
+        self,
+        fingerprint: 'ContentFingerprint',
+        params: Dict[str, Any]
+    ) -> Optional[Tuple[str, List[str]]]:
+        """
+        同じ内容の別の入力を同じ設定で変換した記録を探す
+
+        サイズ、抜き出しのハッシュ、全体のハッシュの順に照合する。記録にないハッシュは
+        記録時から変更のない入力からだけ計算し、記録に加える。
+
+        Returns:
+            Optional[Tuple[str, List[str]]]: (その入力, 残っている出力ファイル)。なければNone
+        """
+        key = self._key(fingerprint.path)
+        with self._lock:
+            candidates = [
+                (other, entry) for other, entry in self.entries.items()
+                if other != key
+                and entry.get('params') == params
+                and entry['input']['size'] == fingerprint.size
+            ]
+        for other, entry in candidates:
+            source = entry['input']
+            if self._source_digest(other, source, 'sample') != fingerprint.sample:
+                continue
+            if self._source_digest(other, source, 'sha256') != fingerprint.sha256:
+                continue
+            outputs = self._valid_outputs(entry)
+            if outputs:
+                return other, outputs
+        return None
+
+    def _source_digest(self, input_file: str, source: Dict[str, Any], name: str) -> Optional[str]:
+        if source.get(name):
+            return source[name]
+        try:
+            stat = os.stat(input_file)
+            if (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime_ns']):
+                return None
+            if name == 'sample':
+                value = sample_digest(input_file, stat.st_size)
+            else:
+                value = file_sha256(input_file)
+        except OSError:
+            return None
+        with self._lock:
+            source[name] = value
+            self.dirty = True
+        return value
+
+    def extra_outputs(self, input_file: str) -> List[str]:
+        """記録されている2つ目以降の出力ファイル（出力プロファイルが複数の場合）"""
+        entry = self.entries.get(self._key(input_file)) or {}
+        return [
+            os.path.join(self.output_dir, output['path'])
+            for output in entry.get('extra_outputs', [])
+        ]
+
+    def _output_record(self, output_file: str) -> Dict[str, Any]:
+        return {
+            'path': os.path.relpath(output_file, self.output_dir),
+            'size': os.path.getsize(output_file),
+            'sha256': file_sha256(output_file),
+        }
+
+    def record(
+        self,
+        input_file: str,
+        output_file: str,
+        params: Dict[str, Any],
+        extra_outputs: Sequence[str] = (),
+        fingerprint: Optional['ContentFingerprint'] = None,
+        loudness: Optional[LoudnessMeasurement] = None
+    ):
+        """
+        変換に成功した入力と出力を記録する
+
+        fingerprintを渡すと、同じ内容の入力を後で探せるよう抜き出しのハッシュも残す。
+        loudnessを渡すと、設定を変えた再変換で解析を省けるよう入力の測定値も残す。
+        """
+        stat = os.stat(input_file)
+        source: Dict[str, Any] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+        if fingerprint is not None:
+            source['sample'] = fingerprint.sample
+            if fingerprint.known_sha256:
+                source['sha256'] = fingerprint.known_sha256
+        if self.hash_inputs and 'sha256' not in source:
+            source['sha256'] = file_sha256(input_file)
+        if loudness is not None:
+            source['loudness'] = list(loudness)
+        entry: Dict[str, Any] = {
+            'input': source,
+            'params': params,
+            'output': self._output_record(output_file),
+        }
+        if extra_outputs:
+            entry['extra_outputs'] = [self._output_record(path) for path in extra_outputs]
+        key = self._key(input_file)
+        with self._lock:
+            # 完了はディスクに書かれてから次へ進む（落ちても次回に復元できる）
+            self.journal.append({'state': 'done', 'input': key, 'entry': entry}, durable=True)
+            self.entries[key] = entry
+            self.dirty = True
+
+    def prune(self) -> List[str]:
+        """
+        入力が変更・削除された、または出力が失われた記録を削除する
+
+        Returns:
+            List[str]: 削除した記録の入力ファイル
+        """
+        removed = []
+        for key, entry in list(self.entries.items()):
+            outputs = [entry['output'], *entry.get('extra_outputs', [])]
+            try:
+                stat = os.stat(key)
+                output_sizes = [
+                    os.path.getsize(os.path.join(self.output_dir, output['path']))
+                    for output in outputs
+                ]
+            except OSError:
+                stale = True
+            else:
+                stale = output_sizes != [output['size'] for output in outputs] or \
+                    not self._input_unchanged(key, stat, entry['input'])
+            if stale:
+                del self.entries[key]
+                removed.append(key)
+        if removed:
+            self.dirty = True
+        return removed
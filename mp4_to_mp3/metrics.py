@@ -0,0 +1,329 @@
+"""
+変換ジョブの計測値と実行レポート
+
+BatchReportをエンジンのリスナーとして登録すると、完了したジョブの
+段階ごとの所要時間などを集め、JSON/CSVのレポートや
+Prometheus node-exporterのtextfile collector用ファイルに書き出せる。
+"""
+import csv
+import io
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .engine import ConversionEvent, ConversionJob, EventKind, JobStatus
+
+# 出力ディレクトリに置くレポートのファイル名
+REPORT_JSON_FILENAME = "conversion_report.json"
+REPORT_CSV_FILENAME = "conversion_report.csv"
+REPORT_VERSION = 1
+
+# レポートに含める段階（ConversionJob.timingsのキー）
+STAGES = ('queue_wait', 'probe', 'analyze', 'encode', 'finalize')
+
+# Prometheusのメトリクス名の接頭辞
+METRIC_PREFIX = "mp4_to_mp3"
+
+CSV_FIELDS = [
+    'input_file', 'output_file', 'status',
+    'duration_seconds', 'output_bytes',
+    *(f'{stage}_seconds' for stage in STAGES),
+    'latency_seconds', 'realtime_factor',
+    'returncode', 'error', 'duplicate_of',
+]
+
+
+def _cpu_seconds() -> Optional[float]:
+    """このプロセスと終了済みの子プロセス（ffmpeg）のCPU時間の合計"""
+    if resource is None:
+        return None
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def percentile(values: Sequence[float], fraction: float) -> Optional[float]:
+    """最近傍順位法によるパーセンタイル（値がなければNone）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def job_realtime_factor(job: ConversionJob) -> Optional[float]:
+    """
+    入力の長さ÷処理時間（キュー待ちを除く）
+
+    エンコードしたジョブだけが対象で、スキップしたジョブや同じ内容の出力へ
+    リンクしたジョブはsummary()と同じく除く（None）。
+    """
+    if job.status != JobStatus.DONE or job.duplicate_of:
+        return None
+    if job.media is None or not job.media.duration:
+        return None
+    if job.started_at is None or job.finished_at is None:
+        return None
+    elapsed = job.finished_at - job.started_at
+    return job.media.duration / elapsed if elapsed > 0 else None
+
+
+def job_record(job: ConversionJob) -> Dict[str, Any]:
+    """ジョブ1件分のレポート行"""
+    record: Dict[str, Any] = {
+        'input_file': job.input_file,
+        'output_file': job.output_file,
+        'status': job.status,
+        'duration_seconds': job.media.duration if job.media else None,
+        'output_bytes': job.output_size,
+    }
+    for stage in STAGES:
+        record[f'{stage}_seconds'] = job.timings.get(stage)
+    record['latency_seconds'] = job.latency
+    record['realtime_factor'] = job_realtime_factor(job)
+    record['returncode'] = job.returncode
+    record['error'] = job.error_message if job.status == JobStatus.FAILED else ""
+    record['duplicate_of'] = job.duplicate_of or ""
+    return record
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """残り時間を「1:02:03」や「2:05」の形にする（不明なら空文字列）"""
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class EtaEstimator:
+    """
+    バッチの残り時間を見積もる
+
+    エンジンのリスナーとして登録すると、これまでに処理した入力の長さと
+    経過時間から実時間比を随時更新し、残りの入力の長さから残り時間を求める。
+    変換済みで省略されたジョブと失敗したジョブは見積もりから除く。
+    """
+
+    def __init__(self, jobs: Sequence[ConversionJob]):
+        self.jobs = jobs
+        self.started_at: Optional[float] = None
+        # ジョブの番号 -> 処理済みの入力の長さ（秒）
+        self._processed: Dict[int, float] = {}
+        self._excluded: set = set()
+
+    def __call__(self, event: ConversionEvent):
+        job = event.job
+        if job is None:
+            return
+        if event.kind == EventKind.STARTED and self.started_at is None:
+            self.started_at = time.monotonic()
+        elif event.kind == EventKind.PROGRESS and event.fraction is not None:
+            self._processed[job.index] = event.fraction * self._duration(job)
+        elif event.kind == EventKind.FINISHED:
+            if job.status == JobStatus.DONE:
+                self._processed[job.index] = self._duration(job)
+            else:
+                self._processed.pop(job.index, None)
+                self._excluded.add(job.index)
+
+    @staticmethod
+    def _duration(job: ConversionJob) -> float:
+        return (job.media.duration or 0.0) if job.media else 0.0
+
+    def realtime_factor(self, now: Optional[float] = None) -> Optional[float]:
+        """これまでの処理速度（入力の長さ÷経過時間、全ワーカーの合計）"""
+        if self.started_at is None:
+            return None
+        elapsed = (now if now is not None else time.monotonic()) - self.started_at
+        processed = sum(self._processed.values())
+        if elapsed <= 0 or processed <= 0:
+            return None
+        return processed / elapsed
+
+    def remaining_seconds(self, now: Optional[float] = None) -> Optional[float]:
+        """残り時間の見積もり（秒）。まだ見積もれない場合はNone"""
+        rate = self.realtime_factor(now)
+        if rate is None:
+            return None
+        total = sum(
+            self._duration(job) for job in self.jobs if job.index not in self._excluded
+        )
+        return max(0.0, total - sum(self._processed.values())) / rate
+
+
+def _write_atomic(path: str, text: str):
+    """一時ファイルに書いてから置き換える（読み手が途中の内容を見ないように）"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class BatchReport:
+    """
+    1回の一括変換の計測値を集める
+
+    エンジンのリスナーとして登録し、変換の前後でstart()とfinish()を呼ぶ。
+    """
+
+    def __init__(self):
+        self.jobs: List[ConversionJob] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.timestamp: Optional[float] = None
+        self._cpu_start: Optional[float] = None
+        self._cpu_end: Optional[float] = None
+
+    def __call__(self, event: ConversionEvent):
+        if event.kind == EventKind.FINISHED:
+            self.jobs.append(event.job)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._cpu_start = _cpu_seconds()
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+        self.timestamp = time.time()
+        self._cpu_end = _cpu_seconds()
+
+    @property
+    def wall_seconds(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def cpu_seconds(self) -> Optional[float]:
+        if self._cpu_start is None or self._cpu_end is None:
+            return None
+        return self._cpu_end - self._cpu_start
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        バッチ全体の集計値
+
+        Returns:
+            Dict[str, Any]: ファイル数（状態別、同じ内容の入力から作った数）、経過時間、CPU時間と使用率、
+            入力の長さの合計、実時間比、ジョブのレイテンシのp50/p95、
+            段階ごとの所要時間の合計
+        """
+        by_status = {status: 0 for status in (JobStatus.DONE, JobStatus.SKIPPED, JobStatus.FAILED)}
+        for job in self.jobs:
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+
+        wall = self.wall_seconds
+        cpu = self.cpu_seconds
+        cpu_utilization = None
+        if wall and cpu is not None:
+            cpu_utilization = cpu / (wall * (os.cpu_count() or 1))
+
+        # 同じ内容の入力の出力から作ったジョブはエンコードしていないため実時間比に含めない
+        converted = [job for job in self.jobs if job.status == JobStatus.DONE and not job.duplicate_of]
+        media_seconds = sum(job.media.duration for job in converted if job.media and job.media.duration)
+        latencies = [job.latency for job in self.jobs if job.latency is not None]
+        stage_seconds = {
+            stage: sum(job.timings.get(stage, 0.0) for job in self.jobs) for stage in STAGES
+        }
+        return {
+            'files': len(self.jobs),
+            'files_by_status': by_status,
+            'files_deduplicated': sum(1 for job in self.jobs if job.duplicate_of),
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'cpu_count': os.cpu_count(),
+            'cpu_utilization': cpu_utilization,
+            'media_seconds': media_seconds,
+            'realtime_factor': media_seconds / wall if wall else None,
+            'latency_p50_seconds': percentile(latencies, 0.50),
+            'latency_p95_seconds': percentile(latencies, 0.95),
+            'stage_seconds': stage_seconds,
+        }
+
+    def write_json(self, path: str):
+        report = {
+            'version': REPORT_VERSION,
+            'timestamp': self.timestamp,
+            'summary': self.summary(),
+            'jobs': [
+                {**job_record(job), 'extra_outputs': job.extra_outputs, 'stderr_tail': job.stderr_tail}
+                for job in self._ordered_jobs()
+            ],
+        }
+        _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+
+    def write_csv(self, path: str):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for job in self._ordered_jobs():
+            writer.writerow(job_record(job))
+        _write_atomic(path, buffer.getvalue())
+
+    def write_reports(self, output_dir: str) -> List[str]:
+        """
+        出力ディレクトリにJSONとCSVのレポートを書き込む
+
+        Returns:
+            List[str]: 書き込んだファイルのパス
+        """
+        json_path = os.path.join(output_dir, REPORT_JSON_FILENAME)
+        csv_path = os.path.join(output_dir, REPORT_CSV_FILENAME)
+        self.write_json(json_path)
+        self.write_csv(csv_path)
+        return [json_path, csv_path]
+
+    def prometheus_text(self) -> str:
+        """node-exporterのtextfile collector形式のメトリクス"""
+        summary = self.summary()
+        lines: List[str] = []
+
+        def gauge(name: str, help_text: str, samples: Dict[str, Optional[float]]):
+            samples = {labels: value for labels, value in samples.items() if value is not None}
+            if not samples:
+                return
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in samples.items():
+                lines.append(f"{metric}{labels} {value}")
+
+        gauge('batch_files', "Files in the last batch by status.", {
+            f'{{status="{status}"}}': count for status, count in summary['files_by_status'].items()
+        })
+        gauge('batch_deduplicated_files', "Files whose outputs were linked from identical content.", {
+            '': summary['files_deduplicated']
+        })
+        gauge('batch_wall_seconds', "Wall-clock time of the last batch.", {'': summary['wall_seconds']})
+        gauge('batch_cpu_seconds', "CPU time of the last batch including ffmpeg.", {'': summary['cpu_seconds']})
+        gauge('batch_cpu_utilization', "CPU time divided by wall time and CPU count.", {
+            '': summary['cpu_utilization']
+        })
+        gauge('batch_media_seconds', "Input duration converted in the last batch.", {'': summary['media_seconds']})
+        gauge('batch_realtime_factor', "Input duration divided by wall time.", {'': summary['realtime_factor']})
+        gauge('job_latency_seconds', "Job latency from queueing to completion.", {
+            '{quantile="0.5"}': summary['latency_p50_seconds'],
+            '{quantile="0.95"}': summary['latency_p95_seconds'],
+        })
+        gauge('batch_stage_seconds', "Time spent in each stage summed over jobs in the last batch.", {
+            f'{{stage="{stage}"}}': seconds for stage, seconds in summary['stage_seconds'].items()
+        })
+        gauge('last_batch_timestamp_seconds', "Unix time the last batch finished.", {'': self.timestamp})
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """textfile collectorが途中の内容を読まないよう一時ファイル経由で書き込む"""
+        _write_atomic(path, self.prometheus_text())
+
+    def _ordered_jobs(self) -> List[ConversionJob]:
+        return sorted(self.jobs, key=lambda job: job.index)
@@ -0,0 +1,149 @@
+"""
+ffprobeの結果のキャッシュ
+
+入力ファイルのパス・サイズ・更新時刻をキーにSQLiteへ保存し、
+変更されていないファイルは次回以降ffprobeを起動せずに済ませる。
+ラウドネスの解析結果も同じキーで保存し、変換し直すときの解析を省く。
+"""
+import os
+import sqlite3
+import sys
+from typing import Dict, Iterable, Optional, Tuple
+
+from .engine import MediaInfo
+from .loudness import LoudnessMeasurement
+
+INDEX_FILENAME = "probe_index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    codec TEXT,
+    sample_rate INTEGER,
+    channels INTEGER,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS loudness (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    input_i REAL NOT NULL,
+    input_tp REAL NOT NULL,
+    input_lra REAL NOT NULL,
+    input_thresh REAL NOT NULL
+);
+"""
+
+
+def default_cache_dir() -> str:
+    """ユーザーのキャッシュディレクトリ（このアプリ用のサブディレクトリ）"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'mp4_to_mp3')
+
+
+def default_index_path() -> str:
+    """ユーザーのキャッシュディレクトリに置くインデックスのパス"""
+    return os.path.join(default_cache_dir(), INDEX_FILENAME)
+
+
+def _file_key(path: str) -> Optional[Tuple[str, int, int]]:
+    """(絶対パス, サイズ, 更新時刻)。ファイルがなければNone"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+class ProbeIndex:
+    """パス・サイズ・更新時刻をキーにしたffprobe結果の索引"""
+
+    def __init__(self, path: str = ":memory:"):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # GUIでは作成したスレッドと変換を実行するスレッドが異なる（同時には使わない）
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def lookup_many(self, paths: Iterable[str]) -> Dict[str, Optional[MediaInfo]]:
+        """
+        変更されていないファイルの解析結果をまとめて取り出す
+
+        Returns:
+            Dict[str, Optional[MediaInfo]]: 入力パス -> 解析結果
+            （未登録・変更あり・存在しないファイルはNone）
+        """
+        results: Dict[str, Optional[MediaInfo]] = {}
+        cursor = self._connection.cursor()
+        for path in paths:
+            results[path] = None
+            key = _file_key(path)
+            if key is None:
+                continue
+            row = cursor.execute(
+                "SELECT codec, sample_rate, channels, duration FROM probes"
+                " WHERE path = ? AND size = ? AND mtime_ns = ?",
+                key
+            ).fetchone()
+            if row is not None:
+                results[path] = MediaInfo(*row)
+        return results
+
+    def lookup(self, path: str) -> Optional[MediaInfo]:
+        return self.lookup_many([path])[path]
+
+    def store_many(self, media: Dict[str, MediaInfo]):
+        """解析結果をまとめて保存する（1回のトランザクションで書き込む）"""
+        rows = []
+        for path, info in media.items():
+            key = _file_key(path)
+            if key is not None:
+                rows.append((*key, *info))
+        if rows:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO probes"
+                    " (path, size, mtime_ns, codec, sample_rate, channels, duration)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def store(self, path: str, media: MediaInfo):
+        self.store_many({path: media})
+
+    def lookup_loudness(self, path: str) -> Optional[LoudnessMeasurement]:
+        """変更されていないファイルのラウドネスの解析結果（なければNone）"""
+        key = _file_key(path)
+        if key is None:
+            return None
+        row = self._connection.execute(
+            "SELECT input_i, input_tp, input_lra, input_thresh FROM loudness"
+            " WHERE path = ? AND size = ? AND mtime_ns = ?",
+            key
+        ).fetchone()
+        return LoudnessMeasurement(*row) if row is not None else None
+
+    def store_loudness(self, path: str, measurement: LoudnessMeasurement):
+        """ラウドネスの解析結果を保存する"""
+        key = _file_key(path)
+        if key is None:
+            return
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO loudness"
+                " (path, size, mtime_ns, input_i, input_tp, input_lra, input_thresh)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, *measurement)
+            )
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,178 @@
+"""
+出力プロファイル
+
+1つの入力から作る出力ファイルごとのエンコード設定とファイル名のテンプレート。
+複数のプロファイルは1回のffmpeg実行でまとめて書き出すため、
+入力の読み込みとデコードは1度で済む。
+"""
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+
+class OutputProfile(NamedTuple):
+    """
+    出力ファイル1つ分の設定
+
+    template: 出力ファイル名。{stem}は入力のベース名（拡張子なし）、{name}はプロファイル名
+    bitrate: libmp3lameのビットレート
+    channels: チャンネル数（Noneなら入力と同じ）
+    sample_rate: サンプルレート（Noneなら入力と同じ）
+    stream_copy: 入力の音声がそのまま使える場合は再エンコードせずに取り出す
+    quality: VBRの品質（0が最高、9が最小。指定するとbitrateは使わない）
+    compression_level: LAMEのアルゴリズム品質（0が最高で最も遅く、9が最も速い。Noneならffmpegの既定）
+    """
+    name: str
+    template: str = "{stem}.mp3"
+    bitrate: str = "192k"
+    channels: Optional[int] = None
+    sample_rate: Optional[int] = None
+    stream_copy: bool = False
+    quality: Optional[int] = None
+    compression_level: Optional[int] = None
+
+    def filename(self, input_file: str) -> str:
+        stem = os.path.splitext(os.path.basename(input_file))[0]
+        return self.template.format(stem=stem, name=self.name)
+
+    def codec_args(self) -> List[str]:
+        """再エンコードするときのffmpegの引数"""
+        args = ['-acodec', 'libmp3lame']
+        if self.quality is not None:
+            args += ['-q:a', str(self.quality)]
+        else:
+            args += ['-b:a', self.bitrate]
+        if self.compression_level is not None:
+            args += ['-compression_level', str(self.compression_level)]
+        if self.channels:
+            args += ['-ac', str(self.channels)]
+        if self.sample_rate:
+            args += ['-ar', str(self.sample_rate)]
+        return args
+
+    def params(self) -> Dict[str, Any]:
+        """
+        変換記録と照合する設定
+
+        未指定のエンコーダー設定は含めない（設定が追加される前の記録とも一致させるため）。
+        """
+        return {
+            key: value for key, value in self._asdict().items()
+            if value is not None or key not in _ENCODER_OPTIONS
+        }
+
+
+_ENCODER_OPTIONS = ('quality', 'compression_level')
+
+# 既定のプロファイル（192kbpsのMP3。音声が既にMP3ならそのまま取り出す）
+DEFAULT_PROFILE = OutputProfile('default', stream_copy=True)
+
+# 用途ごとのエンコード設定（速度と出力サイズの測定値はREADMEの「エンコード設定のプリセット」を参照）
+PRESETS: Dict[str, OutputProfile] = {
+    # 192kbpsのCBR（既定のプロファイルと同じなので、既存の変換記録もそのまま使える）
+    'default': DEFAULT_PROFILE,
+    # 192kbpsのCBRを速いアルゴリズムで（音質の差は小さく、エンコードは速い）
+    'fast': OutputProfile('fast', compression_level=7),
+    # VBR（LAMEの-V2相当。ビットレートは内容に応じて変わり、多くの場合192kbpsのCBRより小さい）
+    'vbr': OutputProfile('vbr', quality=2),
+    # 講義や会議の音声向け（モノラル・24kHz・VBR、平均およそ35kbps）
+    'speech': OutputProfile('speech', channels=1, sample_rate=24000, quality=7),
+    # 音声向けで最も速く小さい設定（モノラル・22.05kHz・48kbpsのCBR）
+    'speech-fast': OutputProfile('speech-fast', bitrate='48k', channels=1, sample_rate=22050, compression_level=9),
+    # 保存用の最高品質（320kbpsのCBR、LAMEの高品質アルゴリズム）
+    'archive': OutputProfile('archive', bitrate='320k', compression_level=2),
+}
+
+_CHANNEL_NAMES = {'mono': 1, 'stereo': 2}
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def parse_profile(spec: str) -> OutputProfile:
+    """
+    コマンドラインのプロファイル指定を解釈する
+
+    形式は「名前[,キー=値...]」。キーはpreset（PRESETSの名前。ほかのキーの既定値になる）、
+    bitrate、quality（VBR）、compression_level、channels（数値またはmono/stereo）、
+    sample_rate、template、copy。templateの既定は「{stem}_{名前}.mp3」。
+
+    例: podcast,bitrate=64k,channels=mono
+        lecture,preset=speech,quality=6
+
+    Raises:
+        ValueError: 形式が正しくない場合
+    """
+    name, *options = [part.strip() for part in spec.split(',')]
+    if not name or '=' in name:
+        raise ValueError(f"プロファイル名がありません: {spec}")
+    values: Dict[str, str] = {}
+    for option in options:
+        key, separator, value = option.partition('=')
+        if not separator or not value:
+            raise ValueError(f"「キー=値」の形式で指定してください: {option}")
+        values[key.strip()] = value.strip()
+
+    unknown = set(values) - {
+        'preset', 'bitrate', 'quality', 'compression_level', 'channels', 'sample_rate', 'template', 'copy'
+    }
+    if unknown:
+        raise ValueError(f"不明な設定です: {', '.join(sorted(unknown))}")
+    base = preset_profile(values['preset']) if 'preset' in values else OutputProfile(name)
+    channels = values.get('channels')
+    try:
+        profile = base._replace(
+            name=name,
+            template=values.get('template', "{stem}_{name}.mp3"),
+            bitrate=values.get('bitrate', base.bitrate),
+            channels=(_CHANNEL_NAMES.get(channels) or int(channels)) if channels else base.channels,
+            sample_rate=int(values['sample_rate']) if 'sample_rate' in values else base.sample_rate,
+            stream_copy=values['copy'].lower() in _TRUE_VALUES if 'copy' in values else base.stream_copy,
+            quality=int(values['quality']) if 'quality' in values else base.quality,
+            compression_level=(
+                int(values['compression_level']) if 'compression_level' in values else base.compression_level
+            ),
+        )
+    except ValueError:
+        raise ValueError(f"数値の指定が正しくありません: {spec}") from None
+    if profile.quality is not None and not 0 <= profile.quality <= 9:
+        raise ValueError(f"qualityは0〜9で指定してください: {spec}")
+    if profile.compression_level is not None and not 0 <= profile.compression_level <= 9:
+        raise ValueError(f"compression_levelは0〜9で指定してください: {spec}")
+    try:
+        profile.filename("input.mp4")
+    except (KeyError, IndexError, ValueError):
+        raise ValueError(f"ファイル名のテンプレートが正しくありません: {profile.template}") from None
+    return profile
+
+
+def preset_profile(name: str, template: str = "{stem}.mp3") -> OutputProfile:
+    """
+    名前付きのエンコード設定からプロファイルを作る
+
+    Args:
+        name: PRESETSの名前
+        template: 出力ファイル名のテンプレート
+
+    Raises:
+        ValueError: 不明な名前の場合
+    """
+    try:
+        return PRESETS[name]._replace(template=template)
+    except KeyError:
+        raise ValueError(f"不明なプリセットです: {name}（{', '.join(PRESETS)}）") from None
+
+
+def validate_profiles(profiles: Sequence[OutputProfile]):
+    """
+    プロファイルの組み合わせを確認する
+
+    Raises:
+        ValueError: プロファイルがない、または名前や出力ファイル名が重複する場合
+    """
+    if not profiles:
+        raise ValueError("プロファイルを1つ以上指定してください")
+    names = [profile.name for profile in profiles]
+    if len(set(names)) != len(names):
+        raise ValueError("プロファイル名が重複しています")
+    filenames = [profile.filename("input.mp4") for profile in profiles]
+    if len(set(filenames)) != len(filenames):
+        raise ValueError("出力ファイル名のテンプレートが重複しています")
@@ -0,0 +1,198 @@
+"""
+PyAVで変換する常駐ワーカー
+
+PyAVBackendが ``python -m mp4_to_mp3.pyav_worker`` で起動する。標準入力から1行に1つの
+JSONの依頼を読み、FFmpegのライブラリで変換する。1つのプロセスで多数のファイルを順に
+処理するため、ファイルごとのプロセスの起動とライブラリの読み込みがかからない。
+
+依頼: {"input": 入力ファイル, "outputs": [[出力ファイル, エンコード引数], ...]}
+エンコード引数はffmpegのものと同じ（engine.plan_outputsの結果。supported_argsで扱えるものだけ）。
+
+標準出力には進捗をffmpegの -progress と同じkey=value形式で書き、最後に
+``result={"returncode": 0}`` （失敗時は "error" も付く）を1行書く。
+"""
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import av
+
+# 進捗を書き出す間隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+# LAMEのVBRの品質（-q:a）をglobal_qualityに直す係数（FFmpegのFF_QP2LAMBDA）
+_QP2LAMBDA = 118
+
+# 値を取るエンコード引数
+_VALUE_OPTIONS = ('-b:a', '-q:a', '-compression_level', '-ac', '-ar')
+
+
+def _parse_codec_args(codec_args: Sequence[str]) -> Optional[Dict[str, str]]:
+    """エンコード引数を{オプション: 値}にする（扱えない引数があればNone）"""
+    if len(codec_args) % 2:
+        return None
+    options = dict(zip(codec_args[::2], codec_args[1::2]))
+    for option, value in options.items():
+        if option == '-acodec' and value == 'libmp3lame':
+            continue
+        if option == '-c:a' and value == 'copy':
+            continue
+        if option not in _VALUE_OPTIONS:
+            return None
+    return options
+
+
+def supported_args(codec_args: Sequence[str]) -> bool:
+    """PyAVで同じ出力を作れるエンコード引数か（フィルターなどはffmpegに任せる）"""
+    return _parse_codec_args(codec_args) is not None
+
+
+def probe_media(input_file: str) -> Optional[Tuple[str, Optional[int], Optional[int], Optional[float]]]:
+    """
+    先頭の音声ストリームを調べる（ffprobeの代わり）
+
+    Returns:
+        Optional[Tuple]: (コーデック名, サンプルレート, チャンネル数, 長さ（秒）)。
+        開けない、または音声がない場合None
+    """
+    try:
+        with av.open(input_file) as container:
+            if not container.streams.audio:
+                return None
+            stream = container.streams.audio[0]
+            if stream.duration is not None and stream.time_base is not None:
+                duration: Optional[float] = float(stream.duration * stream.time_base)
+            elif container.duration is not None:
+                duration = container.duration / av.time_base
+            else:
+                duration = None
+            return (
+                stream.codec_context.codec.canonical_name,
+                stream.codec_context.sample_rate or None,
+                stream.codec_context.channels or None,
+                duration,
+            )
+    except (av.FFmpegError, OSError):
+        return None
+
+
+def _add_output_stream(container, source, options: Dict[str, str]):
+    """出力ファイルに音声ストリームを加える（コピーか、libmp3lameでのエンコード）"""
+    if options.get('-c:a') == 'copy':
+        return container.add_stream_from_template(source)
+    codec_options = {}
+    if '-compression_level' in options:
+        codec_options['compression_level'] = options['-compression_level']
+    if '-q:a' in options:
+        # ffmpegの -q:a と同じく、コーデックのオプションとして渡す（属性の設定ではVBRにならない）
+        codec_options['flags'] = '+qscale'
+        codec_options['global_quality'] = str(int(options['-q:a']) * _QP2LAMBDA)
+    channels = int(options.get('-ac') or source.codec_context.channels)
+    rate = int(options.get('-ar') or source.codec_context.sample_rate)
+    # ffmpegと同じく、LAMEが扱えないサンプルレートは最も近いものにする
+    # （libmp3lameのないPyAVでもコピーはできるよう、エンコードするときに調べる）
+    lame = av.codec.Codec('libmp3lame', 'w')
+    rate = min(lame.audio_rates, key=lambda supported: abs(supported - rate))
+    stream = container.add_stream(
+        'libmp3lame',
+        rate=rate,
+        layout='mono' if channels == 1 else 'stereo',
+        options=codec_options,
+    )
+    if '-q:a' not in options:
+        stream.bit_rate = int(options.get('-b:a', '192k').lower().replace('k', '000'))
+    return stream
+
+
+def convert(
+    input_file: str,
+    outputs: Sequence[Tuple[str, Sequence[str]]],
+    report: Callable[[Optional[float]], None]
+):
+    """
+    先頭の音声ストリームを出力ごとの設定で書き出す（デコードは1度だけ行う）
+
+    Args:
+        input_file: 入力ファイル
+        outputs: (出力ファイル, エンコード引数)のリスト
+        report: 書き出した位置（秒）を受け取るコールバック
+
+    Raises:
+        ValueError: 音声ストリームがない、または扱えないエンコード引数の場合
+        av.FFmpegError: FFmpegのライブラリが失敗した場合
+    """
+    with av.open(input_file) as source:
+        if not source.streams.audio:
+            raise ValueError("音声ストリームがありません")
+        stream = source.streams.audio[0]
+        opened = []
+        encoding = []
+        copying = []
+        try:
+            for output_file, codec_args in outputs:
+                options = _parse_codec_args(codec_args)
+                if options is None:
+                    raise ValueError(f"扱えないエンコード引数です: {' '.join(codec_args)}")
+                container = av.open(output_file, 'w')
+                opened.append(container)
+                encoder = _add_output_stream(container, stream, options)
+                (copying if options.get('-c:a') == 'copy' else encoding).append((container, encoder))
+
+            for packet in source.demux(stream):
+                # 最後の空のパケットはデコーダーに残ったフレームを取り出すためだけに使う
+                flushing = packet.dts is None
+                position = float(packet.pts * packet.time_base) if packet.pts is not None else None
+                frames = packet.decode() if encoding else []
+                if not flushing:
+                    for container, encoder in copying:
+                        packet.stream = encoder
+                        container.mux(packet)
+                for frame in frames:
+                    for container, encoder in encoding:
+                        container.mux(encoder.encode(frame))
+                report(position)
+            for container, encoder in encoding:
+                container.mux(encoder.encode(None))
+        finally:
+            for container in opened:
+                container.close()
+
+
+def _write(line: str):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def serve():
+    """依頼を1行ずつ読んで変換し、標準入力が閉じられたら終了する"""
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request: Dict[str, Any] = json.loads(line)
+        started = time.monotonic()
+        reported_at = 0.0
+
+        def report(position: Optional[float]):
+            nonlocal reported_at
+            now = time.monotonic()
+            if position is None or now - reported_at < PROGRESS_INTERVAL:
+                return
+            reported_at = now
+            speed = position / (now - started) if now > started else 0.0
+            _write(f"out_time_us={int(position * 1000000)}")
+            _write(f"speed={speed:.3g}x")
+            _write("progress=continue")
+
+        result: Dict[str, Any] = {'returncode': 0}
+        try:
+            outputs: List[Tuple[str, List[str]]] = request['outputs']
+            convert(request['input'], outputs, report)
+            _write("progress=end")
+        except (av.FFmpegError, OSError, ValueError) as e:
+            result = {'returncode': 1, 'error': str(e)}
+        _write("result=" + json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    serve()
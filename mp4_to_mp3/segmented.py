@@ -0,0 +1,216 @@
+"""
+長い入力の分割並列エンコード
+
+音声を時間方向にN個の区間へ分け、区間ごとに別のffmpegプロセスで
+エンコードしてから1つのMP3に結合する。
+
+区間の継ぎ目で無音やずれが生じないよう、次のように処理する。
+
+- ビットリザーバーを無効にし（-reservoir 0）、各MP3フレームが
+  前のフレームのデータを参照しないようにする
+- LAMEのエンコーダー遅延とデコーダー遅延（合計1105サンプル）を考慮して、
+  区間の境界がちょうどフレーム境界に来る位置で分割する
+- 2番目以降の区間は境界より少し前から（プリロール）エンコードし、
+  助走部分のフレームを捨てる。区間末尾も少し余分にエンコードし、
+  境界までのフレームだけを残す
+- 残したフレームを連結し、concat demuxerでストリームコピーして
+  1つのファイルにまとめる（Xingヘッダーはここで書かれる）
+
+結合結果の音声は1回でエンコードした場合とサンプル単位で一致する。ただし
+結合後のXingヘッダーにはエンコーダー遅延の情報が入らないため、
+ギャップレス再生に対応したデコーダーでも先頭の約25ms（1105サンプル）は
+無音として残る。
+"""
+import math
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+# LAMEのエンコーダー遅延（576）とデコーダー遅延（529）の合計サンプル数
+LAME_DELAY = 1105
+
+# MPEG-1 Layer IIIの1フレームあたりのサンプル数。境界はこの倍数で決める
+FRAME_SAMPLES = 1152
+
+# 2番目以降の区間の前に付ける助走フレーム数
+PREROLL_FRAMES = 2
+
+# 区間末尾に余分にエンコードするフレーム数
+TAIL_FRAMES = 2
+
+# これより短い区間には分割しない（秒）
+MIN_SEGMENT_SECONDS = 60.0
+
+# 区間の開始位置をフレーム境界に合わせるための助走サンプル数
+_PREROLL_SAMPLES = (FRAME_SAMPLES - LAME_DELAY) + PREROLL_FRAMES * FRAME_SAMPLES
+
+_BITRATES = {
+    # (MPEG-1か) -> Layer IIIのビットレート表（kbps）
+    True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+
+class Segment(NamedTuple):
+    """
+    分割エンコードの1区間
+
+    start_sample: ffmpegへの入力を開始するサンプル位置
+    sample_count: エンコードするサンプル数（最後の区間はNone＝末尾まで）
+    drop_frames: 出力の先頭から捨てるフレーム数
+    keep_frames: 残すフレーム数（最後の区間はNone＝すべて）
+    """
+    index: int
+    start_sample: int
+    sample_count: Optional[int]
+    drop_frames: int
+    keep_frames: Optional[int]
+
+
+def samples_per_frame(sample_rate: int) -> int:
+    """出力サンプルレートでの1フレームあたりのサンプル数"""
+    return 1152 if sample_rate >= 32000 else 576
+
+
+def plan_segments(total_samples: int, sample_rate: int, count: int) -> List[Segment]:
+    """
+    入力をcount個の区間に分ける
+
+    区間の境界Bはエンコード後の出力フレーム境界と一致するよう
+    B + LAME_DELAY がFRAME_SAMPLESの倍数になる位置に置く。
+
+    Returns:
+        List[Segment]: 区間のリスト（分割できない場合は1区間）
+    """
+    frame_size = samples_per_frame(sample_rate)
+    total_frames = (total_samples + LAME_DELAY) // FRAME_SAMPLES
+    count = max(1, min(count, total_frames // (PREROLL_FRAMES + TAIL_FRAMES + 1)))
+    if count == 1:
+        return [Segment(0, 0, None, 0, None)]
+
+    # 境界（LAME_DELAY分ずらしたフレーム単位）をほぼ等間隔に置く
+    bounds = [
+        round(total_frames * i / count) * FRAME_SAMPLES - LAME_DELAY
+        for i in range(1, count)
+    ]
+    segments = []
+    edges = [None] + bounds + [None]
+    for index in range(count):
+        start, end = edges[index], edges[index + 1]
+        if start is None:
+            start_sample, drop = 0, 0
+            kept_from = -LAME_DELAY
+        else:
+            start_sample = start - _PREROLL_SAMPLES
+            drop = (_PREROLL_SAMPLES + LAME_DELAY) // frame_size
+            kept_from = start
+        if end is None:
+            segments.append(Segment(index, start_sample, None, drop, None))
+        else:
+            sample_count = end - start_sample + TAIL_FRAMES * FRAME_SAMPLES
+            keep = (end - kept_from) // frame_size
+            segments.append(Segment(index, start_sample, sample_count, drop, keep))
+    return segments
+
+
+def segment_count_for(duration: float, max_segments: int) -> int:
+    """長さに応じた区間数（各区間がMIN_SEGMENT_SECONDS以上になる数）"""
+    return max(1, min(max_segments, int(duration // MIN_SEGMENT_SECONDS)))
+
+
+def segment_args(
+    input_file: str,
+    segment: Segment,
+    sample_rate: int,
+    codec_args: List[str],
+    output_file: str
+) -> List[str]:
+    """区間をエンコードするffmpegの引数（入力〜出力）を作る"""
+    args: List[str] = []
+    if segment.start_sample > 0:
+        args += ['-ss', f"{segment.start_sample / sample_rate:.6f}"]
+    args += ['-i', input_file]
+    if segment.sample_count is not None:
+        args += ['-t', f"{segment.sample_count / sample_rate:.6f}"]
+    args += [
+        '-map', '0:a:0',
+        '-vn',
+        '-ar', str(sample_rate),
+        *codec_args,
+        '-reservoir', '0',  # フレームを単独でデコード可能にする
+        '-write_xing', '0',
+        '-id3v2_version', '0',
+        '-f', 'mp3',
+        '-y',
+        output_file,
+    ]
+    return args
+
+
+def _frame_length(header: bytes) -> Optional[int]:
+    """MPEG Audio Layer IIIのフレームヘッダーからフレーム長を求める"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    return (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+
+def split_frames(data: bytes) -> List[Tuple[int, int]]:
+    """
+    MP3データをフレームに分ける
+
+    Returns:
+        List[Tuple[int, int]]: 各フレームの(開始位置, 長さ)
+    """
+    frames = []
+    position = 0
+    while position + 4 <= len(data):
+        length = _frame_length(data[position:position + 4])
+        if length is None:
+            # 同期が外れた場合は次の同期ワードを探す
+            position = data.find(b'\xff', position + 1)
+            if position < 0:
+                break
+            continue
+        frames.append((position, length))
+        position += length
+    return frames
+
+
+def trim_segment(path: str, drop_frames: int, keep_frames: Optional[int]):
+    """区間の出力から助走と余分な末尾のフレームを取り除く"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = split_frames(data)
+    end = None if keep_frames is None else drop_frames + keep_frames
+    kept = frames[drop_frames:end]
+    with open(path, 'wb') as f:
+        for offset, length in kept:
+            f.write(data[offset:offset + length])
+
+
+def write_concat_list(list_file: str, segment_files: List[str]):
+    """concat demuxer用のファイル一覧を書き込む"""
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment_file in segment_files:
+            escaped = os.path.abspath(segment_file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def total_samples_for(duration: float, sample_rate: int) -> int:
+    """長さ（秒）からサンプル数を求める"""
+    return int(math.floor(duration * sample_rate))
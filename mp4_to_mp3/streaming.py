@@ -0,0 +1,285 @@
+"""
+一時ファイルを使わないストリーミング変換
+
+入力をパイプ（バイト列、ファイルオブジェクト、同期・非同期のイテラブル）からffmpegの
+標準入力へ流し込み、エンコードしたMP3を標準出力からチャンクごとに返す。
+読み取りは呼び出し側がチャンクを取り出したときだけ行うため、呼び出し側が遅ければ
+パイプが詰まってffmpegが止まり、さらに入力の読み込みも止まる（バックプレッシャー）。
+メモリに置くのはパイプのバッファとチャンク1つ分だけになる。
+
+MP4はmoovアトム（索引）が先頭にないとパイプからは変換できない。入力の先頭のボックスを
+調べ、mdatがmoovより先にある場合は一時ファイルへ書き出してから変換する。
+実在するファイルのパスやファイルオブジェクトはffmpegに直接読ませる（シークできるため）。
+入力を2度読めないため、音量の正規化は常に1パスの動的な調整で行う。loudnormは192kHzで
+出力するため、ファイル（実在するものか書き出したもの）からは入力のサンプルレートを調べて
+それに戻す。パイプから変換する場合は入力のサンプルレートがわからないため、プロファイルで
+指定しなければffmpegがlibmp3lameに選ぶ48kHzになる。
+"""
+import asyncio
+import os
+import struct
+import tempfile
+from collections import deque
+from typing import IO, Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .engine import STDERR_TAIL_LINES, ConversionEngine, _read_lines
+from .loudness import loudness_args
+from .profiles import DEFAULT_PROFILE, OutputProfile
+from .system import set_process_priority
+
+# 出力を返すチャンクの大きさと、入力を読むチャンクの大きさ
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# ffmpegの標準入力へ書き込んで返事を待たずにためておく上限
+WRITE_BUFFER_LIMIT = 256 * 1024
+
+# moovを探すために先頭から読む上限（これを超えたら一時ファイルに書き出す）
+HEAD_SCAN_LIMIT = 16 * 1024 * 1024
+
+StreamSource = Union[str, 'os.PathLike[str]', bytes, bytearray, memoryview, IO[bytes], AsyncIterable[bytes], Iterable[bytes]]
+
+
+class StreamConversionError(RuntimeError):
+    """ffmpegがエラーで終了した（それまでに返したチャンクは不完全な出力）"""
+
+    def __init__(self, returncode: int, stderr_tail: List[str]):
+        message = stderr_tail[-1] if stderr_tail else "不明なエラー"
+        super().__init__(f"ffmpegがエラーで終了しました（終了コード {returncode}）: {message}")
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+
+
+def _file_path(source: Any) -> Optional[str]:
+    """ffmpegに直接読ませられる実在のファイルならそのパス"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    name = getattr(source, 'name', None)
+    seekable = getattr(source, 'seekable', None)
+    if isinstance(name, str) and seekable is not None and seekable() and os.path.isfile(name):
+        return name
+    return None
+
+
+async def _iter_chunks(source: Any, chunk_size: int) -> AsyncIterator[bytes]:
+    """入力の種類によらずバイト列のチャンクを順に返す"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source)
+        for start in range(0, len(data), chunk_size):
+            yield bytes(data[start:start + chunk_size])
+        return
+    read = getattr(source, 'read', None)
+    if read is not None:
+        loop = asyncio.get_event_loop()
+        while True:
+            if asyncio.iscoroutinefunction(read):
+                chunk = await read(chunk_size)
+            else:
+                # 同期のファイルオブジェクトの読み込みはイベントループを止めないよう別スレッドで行う
+                chunk = await loop.run_in_executor(None, read, chunk_size)
+            if not chunk:
+                return
+            yield bytes(chunk)
+    if hasattr(source, '__aiter__'):
+        async for chunk in source:
+            if chunk:
+                yield bytes(chunk)
+        return
+    for chunk in source:
+        if chunk:
+            yield bytes(chunk)
+
+
+async def scan_mp4_head(chunks: AsyncIterator[bytes]) -> Tuple[bytes, bool]:
+    """
+    MP4の先頭のボックスを読み、パイプから変換できるかを調べる
+
+    Args:
+        chunks: 入力のチャンク（読んだ分は戻り値の先頭部分に含まれる）
+
+    Returns:
+        Tuple[bytes, bool]: (読んだ先頭部分, パイプから変換できる場合True)。
+        MP4でない入力はパイプから変換できるとみなす。
+    """
+    buffer = bytearray()
+
+    async def fill(size: int) -> bool:
+        while len(buffer) < size:
+            try:
+                buffer.extend(await chunks.__anext__())
+            except StopAsyncIteration:
+                return False
+        return True
+
+    offset = 0
+    while offset <= HEAD_SCAN_LIMIT:
+        if not await fill(offset + 8):
+            return bytes(buffer), True
+        size, kind = struct.unpack('>I4s', buffer[offset:offset + 8])
+        if offset == 0 and kind != b'ftyp':
+            return bytes(buffer), True
+        if kind == b'moov':
+            return bytes(buffer), True
+        if kind == b'mdat':
+            return bytes(buffer), False
+        if size == 1:
+            if not await fill(offset + 16):
+                return bytes(buffer), True
+            size = struct.unpack('>Q', buffer[offset + 8:offset + 16])[0]
+        if size < 8:
+            # 0（ファイルの最後まで）や壊れた大きさ。ffmpegの判断に任せる
+            return bytes(buffer), True
+        offset += size
+    return bytes(buffer), False
+
+
+async def _spool(head: bytes, chunks: AsyncIterator[bytes], spool_dir: Optional[str]) -> str:
+    """先頭部分と残りのチャンクを一時ファイルに書き出し、そのパスを返す"""
+    loop = asyncio.get_event_loop()
+    fd, path = tempfile.mkstemp(prefix=".mp4_to_mp3-stream-", suffix=".mp4", dir=spool_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            await loop.run_in_executor(None, f.write, head)
+            async for chunk in chunks:
+                await loop.run_in_executor(None, f.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+async def stream_mp3(
+    source: StreamSource,
+    engine: Optional[ConversionEngine] = None,
+    profile: Optional[OutputProfile] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    spool_dir: Optional[str] = None
+) -> AsyncIterator[bytes]:
+    """
+    入力をMP3に変換し、出力をチャンクごとに返す
+
+    途中で取り出しをやめる（aclose()する）とffmpegを終了させる。
+
+    Args:
+        source: ファイルのパス、バイト列、ファイルオブジェクト（同期のread()または
+            非同期のread()を持つもの）、バイト列の同期・非同期イテラブル
+        engine: ffmpegのパスと実行設定（スレッド数・優先度・音量の正規化）を使うエンジン
+        profile: 出力の設定（省略時はengineの最初のプロファイル。常に再エンコードする）
+        chunk_size: 返すチャンクの最大の大きさ
+        spool_dir: moovが末尾にあるMP4を書き出す一時ディレクトリ
+
+    Yields:
+        bytes: MP3のチャンク
+
+    Raises:
+        StreamConversionError: ffmpegがエラーで終了した場合（最後のチャンクの後に送出する）
+    """
+    engine = engine or ConversionEngine(use_manifest=False)
+    profile = profile or (engine.profiles[0] if engine.profiles else DEFAULT_PROFILE)
+    chunks: Optional[AsyncIterator[bytes]] = None
+    head = b""
+    spooled: Optional[str] = None
+
+    input_path = _file_path(source)
+    if input_path is None:
+        chunks = _iter_chunks(source, chunk_size).__aiter__()
+        head, streamable = await scan_mp4_head(chunks)
+        if not streamable:
+            input_path = spooled = await _spool(head, chunks, spool_dir)
+            chunks = None
+
+    codec_args = profile.codec_args()
+    tuning = engine.tuning
+    threads = ['-threads', str(tuning.threads)] if tuning.threads else []
+    try:
+        if engine.loudness is not None:
+            media = await engine._probe(input_path) if input_path is not None else None
+            sample_rate = media.sample_rate if media is not None else None
+            codec_args += loudness_args(engine.loudness, None, codec_args, sample_rate)
+        process = await asyncio.create_subprocess_exec(
+            engine.ffmpeg_path,
+            '-hide_banner',
+            '-nostats',
+            *threads,
+            '-i', input_path or 'pipe:0',
+            '-map', '0:a:0',
+            '-vn',
+            *codec_args,
+            '-f', 'mp3',
+            'pipe:1',
+            stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=chunk_size
+        )
+    except BaseException:
+        if spooled is not None:
+            os.remove(spooled)
+        raise
+    if tuning.nice is not None or tuning.io_class is not None:
+        set_process_priority(process.pid, tuning.nice, tuning.io_class)
+
+    stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+
+    async def read_stderr():
+        async for line in _read_lines(process.stderr):
+            stderr_tail.append(line)
+
+    async def feed():
+        stdin = process.stdin
+        stdin.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        try:
+            if head:
+                stdin.write(head)
+                await stdin.drain()
+            async for chunk in chunks:
+                stdin.write(chunk)
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpegが入力を読むのをやめた（終了コードで報告される）
+            pass
+        finally:
+            stdin.close()
+
+    tasks = [asyncio.ensure_future(read_stderr())]
+    if chunks is not None:
+        tasks.append(asyncio.ensure_future(feed()))
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        await asyncio.gather(*tasks)
+        await process.wait()
+        if process.returncode != 0:
+            raise StreamConversionError(process.returncode, list(stderr_tail))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if process.returncode is None:
+            process.kill()
+            # 読み込みが止まったパイプの残りを捨てないと、パイプが閉じず終了を待てない
+            await asyncio.gather(process.stdout.read(), process.stderr.read(), return_exceptions=True)
+            await process.wait()
+        if spooled is not None:
+            os.remove(spooled)
+
+
+def iter_mp3(source: StreamSource, **kwargs) -> Iterator[bytes]:
+    """
+    stream_mp3()の同期版（イベントループの外から使う）
+
+    引数はstream_mp3()と同じ。
+    """
+    loop = asyncio.new_event_loop()
+    chunks = stream_mp3(source, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(chunks.aclose())
+        loop.close()
@@ -0,0 +1,118 @@
+"""
+OSの負荷の計測とプロセスの優先度の設定
+
+CPU使用率とI/O待ちはLinuxでは/proc/statの差分から求め、それ以外の環境では
+ロードアベレージで代用する（I/O待ちは不明として0）。
+I/O優先度（ionice）はLinuxでのみioprio_setシステムコール（ctypes経由）で設定する。
+"""
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+from typing import NamedTuple, Optional, Tuple
+
+# ioprio_setのシステムコール番号（アーキテクチャごと）
+_IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'aarch64': 30,
+    'i386': 289,
+    'i686': 289,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+
+# I/O優先度のクラス（<linux/ioprio.h>）。best-effortは同じクラスの中で最も低い7を使う
+IO_CLASSES = {'best-effort': (2, 7), 'idle': (3, 0)}
+
+
+class SystemSample(NamedTuple):
+    """前回の計測からの平均（いずれも全CPUに対する割合 0.0〜1.0）"""
+    cpu_busy: float
+    iowait: float
+
+
+def _read_cpu_times() -> Optional[Tuple[int, int, int]]:
+    """/proc/statの合計行から(全体, アイドル, I/O待ち)のティック数を読む"""
+    try:
+        with open('/proc/stat', 'r') as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    if not fields or fields[0] != 'cpu' or len(fields) < 6:
+        return None
+    # user nice system idle iowait irq softirq steal（guestはuserに含まれる）
+    ticks = [int(value) for value in fields[1:9]]
+    return sum(ticks), ticks[3], ticks[4]
+
+
+class SystemSampler:
+    """呼び出しごとに前回からのCPU使用率とI/O待ちの割合を返す"""
+
+    def __init__(self):
+        self._previous = _read_cpu_times()
+
+    def sample(self) -> Optional[SystemSample]:
+        """
+        前回の呼び出しからの平均を計測する
+
+        Returns:
+            Optional[SystemSample]: 計測できない環境、または経過が短すぎる場合はNone
+        """
+        current = _read_cpu_times()
+        if current is None:
+            return self._sample_loadavg()
+        previous, self._previous = self._previous, current
+        if previous is None:
+            return None
+        total = current[0] - previous[0]
+        if total <= 0:
+            return None
+        idle = current[1] - previous[1]
+        iowait = current[2] - previous[2]
+        return SystemSample(max(0.0, (total - idle - iowait) / total), max(0.0, iowait / total))
+
+    @staticmethod
+    def _sample_loadavg() -> Optional[SystemSample]:
+        if not hasattr(os, 'getloadavg'):
+            return None
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            return None
+        return SystemSample(min(1.0, load / (os.cpu_count() or 1)), 0.0)
+
+
+def _ioprio_set(pid: int, io_class: str) -> bool:
+    syscall = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None or io_class not in IO_CLASSES:
+        return False
+    klass, level = IO_CLASSES[io_class]
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return False
+    value = (klass << _IOPRIO_CLASS_SHIFT) | level
+    return libc.syscall(syscall, _IOPRIO_WHO_PROCESS, pid, value) == 0
+
+
+def set_process_priority(pid: int, nice: Optional[int] = None, io_class: Optional[str] = None):
+    """
+    起動したプロセスのCPU優先度（nice値）とI/O優先度を設定する
+
+    権限がない（nice値を下げようとした）場合や対応していない環境では何もしない。
+
+    Args:
+        pid: 対象のプロセス
+        nice: nice値（-20〜19、大きいほど優先度が低い）
+        io_class: 'best-effort'または'idle'（Linuxのみ）
+    """
+    if nice is not None and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+        except OSError:
+            pass
+    if io_class is not None and sys.platform.startswith('linux'):
+        _ioprio_set(pid, io_class)
@@ -0,0 +1,238 @@
+"""
+ffmpeg/ffprobeの検出と機能の確認
+
+実行ファイルは明示的な指定（引数または環境変数）、アプリと同じフォルダ、PATHの順に探す。
+バージョン・音声エンコーダー・プロトコルの一覧は実行ファイルのパスと更新時刻をキーに
+キャッシュし、2回目以降の起動ではffmpegを実行しない。
+"""
+import asyncio
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .probe_index import default_cache_dir
+
+CAPABILITIES_FILENAME = "ffmpeg_capabilities.json"
+
+# 実行ファイルを明示的に指定する環境変数
+ENVIRONMENT_VARIABLES = {'ffmpeg': 'MP4_TO_MP3_FFMPEG', 'ffprobe': 'MP4_TO_MP3_FFPROBE'}
+
+# 機能の確認でffmpegの応答を待つ秒数
+PROBE_TIMEOUT = 10.0
+
+
+class FfmpegCapabilities(NamedTuple):
+    """
+    検出したffmpegの情報
+
+    ffprobe: ffprobeのパス（見つからなければNone。入力の解析なしで変換する）
+    encoders: 音声エンコーダー名の一覧
+    """
+    ffmpeg: str
+    ffprobe: Optional[str]
+    version: str
+    encoders: Tuple[str, ...]
+    input_protocols: Tuple[str, ...]
+    output_protocols: Tuple[str, ...]
+
+    @property
+    def has_libmp3lame(self) -> bool:
+        return 'libmp3lame' in self.encoders
+
+
+def default_capabilities_path() -> str:
+    return os.path.join(default_cache_dir(), CAPABILITIES_FILENAME)
+
+
+def _app_dirs() -> List[str]:
+    """同梱された実行ファイルを探すディレクトリ（実行中のアプリと同じフォルダ）"""
+    dirs = []
+    if getattr(sys, 'frozen', False):
+        dirs.append(os.path.dirname(sys.executable))
+    if sys.argv and sys.argv[0]:
+        dirs.append(os.path.dirname(os.path.abspath(sys.argv[0])))
+    return dirs
+
+
+def find_binary(name: str, explicit: Optional[str] = None) -> Optional[str]:
+    """
+    ffmpegまたはffprobeの実行ファイルを探す
+
+    Args:
+        name: 'ffmpeg'または'ffprobe'
+        explicit: 指定されたパスまたはコマンド名（省略時は環境変数の値）
+
+    Returns:
+        Optional[str]: 実行ファイルの絶対パス（見つからなければNone）
+    """
+    explicit = explicit or os.environ.get(ENVIRONMENT_VARIABLES.get(name, ''))
+    if explicit:
+        if os.path.isfile(explicit):
+            return os.path.abspath(explicit)
+        return shutil.which(explicit)
+    filename = name + ('.exe' if sys.platform == 'win32' else '')
+    for directory in _app_dirs():
+        candidate = os.path.join(directory, filename)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return shutil.which(name)
+
+
+def _parse_version(output: str) -> str:
+    """「ffmpeg version 7.0.2 Copyright ...」からバージョンを取り出す"""
+    words = output.split(None, 3)
+    if len(words) >= 3 and words[1] == 'version':
+        return words[2]
+    return ""
+
+
+def _parse_encoders(output: str) -> Tuple[str, ...]:
+    """ffmpeg -encodersの一覧から音声エンコーダー名を取り出す"""
+    encoders = []
+    in_list = False
+    for line in output.splitlines():
+        words = line.split()
+        if not in_list:
+            in_list = words[:1] == ['------']
+            continue
+        if len(words) >= 2 and words[0].startswith('A'):
+            encoders.append(words[1])
+    return tuple(encoders)
+
+
+def _parse_protocols(output: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """ffmpeg -protocolsの一覧から(入力, 出力)のプロトコル名を取り出す"""
+    protocols: Dict[str, List[str]] = {'Input:': [], 'Output:': []}
+    current: Optional[List[str]] = None
+    for line in output.splitlines():
+        if line.strip() in protocols:
+            current = protocols[line.strip()]
+        elif current is not None and line.startswith(' ') and line.strip():
+            current.append(line.strip())
+    return tuple(protocols['Input:']), tuple(protocols['Output:'])
+
+
+async def _command_output(*args: str) -> str:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise OSError(f"{args[0]}の終了コードが{process.returncode}です")
+    return stdout.decode('utf-8', errors='ignore')
+
+
+async def detect_capabilities(ffmpeg: str, ffprobe: Optional[str] = None) -> FfmpegCapabilities:
+    """
+    ffmpegを実行してバージョン・エンコーダー・プロトコルを調べる
+
+    3つの問い合わせは並行して実行する。
+
+    Raises:
+        OSError: ffmpegを実行できない、または異常終了した場合
+        asyncio.TimeoutError: ffmpegが応答しない場合
+    """
+    version, encoders, protocols = await asyncio.gather(
+        _command_output(ffmpeg, '-version'),
+        _command_output(ffmpeg, '-hide_banner', '-encoders'),
+        _command_output(ffmpeg, '-hide_banner', '-protocols'),
+    )
+    return FfmpegCapabilities(
+        ffmpeg, ffprobe, _parse_version(version), _parse_encoders(encoders), *_parse_protocols(protocols)
+    )
+
+
+def _cache_key(path: str) -> Optional[str]:
+    """実行ファイルのパス・サイズ・更新時刻（差し替えられたら別のキーになる）"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def _read_cache(cache_path: str) -> Dict[str, dict]:
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _write_cache(cache_path: str, cache: Dict[str, dict]):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+def load_capabilities(
+    ffmpeg: Optional[str] = None,
+    ffprobe: Optional[str] = None,
+    cache_path: Optional[str] = None
+) -> Optional[FfmpegCapabilities]:
+    """
+    ffmpegを探し、キャッシュがあればそれを、なければ実行して機能を調べる
+
+    イベントループを自分で回すため、GUIではバックグラウンドのスレッドから呼ぶ。
+
+    Args:
+        ffmpeg: ffmpegのパスまたはコマンド名（省略時は自動で探す）
+        ffprobe: ffprobeのパスまたはコマンド名（省略時は自動で探す）
+        cache_path: キャッシュファイル（省略時はユーザーのキャッシュディレクトリ）
+
+    Returns:
+        Optional[FfmpegCapabilities]: ffmpegが見つからないか実行できない場合はNone
+    """
+    ffmpeg_path = find_binary('ffmpeg', ffmpeg)
+    if ffmpeg_path is None:
+        return None
+    ffprobe_path = find_binary('ffprobe', ffprobe)
+    cache_path = cache_path or default_capabilities_path()
+    key = _cache_key(ffmpeg_path)
+    if key is None:
+        return None
+
+    cache = _read_cache(cache_path)
+    cached = cache.get(key)
+    if isinstance(cached, dict):
+        try:
+            return FfmpegCapabilities(
+                ffmpeg_path,
+                ffprobe_path,
+                cached['version'],
+                tuple(cached['encoders']),
+                tuple(cached['input_protocols']),
+                tuple(cached['output_protocols']),
+            )
+        except (KeyError, TypeError):
+            pass
+
+    try:
+        capabilities = asyncio.run(detect_capabilities(ffmpeg_path, ffprobe_path))
+    except (OSError, asyncio.TimeoutError):
+        return None
+    # 同じパスの古い記録（差し替え前のバイナリ）は残さない
+    cache = {k: v for k, v in cache.items() if not k.startswith(f"{ffmpeg_path}|")}
+    cache[key] = {
+        'version': capabilities.version,
+        'encoders': list(capabilities.encoders),
+        'input_protocols': list(capabilities.input_protocols),
+        'output_protocols': list(capabilities.output_protocols),
+    }
+    _write_cache(cache_path, cache)
+    return capabilities
@@ -0,0 +1,311 @@
+"""
+入力ディレクトリの監視
+
+Linuxではinotify（ctypes経由）で新しいファイルを検出し、それ以外の環境や
+inotifyが使えない場合は定期的な再走査に切り替える。書き込み中のファイルを
+変換しないよう、サイズと更新時刻が一定時間変わらなくなってから通知する。
+
+変換済みかどうかは出力ディレクトリの変換記録で判定するため、
+再起動しても既存のファイルを再変換することはない。
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .engine import INPUT_EXTENSIONS, ConversionEngine, ConversionJob, output_path_for
+
+# inotifyのフラグ（<sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# struct inotify_event の固定長部分（wd, mask, cookie, len）
+_EVENT_HEADER = struct.Struct('iIII')
+
+# サイズと更新時刻がこの秒数変わらなければ書き込み完了とみなす
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# inotifyが使えない場合の再走査の間隔（秒）
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify使用時もイベントの取りこぼしに備えて全体を再走査する間隔（秒）
+RESCAN_INTERVAL = 300.0
+
+
+class Inotify:
+    """ctypesで呼び出すinotifyの最小限のラッパー"""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotifyはLinuxでのみ使用できます")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._directories: Dict[int, str] = {}
+
+    def add_watch(self, directory: str):
+        """ディレクトリを監視対象に加える（登録済みなら何もしない）"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self._directories[wd] = directory
+
+    def read_events(self) -> List[Tuple[str, int]]:
+        """
+        届いているイベントを読み出す
+
+        Returns:
+            List[Tuple[str, int]]: (対象のパス, マスク)のリスト
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd, "")
+            events.append((os.path.join(directory, name) if name else directory, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class StabilityTracker:
+    """サイズと更新時刻がsettle_seconds以上変わっていないファイルを判定する"""
+
+    def __init__(self, settle_seconds: float = DEFAULT_SETTLE_SECONDS):
+        self.settle_seconds = settle_seconds
+        # パス -> ((サイズ, 更新時刻), その状態を最初に見た時刻)
+        self.pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        # 通知済みのパス -> 通知したときの(サイズ, 更新時刻)
+        self.reported: Dict[str, Tuple[int, int]] = {}
+
+    def observe(self, path: str, now: float) -> bool:
+        """
+        ファイルの状態を記録し、書き込みが終わったと判断できればTrueを返す
+
+        同じ内容で2回以上Trueを返すことはない（書き換えられれば再び通知する）。
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            self.reported.pop(path, None)
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if stat.st_size == 0 or self.reported.get(path) == signature:
+            self.pending.pop(path, None)
+            return False
+        previous = self.pending.get(path)
+        if previous is None or previous[0] != signature:
+            self.pending[path] = (signature, now)
+            return False
+        if now - previous[1] < self.settle_seconds:
+            return False
+        del self.pending[path]
+        self.reported[path] = signature
+        return True
+
+    def retain(self, paths: Iterable[str]):
+        """
+        paths（走査で見つかったファイル）にないパスの記録を捨てる
+
+        消えたファイルの記録が残り続けて、常駐中にメモリが増え続けるのを防ぐ。
+        """
+        existing = set(paths)
+        for records in (self.pending, self.reported):
+            for path in [path for path in records if path not in existing]:
+                del records[path]
+
+
+class FolderWatcher:
+    """
+    ディレクトリ（サブディレクトリを含む）に現れた入力ファイルを通知する
+
+    起動時に既存のファイルも一度ずつ通知する。
+    """
+
+    def __init__(
+        self,
+        directories: Sequence[str],
+        extensions: Sequence[str] = INPUT_EXTENSIONS,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        use_inotify: bool = True
+    ):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.tracker = StabilityTracker(settle_seconds)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        # 実際に使っている検出方法（"inotify"または"polling"）
+        self.mode: Optional[str] = None
+
+    def _matches(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return not name.startswith('.') and name.lower().endswith(self.extensions)
+
+    def subdir_for(self, path: str) -> str:
+        """監視ディレクトリからの相対的なサブディレクトリ"""
+        for directory in self.directories:
+            relative = os.path.relpath(os.path.dirname(path), directory)
+            if not relative.startswith(os.pardir):
+                return "" if relative == os.curdir else relative
+        return ""
+
+    def _scan(self, inotify: Optional[Inotify]) -> List[str]:
+        """監視ディレクトリ全体を走査する（inotify使用時は監視も登録する）"""
+        found = []
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+                if inotify is not None:
+                    try:
+                        inotify.add_watch(dirpath)
+                    except OSError:
+                        pass
+                found.extend(
+                    os.path.join(dirpath, filename)
+                    for filename in sorted(filenames) if self._matches(filename)
+                )
+        return found
+
+    def _open_inotify(self) -> Optional[Inotify]:
+        if not self.use_inotify:
+            return None
+        try:
+            return Inotify()
+        except (OSError, AttributeError):
+            # Linux以外、またはinotifyの上限に達している
+            return None
+
+    async def watch(self) -> AsyncIterator[Tuple[str, str]]:
+        """
+        書き込みが終わった入力ファイルを見つけた順に返し続ける
+
+        Yields:
+            Tuple[str, str]: (入力ファイル, 出力先のサブディレクトリ)
+        """
+        loop = asyncio.get_event_loop()
+        inotify = self._open_inotify()
+        wakeup = asyncio.Event()
+        touched: Set[str] = set()
+        rescan = True
+
+        def on_readable():
+            nonlocal rescan
+            for path, mask in inotify.read_events():
+                if mask & (IN_ISDIR | IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # 新しいサブディレクトリの登録や取りこぼしの回復
+                    rescan = True
+                else:
+                    touched.add(path)
+            wakeup.set()
+
+        if inotify is not None:
+            try:
+                loop.add_reader(inotify.fd, on_readable)
+            except NotImplementedError:
+                inotify.close()
+                inotify = None
+        self.mode = "inotify" if inotify is not None else "polling"
+        rescan_interval = RESCAN_INTERVAL if inotify is not None else self.poll_interval
+
+        last_scan = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                wakeup.clear()
+                candidates = set(self.tracker.pending) | touched
+                touched.clear()
+                if rescan or now - last_scan >= rescan_interval:
+                    rescan = False
+                    last_scan = now
+                    found = self._scan(inotify)
+                    self.tracker.retain(found)
+                    candidates.update(found)
+                for path in sorted(candidates):
+                    if self._matches(path) and self.tracker.observe(path, now):
+                        yield path, self.subdir_for(path)
+
+                timeout = rescan_interval - (time.monotonic() - last_scan)
+                if self.tracker.pending:
+                    timeout = min(timeout, self.tracker.settle_seconds)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), max(timeout, 0.05))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if inotify is not None:
+                loop.remove_reader(inotify.fd)
+                inotify.close()
+
+
+async def watch_and_convert(
+    engine: ConversionEngine,
+    watcher: FolderWatcher,
+    output_dir: str,
+    max_workers: Optional[int] = None
+) -> AsyncIterator[ConversionJob]:
+    """
+    見つかった入力ファイルを変換し続け、完了したジョブを返す
+
+    ジョブはワーカー数を上限にすぐ実行され、変換記録は1件ごとに保存される。
+    変換済みの入力はエンジンがSKIPPEDとして返す。
+
+    Yields:
+        ConversionJob: 完了したジョブ
+    """
+    worker_count = max_workers or engine.max_workers
+    job_queue: asyncio.Queue = asyncio.Queue()
+
+    async def feed():
+        index = 0
+        try:
+            async for input_file, subdir in watcher.watch():
+                job_queue.put_nowait(ConversionJob(
+                    input_file, output_path_for(input_file, output_dir, subdir=subdir), index
+                ))
+                index += 1
+        finally:
+            # 監視が止まったらワーカーを終了させる
+            for _ in range(worker_count):
+                job_queue.put_nowait(None)
+
+    feeder = asyncio.ensure_future(feed())
+    results = engine.iter_queue(job_queue, worker_count, save_each=True)
+    try:
+        async for job in results:
+            yield job
+        # 監視側の例外を呼び出し側に伝える
+        await feeder
+    finally:
+        await results.aclose()
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
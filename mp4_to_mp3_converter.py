@@ -1,20 +1,255 @@
 import asyncio
 import os
-import shutil
 import subprocess
 import sys
 import threading
 import tkinter as tk
 from queue import Queue
 from tkinter import filedialog, messagebox, ttk
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from mp4_to_mp3 import (
+    DEFAULT_STALL_TIMEOUT,
+    BatchReport,
+    ConversionEngine,
+    ConversionEvent,
+    ConversionJob,
+    EtaEstimator,
+    EventKind,
+    FfmpegCapabilities,
+    JobStatus,
+    LoudnessTarget,
+    PRESETS,
+    ProbeIndex,
+    default_index_path,
+    format_eta,
+    load_capabilities,
+    make_jobs,
+    preset_profile,
+)
+
+
+# 画面の更新間隔（ミリ秒）。ほかのスレッドからの更新はこの間隔でまとめて反映する
+FRAME_INTERVAL_MS = 50
+
+# 終了時に変換の取り消しが終わるのを待つ秒数（過ぎたらffmpegを強制終了する）
+CLOSE_TIMEOUT = 5.0
+
+# ファイル一覧に表示する状態
+STATE_LABELS = {
+    JobStatus.PENDING: "待機中",
+    JobStatus.RUNNING: "変換中",
+    JobStatus.DONE: "完了",
+    JobStatus.SKIPPED: "スキップ",
+    JobStatus.FAILED: "失敗",
+    JobStatus.CANCELLED: "中止",
+}
+
+
+class PendingUpdates(NamedTuple):
+    """UiUpdatesから取り出した、まだ画面に反映していない更新"""
+    rows: Dict[int, Tuple[str, str]]
+    status: Optional[str]
+    progress: Optional[Tuple[int, int]]
+    calls: List[Callable[[], None]]
+
+
+class UiUpdates:
+    """
+    ほかのスレッドからの画面の更新をためてTkのスレッドへ渡す
+
+    ウィジェットにはTkのスレッドからしか触れないため、変換のスレッドはここへ書き込むだけにする。
+    同じ行・ステータス・プログレスバーへの更新は最後のものだけを残す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: Dict[int, Tuple[str, str]] = {}
+        self._status: Optional[str] = None
+        self._progress: Optional[Tuple[int, int]] = None
+        self._calls: List[Callable[[], None]] = []
+
+    def set_row(self, index: int, state: str, detail: str = ""):
+        """ファイル一覧のindex番目の行の状態と詳細を変える"""
+        with self._lock:
+            self._rows[index] = (state, detail)
+
+    def set_status(self, text: str):
+        with self._lock:
+            self._status = text
+
+    def set_progress(self, value: int, maximum: int):
+        with self._lock:
+            self._progress = (value, maximum)
+
+    def call(self, func: Callable[[], None]):
+        """funcをTkのスレッドで1回呼ぶ（ダイアログの表示など、まとめられない処理に使う）"""
+        with self._lock:
+            self._calls.append(func)
+
+    def drain(self) -> PendingUpdates:
+        """たまっている更新をすべて取り出す"""
+        with self._lock:
+            pending = PendingUpdates(self._rows, self._status, self._progress, self._calls)
+            self._rows = {}
+            self._status = self._progress = None
+            self._calls = []
+        return pending
+
+
+class FileListModel:
+    """
+    ファイル一覧の行と、そのうち表示している範囲
+
+    行は何件あってもリストで持つだけにし、ウィジェットには表示している範囲の行だけを置く。
+    """
+
+    def __init__(self, visible_rows: int = 8):
+        # 各行は [ファイル名, 状態, 詳細]
+        self.rows: List[List[str]] = []
+        self.first = 0
+        self.visible_rows = visible_rows
+
+    def set_files(self, files: Iterable[str]):
+        pending = STATE_LABELS[JobStatus.PENDING]
+        self.rows = [[os.path.basename(file), pending, ""] for file in files]
+        self.first = 0
+
+    def update(self, changes: Dict[int, Tuple[str, str]]) -> bool:
+        """
+        行の状態と詳細を変える
+
+        Returns:
+            bool: 表示している範囲の行が変わった場合True
+        """
+        visible = False
+        for index, (state, detail) in changes.items():
+            if 0 <= index < len(self.rows):
+                self.rows[index][1:] = [state, detail]
+                visible = visible or self.first <= index < self.first + self.visible_rows
+        return visible
+
+    def window(self) -> List[List[str]]:
+        """表示している範囲の行"""
+        return self.rows[self.first:self.first + self.visible_rows]
+
+    def scroll_to(self, first: int) -> bool:
+        """
+        表示の先頭の行を変える（範囲外は端に寄せる）
+
+        Returns:
+            bool: 表示している範囲が変わった場合True
+        """
+        first = max(0, min(first, len(self.rows) - self.visible_rows))
+        if first == self.first:
+            return False
+        self.first = first
+        return True
+
+    def set_visible_rows(self, visible_rows: int) -> bool:
+        visible_rows = max(1, visible_rows)
+        if visible_rows == self.visible_rows:
+            return False
+        self.visible_rows = visible_rows
+        self.scroll_to(self.first)
+        return True
+
+    def fraction(self) -> Tuple[float, float]:
+        """スクロールバーに渡す表示範囲（一覧全体に対する割合）"""
+        if len(self.rows) <= self.visible_rows:
+            return 0.0, 1.0
+        total = len(self.rows)
+        return self.first / total, min(1.0, (self.first + self.visible_rows) / total)
+
+
+class VirtualFileList(ttk.Frame):
+    """
+    表示している範囲の行だけをTreeviewに置くファイル一覧
+
+    スクロールバーは一覧全体での位置を表す。スクロールしてもTreeviewの行は作り直さず、
+    値だけを書き換える。
+    """
+
+    def __init__(self, master, height: int = 8):
+        super().__init__(master)
+        self.model = FileListModel(height)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree = ttk.Treeview(
+            self,
+            columns=("name", "state", "detail"),
+            show="headings",
+            height=height,
+            selectmode="none"
+        )
+        for column, heading, width in (("name", "ファイル", 260), ("state", "状態", 70), ("detail", "詳細", 200)):
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width, stretch=column != "state")
+        self.tree.grid(row=0, column=0, sticky="nsew")
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(sequence, self._on_wheel)
+        self.tree.bind("<Configure>", self._on_resize)
+
+    def set_files(self, files: Iterable[str]):
+        self.model.set_files(files)
+        self.refresh()
+
+    def update_rows(self, changes: Dict[int, Tuple[str, str]]):
+        if self.model.update(changes):
+            self.refresh()
+
+    def refresh(self):
+        """表示している範囲の行をTreeviewへ書き込む"""
+        window = self.model.window()
+        items = self.tree.get_children()
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+        for position, values in enumerate(window):
+            if position < len(items):
+                self.tree.item(items[position], values=values)
+            else:
+                self.tree.insert("", "end", iid=f"row{position}", values=values)
+        self.scrollbar.set(*self.model.fraction())
+
+    def row_at(self, y: int) -> Optional[int]:
+        """Treeview内のy座標にある行の、一覧全体での番号"""
+        iid = self.tree.identify_row(y)
+        if not iid:
+            return None
+        return self.model.first + self.tree.index(iid)
+
+    def _on_scrollbar(self, action: str, amount: str, unit: Optional[str] = None):
+        if action == "moveto":
+            first = round(float(amount) * len(self.model.rows))
+        else:
+            step = self.model.visible_rows if unit == "pages" else 1
+            first = self.model.first + int(amount) * step
+        if self.model.scroll_to(first):
+            self.refresh()
+
+    def _on_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        if self.model.scroll_to(self.model.first + (-3 if up else 3)):
+            self.refresh()
+        return "break"
+
+    def _on_resize(self, event):
+        # 見出しの高さは1行分とみなす
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        if self.model.set_visible_rows(event.height // row_height - 1):
+            self.refresh()
 
 
 class MP4ToMP3Converter:
     def __init__(self):
         self.window = tk.Tk()
         self.window.title("MP4 to MP3 Converter")
-        self.window.geometry("600x450")
+        self.window.geometry("640x520")
         
         # アプリケーションアイコンの設定（オプション）
         try:
@@ -24,35 +259,73 @@ class MP4ToMP3Converter:
         
         self.selected_files: List[str] = []
         self.output_dir: str = ""
-        self.progress_queue = Queue()
+        # 変換のスレッドからの画面の更新（Tkのスレッドがまとめて反映する）
+        self.ui_updates = UiUpdates()
         self.is_converting = False
-        
-        # ffmpegの存在確認
-        if not self._check_ffmpeg():
-            self._show_ffmpeg_error()
-            return
+        self._conversion_thread: Optional[threading.Thread] = None
+        # 実行中のバッチのジョブ（ファイル一覧の行番号と同じ順）
+        self.jobs: List[ConversionJob] = []
+        # 変換処理はGUIに依存しないエンジンに任せる
+        self.engine = ConversionEngine(
+            probe_index=self._open_probe_index(),
+            stall_timeout=DEFAULT_STALL_TIMEOUT
+        )
+        self.engine.add_listener(self._on_engine_event)
+        self.ffmpeg_capabilities: Optional[FfmpegCapabilities] = None
+        self._ffmpeg_probe_queue = Queue()
         
         self._create_widgets()
         self._setup_async_loop()
+        self.window.after(FRAME_INTERVAL_MS, self._flush_ui_updates)
+        # ffmpegの確認は画面の表示を待たせないようバックグラウンドで行う
+        self._start_ffmpeg_probe()
     
-    def _check_ffmpeg(self) -> bool:
+    def _open_probe_index(self):
+        """ffprobe結果のキャッシュを開く（開けない場合は使わない）"""
+        try:
+            return ProbeIndex(default_index_path())
+        except Exception:
+            return None
+    
+    def _start_ffmpeg_probe(self):
+        """ffmpegの検出と機能の確認をバックグラウンドのスレッドで始める"""
+        threading.Thread(
+            target=lambda: self._ffmpeg_probe_queue.put(load_capabilities()),
+            daemon=True
+        ).start()
+        self.window.after(50, self._poll_ffmpeg_probe)
+    
+    def _poll_ffmpeg_probe(self):
+        if self._ffmpeg_probe_queue.empty():
+            self.window.after(50, self._poll_ffmpeg_probe)
+            return
+        self._on_ffmpeg_probed(self._ffmpeg_probe_queue.get())
+    
+    def _on_ffmpeg_probed(self, capabilities: Optional[FfmpegCapabilities]):
         """
-        ffmpegが利用可能かチェックする
+        ffmpegの確認結果を画面とエンジンに反映する
         
-        Returns:
-            bool: ffmpegが利用可能な場合True
+        Args:
+            capabilities: 確認結果（ffmpegが見つからない場合はNone）
         """
-        try:
-            # ffmpegコマンドの存在確認
-            result = subprocess.run(
-                ['ffmpeg', '-version'],
-                capture_output=True,
-                text=True,
-                timeout=10
+        if capabilities is None:
+            self._show_ffmpeg_error()
+            return
+        
+        self.ffmpeg_capabilities = capabilities
+        self.engine.ffmpeg_path = capabilities.ffmpeg
+        if capabilities.ffprobe:
+            self.engine.ffprobe_path = capabilities.ffprobe
+        if not capabilities.has_libmp3lame:
+            self.ffmpeg_info.config(
+                text="✗ このFFmpegにはMP3エンコーダー（libmp3lame）が含まれていません",
+                foreground="red"
             )
-            return result.returncode == 0
-        except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
-            return False
+            return
+        
+        version = f" {capabilities.version}" if capabilities.version else ""
+        self.ffmpeg_info.config(text=f"✓ FFmpeg{version} が利用可能です", foreground="green")
+        self.convert_btn.config(state='normal')
     
     def _show_ffmpeg_error(self):
         """ffmpegが見つからない場合のエラーダイアログを表示"""
@@ -115,14 +388,76 @@ class MP4ToMP3Converter:
         )
         self.open_output_btn.grid(row=3, column=0, pady=5)
         
+        # 変換オプション
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=4, column=0, pady=5)
+        
+        self.aac_passthrough_var = tk.BooleanVar(value=self.engine.aac_passthrough)
+        ttk.Checkbutton(
+            options_frame,
+            text="AAC音声は再エンコードせず .m4a で抽出",
+            variable=self.aac_passthrough_var
+        ).grid(row=0, column=0, sticky="w")
+        
+        self.force_var = tk.BooleanVar(value=self.engine.force)
+        ttk.Checkbutton(
+            options_frame,
+            text="変換済みのファイルも再変換する",
+            variable=self.force_var
+        ).grid(row=1, column=0, sticky="w")
+        
+        self.dedup_var = tk.BooleanVar(value=self.engine.dedup)
+        ttk.Checkbutton(
+            options_frame,
+            text="同じ内容のファイルは1度だけ変換する",
+            variable=self.dedup_var
+        ).grid(row=2, column=0, sticky="w")
+        
+        preset_frame = ttk.Frame(options_frame)
+        preset_frame.grid(row=3, column=0, sticky="w")
+        ttk.Label(preset_frame, text="エンコード設定:").grid(row=0, column=0, padx=(0, 5))
+        self.preset_var = tk.StringVar(value='default')
+        ttk.Combobox(
+            preset_frame,
+            textvariable=self.preset_var,
+            values=list(PRESETS),
+            state='readonly',
+            width=12
+        ).grid(row=0, column=1)
+        
+        self.loudnorm_var = tk.BooleanVar(value=self.engine.loudness is not None)
+        ttk.Checkbutton(
+            options_frame,
+            text="音量をそろえる（-16 LUFS）",
+            variable=self.loudnorm_var
+        ).grid(row=4, column=0, sticky="w")
+        
+        self.loudnorm_single_pass_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="解析を省いて1パスで処理する（音の強弱が平らになる）",
+            variable=self.loudnorm_single_pass_var
+        ).grid(row=5, column=0, sticky="w", padx=(20, 0))
+        
         # 変換開始ボタン
         self.convert_btn = ttk.Button(
             main_frame,
             text="変換開始",
             command=self._start_conversion,
+            state='disabled',  # ffmpegの確認が終わるまで無効
             width=30
         )
-        self.convert_btn.grid(row=4, column=0, pady=10)
+        self.convert_btn.grid(row=5, column=0, pady=10)
+        
+        # 中止ボタン（変換中だけ有効）
+        self.cancel_btn = ttk.Button(
+            main_frame,
+            text="変換を中止",
+            command=self._cancel_conversion,
+            state='disabled',
+            width=30
+        )
+        self.cancel_btn.grid(row=6, column=0, pady=(0, 10))
         
         # プログレスバー
         self.progress = ttk.Progressbar(
@@ -130,7 +465,7 @@ class MP4ToMP3Converter:
             length=400,
             mode='determinate'
         )
-        self.progress.grid(row=5, column=0, pady=10, sticky="we")
+        self.progress.grid(row=7, column=0, pady=10, sticky="we")
         
         # ステータスラベル
         self.status_label = ttk.Label(
@@ -138,33 +473,27 @@ class MP4ToMP3Converter:
             text="ファイルを選択してください",
             font=("Arial", 10)
         )
-        self.status_label.grid(row=6, column=0, pady=5)
-        
-        # ファイルリスト
-        listbox_frame = ttk.Frame(main_frame)
-        listbox_frame.grid(row=7, column=0, sticky="nsew", pady=10)
-        listbox_frame.columnconfigure(0, weight=1)
-        main_frame.rowconfigure(7, weight=1)
-        
-        self.file_listbox = tk.Listbox(
-            listbox_frame,
-            height=8
-        )
-        self.file_listbox.grid(row=0, column=0, sticky="nsew")
-        
-        # スクロールバー
-        scrollbar = ttk.Scrollbar(listbox_frame, orient=tk.VERTICAL, command=self.file_listbox.yview)
-        scrollbar.grid(row=0, column=1, sticky="ns")
-        self.file_listbox.configure(yscrollcommand=scrollbar.set)
+        self.status_label.grid(row=8, column=0, pady=5)
+        
+        # ファイルリスト（何万件でも表示している範囲の行だけを描画する）
+        self.file_list = VirtualFileList(main_frame, height=8)
+        self.file_list.grid(row=9, column=0, sticky="nsew", pady=10)
+        main_frame.rowconfigure(9, weight=1)
+        # 右クリックで1つのファイルの変換を中止する
+        self.row_menu = tk.Menu(self.window, tearoff=0)
+        self.row_menu.add_command(label="このファイルの変換を中止", command=self._cancel_selected_row)
+        self._menu_row: Optional[int] = None
+        for sequence in ("<Button-3>", "<Button-2>"):
+            self.file_list.tree.bind(sequence, self._show_row_menu)
         
         # FFmpeg情報ラベル
-        ffmpeg_info = ttk.Label(
+        self.ffmpeg_info = ttk.Label(
             main_frame,
-            text="✓ FFmpeg が利用可能です",
+            text="FFmpegを確認中...",
             font=("Arial", 8),
-            foreground="green"
+            foreground="gray"
         )
-        ffmpeg_info.grid(row=8, column=0, pady=5)
+        self.ffmpeg_info.grid(row=10, column=0, pady=5)
     
     def _setup_async_loop(self):
         self.loop = asyncio.new_event_loop()
@@ -181,9 +510,7 @@ class MP4ToMP3Converter:
         )
         if files:
             self.selected_files = list(files)
-            self.file_listbox.delete(0, tk.END)
-            for file in self.selected_files:
-                self.file_listbox.insert(tk.END, os.path.basename(file))
+            self.file_list.set_files(self.selected_files)
             self.status_label.config(text=f"{len(files)}個のファイルが選択されました")
     
     def _select_output_dir(self):
@@ -217,98 +544,137 @@ class MP4ToMP3Converter:
         except Exception as e:
             messagebox.showerror("エラー", f"ディレクトリを開けませんでした: {str(e)}")
     
-    async def _convert_file(self, input_file: str, output_file: str) -> Tuple[str, bool, str]:
+    def _on_engine_event(self, event: ConversionEvent):
         """
-        ファイル変換を実行する
-        
-        Returns:
-            Tuple[str, bool, str]: (入力ファイル名, 成功フラグ, エラーメッセージ)
+        エンジンのイベントをファイル一覧とステータスの更新に変える
+
+        イベントループのスレッドから呼ばれるため、ウィジェットには触れず
+        ui_updatesへ書き込むだけにする。
         """
-        try:
-            # 出力ファイルが既に存在する場合は上書き
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            
-            process = await asyncio.create_subprocess_exec(
-                'ffmpeg',
-                '-i', input_file,
-                '-vn',  # 映像を無視
-                '-acodec', 'libmp3lame',  # MP3エンコーダー
-                '-b:a', '192k',  # ビットレート
-                '-y',  # 上書きを自動で許可
-                output_file,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0 and os.path.exists(output_file):
-                return input_file, True, ""
+        job = event.job
+        if job is None:
+            return
+        file_name = os.path.basename(job.input_file)
+        if event.kind == EventKind.STARTED:
+            self.ui_updates.set_row(job.index, STATE_LABELS[JobStatus.RUNNING])
+        elif event.kind == EventKind.PROGRESS:
+            if event.fraction is None:
+                self.ui_updates.set_row(job.index, STATE_LABELS[JobStatus.RUNNING], event.speed)
+                self.ui_updates.set_status(f"{file_name}: 変換中 ({event.speed})")
             else:
-                error_msg = stderr.decode('utf-8', errors='ignore') if stderr else "不明なエラー"
-                return input_file, False, error_msg
-                
-        except Exception as e:
-            return input_file, False, str(e)
+                detail = f"{event.fraction:.0%} ({event.speed})"
+                self.ui_updates.set_row(job.index, STATE_LABELS[JobStatus.RUNNING], detail)
+                self.ui_updates.set_status(f"{file_name}: {detail}")
+        elif event.kind == EventKind.SKIPPED:
+            self.ui_updates.set_row(job.index, STATE_LABELS[JobStatus.SKIPPED], event.message)
+            self.ui_updates.set_status(f"{file_name}: {event.message}")
+        elif event.kind == EventKind.WARNING:
+            self.ui_updates.set_status(f"{file_name}: {event.message}")
+        elif event.kind == EventKind.FINISHED and job.status != JobStatus.SKIPPED:
+            if job.error_message:
+                detail = job.error_message.splitlines()[0]
+            elif job.duplicate_of:
+                detail = f"{os.path.basename(job.duplicate_of)} と同じ内容"
+            else:
+                detail = ""
+            self.ui_updates.set_row(job.index, STATE_LABELS.get(job.status, job.status), detail)
     
     async def _convert_all_files(self):
         if not self.selected_files or not self.output_dir:
-            self.status_label.config(text="ファイルと出力先を選択してください")
+            self.ui_updates.set_status("ファイルと出力先を選択してください")
             return
         
         total_files = len(self.selected_files)
-        self.progress['maximum'] = total_files
-        self.progress['value'] = 0
+        self.ui_updates.set_progress(0, total_files)
         
         success_count = 0
+        cancelled_count = 0
         failed_files = []
         
-        tasks = []
-        for input_file in self.selected_files:
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-            output_file = os.path.join(self.output_dir, f"{base_name}.mp3")
-            tasks.append(self._convert_file(input_file, output_file))
-        
-        for i, (input_file, success, error_msg) in enumerate(await asyncio.gather(*tasks)):
-            self.progress['value'] = i + 1
+        jobs = make_jobs(self.selected_files, self.output_dir)
+        self.jobs = jobs
+        report = BatchReport()
+        eta = EtaEstimator(jobs)
+        self.engine.add_listener(report)
+        self.engine.add_listener(eta)
+        report.start()
+        self.ui_updates.set_status("入力ファイルを解析中...")
+        
+        completed = 0
+        async for job in self.engine.iter_results(jobs):
+            completed += 1
+            self.ui_updates.set_progress(completed, total_files)
             
-            file_name = os.path.basename(input_file)
-            if success:
+            file_name = os.path.basename(job.input_file)
+            if job.success:
                 success_count += 1
                 status = f"✓ {file_name}"
+            elif job.status == JobStatus.CANCELLED:
+                cancelled_count += 1
+                status = f"中止: {file_name}"
             else:
-                failed_files.append((file_name, error_msg))
+                failed_files.append((file_name, job.error_message))
                 status = f"✗ {file_name}"
+            remaining = format_eta(eta.remaining_seconds())
+            if remaining and completed < total_files:
+                status += f"（残り約 {remaining}）"
             
-            self.progress_queue.put(status)
-            
-            # プログレスバーの更新
-            self.window.update_idletasks()
+            self.ui_updates.set_status(status)
+        
+        report.finish()
+        self.engine.remove_listener(report)
+        self.engine.remove_listener(eta)
+        self.jobs = []
+        report_note = ""
+        try:
+            report_path = report.write_reports(self.output_dir)[0]
+            report_note = f"\n\n実行レポート: {report_path}"
+        except OSError:
+            pass
         
-        # 最終結果の表示
+        # 最終結果の表示（ダイアログはTkのスレッドで開く）
         if failed_files:
             error_details = "\n".join([f"• {name}: {error}" for name, error in failed_files[:5]])
             if len(failed_files) > 5:
                 error_details += f"\n...他{len(failed_files) - 5}件"
             
-            messagebox.showwarning(
+            self.ui_updates.call(lambda: messagebox.showwarning(
                 "変換完了（一部失敗）",
                 f"変換完了: {success_count}/{total_files} ファイル\n\n"
-                f"失敗したファイル:\n{error_details}"
-            )
-        else:
-            messagebox.showinfo("変換完了", f"すべてのファイル（{total_files}個）の変換が完了しました。")
-        
-        self.status_label.config(text=f"変換完了: {success_count}/{total_files} ファイル")
+                f"失敗したファイル:\n{error_details}{report_note}"
+            ))
+        elif not cancelled_count:
+            self.ui_updates.call(lambda: messagebox.showinfo(
+                "変換完了", f"すべてのファイル（{total_files}個）の変換が完了しました。{report_note}"
+            ))
+        
+        status = f"変換完了: {success_count}/{total_files} ファイル"
+        if cancelled_count:
+            status += f"（{cancelled_count}件中止）"
+        self.ui_updates.set_status(status)
     
-    def _update_status(self):
-        while not self.progress_queue.empty():
-            status = self.progress_queue.get()
-            self.status_label.config(text=status)
-        
-        if self.is_converting:
-            self.window.after(100, self._update_status)
+    def _flush_ui_updates(self):
+        """たまった画面の更新をまとめて反映し、FRAME_INTERVAL_MS後にまた呼ばれるようにする"""
+        pending = self.ui_updates.drain()
+        if pending.rows:
+            self.file_list.update_rows(pending.rows)
+        if pending.progress is not None:
+            value, maximum = pending.progress
+            self.progress.configure(value=value, maximum=maximum)
+        if pending.status is not None:
+            self.status_label.config(text=pending.status)
+        for call in pending.calls:
+            call()
+        
+        self.window.after(FRAME_INTERVAL_MS, self._flush_ui_updates)
+    
+    def _finish_conversion(self):
+        self.is_converting = False
+        self._conversion_thread = None
+        self.cancel_btn.config(state='disabled')
+        self.convert_btn.config(state='normal')
+        self.select_files_btn.config(state='normal')
+        self.select_output_btn.config(state='normal')
     
     def _start_conversion(self):
         if not self.selected_files:
@@ -333,23 +699,66 @@ class MP4ToMP3Converter:
         if not result:
             return
         
+        self.engine.aac_passthrough = self.aac_passthrough_var.get()
+        self.engine.force = self.force_var.get()
+        self.engine.dedup = self.dedup_var.get()
+        self.engine.profiles = [preset_profile(self.preset_var.get())]
+        self.engine.loudness = (
+            LoudnessTarget(single_pass=self.loudnorm_single_pass_var.get())
+            if self.loudnorm_var.get() else None
+        )
+        
         self.is_converting = True
+        self.cancel_btn.config(state='normal')
         self.convert_btn.config(state='disabled')
         self.select_files_btn.config(state='disabled')
         self.select_output_btn.config(state='disabled')
-        
-        self._update_status()
+        # 前回の結果を消して、すべての行を待機中に戻す
+        self.file_list.set_files(self.selected_files)
         
         def run_conversion():
             try:
                 self.loop.run_until_complete(self._convert_all_files())
             finally:
-                self.is_converting = False
-                self.convert_btn.config(state='normal')
-                self.select_files_btn.config(state='normal')
-                self.select_output_btn.config(state='normal')
+                self.ui_updates.call(self._finish_conversion)
         
-        threading.Thread(target=run_conversion, daemon=True).start()
+        self._conversion_thread = threading.Thread(target=run_conversion, daemon=True)
+        self._conversion_thread.start()
+    
+    def _cancel_conversion(self):
+        """バッチ全体を中止する（取り消しはイベントループのスレッドで行う）"""
+        if not self.is_converting:
+            return
+        self.cancel_btn.config(state='disabled')
+        self.status_label.config(text="変換を中止しています...")
+        self.loop.call_soon_threadsafe(self.engine.cancel)
+    
+    def _show_row_menu(self, event):
+        self._menu_row = self.file_list.row_at(event.y)
+        if self.is_converting and self._menu_row is not None:
+            self.row_menu.tk_popup(event.x_root, event.y_root)
+    
+    def _cancel_selected_row(self):
+        """右クリックした行のファイルの変換を中止する"""
+        jobs = self.jobs
+        if self._menu_row is None or self._menu_row >= len(jobs):
+            return
+        self.loop.call_soon_threadsafe(self.engine.cancel, jobs[self._menu_row])
+    
+    def _stop_conversion_for_exit(self):
+        """
+        終了前に変換を止める
+
+        取り消しを依頼してffmpegの終了と書きかけの出力の削除を待ち、
+        CLOSE_TIMEOUT秒で終わらなければ残ったffmpegを強制終了する。
+        """
+        thread = self._conversion_thread
+        if thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.engine.cancel)
+        thread.join(CLOSE_TIMEOUT)
+        if thread.is_alive():
+            self.engine.kill_processes()
     
     def run(self):
         # ウィンドウを中央に配置
@@ -374,9 +783,11 @@ class MP4ToMP3Converter:
             )
             if not result:
                 return
+            self._stop_conversion_for_exit()
         
         self.window.destroy()
 
+
 if __name__ == "__main__":
     try:
         app = MP4ToMP3Converter()
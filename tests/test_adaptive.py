@@ -0,0 +1,154 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mp4_to_mp3.adaptive import AdaptiveController
+from mp4_to_mp3.engine import ConcurrencyLimit, ConversionEngine, ConversionJob, JobStatus, ProcessTuning
+from mp4_to_mp3.system import SystemSample, SystemSampler
+
+
+def _stream(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def _controller(limit: int, upper: int = 8) -> AdaptiveController:
+    """同時実行数limitで動いている状態のコントローラーを作る"""
+    controller = AdaptiveController(max_workers=upper)
+    with patch('os.cpu_count', return_value=limit):
+        controller.start(ConversionEngine(max_workers=upper), upper)
+    return controller
+
+
+IDLE = SystemSample(cpu_busy=0.5, iowait=0.0)
+SATURATED = SystemSample(cpu_busy=0.99, iowait=0.0)
+DISK_BOUND = SystemSample(cpu_busy=0.3, iowait=0.4)
+
+
+class TestConcurrencyLimit:
+    """上限を変更できるセマフォのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_limit_can_change_while_running(self):
+        """実行中に上限を下げ、上げた場合に同時実行数が追従することのテスト"""
+        limit = ConcurrencyLimit(3)
+        peaks = []
+        release = asyncio.Event()
+
+        async def task():
+            async with limit:
+                peaks.append(limit.active)
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(task()) for _ in range(6)]
+        await asyncio.sleep(0)
+        assert limit.active == 3
+
+        limit.set_limit(5)
+        await asyncio.sleep(0)
+        assert limit.active == 5
+
+        limit.set_limit(1)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert max(peaks) == 5 and peaks[-1] == 1
+
+
+class TestAdaptiveController:
+    """同時実行数の自動調整のテストクラス"""
+
+    def test_grows_while_cpu_has_headroom(self):
+        """CPUに余裕があり、増やすと速くなる間は増やし続けることのテスト"""
+        controller = _controller(2)
+        assert controller.decide(IDLE, throughput=20.0, running=2) == 3
+        controller.limit = 3
+        assert controller.decide(IDLE, throughput=30.0, running=3) == 4
+        # CPUが埋まったら増やさない
+        controller.limit = 4
+        assert controller.decide(SATURATED, throughput=40.0, running=4) == 4
+
+    def test_adjust_updates_engine(self):
+        """決めた同時実行数が公開メソッド経由でエンジンに反映されることのテスト"""
+        controller = _controller(2)
+        with patch.object(ConversionEngine, 'set_concurrency') as set_concurrency, \
+             patch.object(controller, 'decide', return_value=3):
+            controller.adjust(IDLE)
+            controller.adjust(IDLE)
+        set_concurrency.assert_called_once_with(3)
+        assert controller.limit == 3
+
+    def test_reverts_when_growing_does_not_help(self):
+        """増やしても速くならなければ戻し、しばらくその数を上限にすることのテスト"""
+        controller = _controller(2)
+        assert controller.decide(IDLE, throughput=20.0, running=2) == 3
+        controller.limit = 3
+        assert controller.decide(IDLE, throughput=20.5, running=3) == 2
+        controller.limit = 2
+        assert controller.decide(IDLE, throughput=20.0, running=2) == 2
+
+    def test_shrinks_on_iowait(self):
+        """I/O待ちが多い場合は減らし、下限は守ることのテスト"""
+        controller = _controller(2)
+        assert controller.decide(DISK_BOUND, throughput=5.0, running=2) == 1
+        controller.limit = 1
+        # 上限の記録が切れても、I/O待ちが続く間は増やさない
+        for _ in range(20):
+            assert controller.decide(DISK_BOUND, throughput=5.0, running=1) == 1
+        assert controller.decide(None, throughput=5.0, running=1) == 1
+
+    def test_tuning(self):
+        """スレッド数とI/O優先度の選び方のテスト"""
+        controller = _controller(2)
+        with patch('os.cpu_count', return_value=8):
+            assert controller.tuning() == ProcessTuning(4, 10, 'best-effort')
+            controller.adjust(DISK_BOUND)
+            assert controller.limit == 1
+            assert controller.tuning() == ProcessTuning(8, 10, 'idle')
+
+    @pytest.mark.asyncio
+    async def test_engine_applies_tuning(self):
+        """ffmpegにスレッド数が渡され、優先度が設定されることのテスト"""
+        engine = ConversionEngine(use_manifest=False, ffmpeg_threads=2, nice=5, io_priority='idle')
+        process = MagicMock(pid=1234, returncode=0, stdout=_stream(b""), stderr=_stream(b""))
+        process.wait = MagicMock(side_effect=lambda: asyncio.sleep(0, 0))
+
+        with patch('asyncio.create_subprocess_exec', return_value=process) as mock_exec, \
+             patch('mp4_to_mp3.engine.set_process_priority') as mock_priority:
+            await engine._run_ffmpeg(['-i', 'in.mp4', 'out.mp3'])
+
+        args = mock_exec.call_args.args
+        assert args[args.index('-threads') + 1] == '2'
+        assert args.index('-threads') < args.index('-i')
+        mock_priority.assert_called_once_with(1234, 5, 'idle')
+
+    @pytest.mark.asyncio
+    async def test_controller_limits_running_jobs(self):
+        """バッチ中の同時実行数がコントローラーの決めた数に従うことのテスト"""
+        engine = ConversionEngine(max_workers=4, use_manifest=False)
+        sampler = MagicMock(spec=SystemSampler)
+        sampler.sample.return_value = DISK_BOUND
+        engine.controller = AdaptiveController(interval=0.01, sampler=sampler)
+        running = []
+        peak = 0
+
+        async def fake_run(job):
+            nonlocal peak
+            running.append(job)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.05)
+            running.remove(job)
+            job.status = JobStatus.DONE
+
+        jobs = [ConversionJob(f"/in/{i}.mp4", f"/out/{i}.mp3", i) for i in range(8)]
+        with patch('os.cpu_count', return_value=2), \
+             patch.object(engine, '_run_job', side_effect=fake_run):
+            await engine.run(jobs)
+
+        assert all(job.status == JobStatus.DONE for job in jobs)
+        assert peak == 2
+        # I/O待ちが続いたため下限まで減らしている
+        assert [limit for _, limit in engine.controller.history] == [2, 1]
+        assert engine.controller not in engine.listeners
@@ -0,0 +1,164 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.backends import PyAVBackend, make_backend, pyav_available
+from mp4_to_mp3.engine import ConversionEngine, EventKind, JobStatus, make_jobs
+from mp4_to_mp3.profiles import PRESETS
+
+pytestmark = pytest.mark.skipif(not pyav_available(), reason="PyAVがインストールされていない")
+
+
+def _write_aac(path, seconds: float = 1.0, noise: bool = False):
+    """AAC音声（既定は無音、noiseならノイズ）を持つMP4を作る（ffmpegを使わない）"""
+    import av
+    import numpy
+    with av.open(str(path), 'w') as container:
+        stream = container.add_stream('aac', rate=44100, layout='stereo')
+        samples = int(44100 * seconds)
+        if noise:
+            data = numpy.random.default_rng(0).uniform(-0.5, 0.5, (2, samples)).astype(numpy.float32)
+        else:
+            data = numpy.zeros((2, samples), dtype=numpy.float32)
+        frame = av.AudioFrame.from_ndarray(data, format='fltp', layout='stereo')
+        frame.sample_rate = 44100
+        container.mux(stream.encode(frame))
+        container.mux(stream.encode(None))
+    return str(path)
+
+
+@pytest.fixture
+def spawned():
+    """ワーカーの起動を数えるフィクスチャ"""
+    calls = []
+    original = asyncio.create_subprocess_exec
+
+    async def counting(*args, **kwargs):
+        calls.append(args)
+        return await original(*args, **kwargs)
+
+    with patch('mp4_to_mp3.backends.asyncio.create_subprocess_exec', counting):
+        yield calls
+
+
+class TestPyAVBackendSupports:
+    """ワーカーで変換するジョブの判定のテストクラス"""
+
+    def test_copy_only_by_default(self):
+        """既定ではストリームコピーだけをワーカーで行い、再エンコードはffmpegに任せることのテスト"""
+        backend = make_backend('pyav')
+        assert backend.supports([("a.m4a", ['-c:a', 'copy'])])
+        assert not backend.supports([("a.mp3", PRESETS['default'].codec_args())])
+        assert make_backend('ffmpeg') is None
+
+    def test_encode_arguments(self):
+        """プリセットのエンコード引数は扱え、フィルターはffmpegに任せることのテスト"""
+        backend = PyAVBackend(encode=True)
+        for profile in PRESETS.values():
+            assert backend.supports([("a.mp3", profile.codec_args())])
+        assert not backend.supports([("a.mp3", ['-acodec', 'libmp3lame', '-af', 'loudnorm'])])
+
+    def test_vbr_quality(self, tmp_path):
+        """-q:aの値がVBRの品質としてエンコーダーに渡ることのテスト"""
+        from mp4_to_mp3.pyav_worker import convert
+        input_file = _write_aac(tmp_path / "a.mp4", seconds=5.0, noise=True)
+        outputs = [
+            (str(tmp_path / f"q{quality}.mp3"), PRESETS['vbr']._replace(quality=quality).codec_args())
+            for quality in (2, 9)
+        ]
+
+        convert(input_file, outputs, lambda position: None)
+
+        high, low = (os.path.getsize(output) for output, _ in outputs)
+        assert high > low * 1.5
+
+
+class TestPyAVBackend:
+    """PyAVのワーカーでの変換のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_worker_is_reused(self, tmp_path, spawned):
+        """1つのワーカーが複数のファイルを変換し、バッチの終わりに終了することのテスト"""
+        inputs = [_write_aac(tmp_path / f"{name}.mp4") for name in ("a", "b", "c")]
+        backend = PyAVBackend(encode=True)
+        # ffmpeg・ffprobeが起動されれば失敗する
+        engine = ConversionEngine(
+            use_manifest=False, backend=backend,
+            ffmpeg_path=str(tmp_path / "missing"), ffprobe_path=str(tmp_path / "missing")
+        )
+
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")), max_workers=1)
+
+        assert [job.status for job in jobs] == [JobStatus.DONE] * 3
+        assert all(job.media.codec == 'aac' for job in jobs)
+        media = await backend.probe(jobs[0].output_file)
+        assert media.codec == 'mp3' and media.sample_rate == 44100
+        assert len(spawned) == 1
+        assert backend._idle == [] and not engine._processes
+
+    @pytest.mark.asyncio
+    async def test_passthrough_and_fallback(self, tmp_path, spawned):
+        """コピーはワーカーで行い、再エンコードはffmpegで行うことのテスト"""
+        input_file = _write_aac(tmp_path / "a.mp4")
+        engine = ConversionEngine(use_manifest=False, aac_passthrough=True, backend=PyAVBackend())
+
+        jobs = await engine.run(make_jobs([input_file], str(tmp_path / "copy")))
+        assert jobs[0].status == JobStatus.DONE
+        assert jobs[0].output_file.endswith(".m4a")
+        assert (await engine.backend.probe(jobs[0].output_file)).codec == 'aac'
+
+        ffmpeg_args = []
+
+        async def fake_ffmpeg(self, args, on_progress=None):
+            ffmpeg_args.append(args)
+            with open(args[-1], 'wb') as f:
+                f.write(b"mp3")
+            return 0, []
+
+        engine.aac_passthrough = False
+        with patch.object(ConversionEngine, '_run_ffmpeg', fake_ffmpeg):
+            jobs = await engine.run(make_jobs([input_file], str(tmp_path / "encode")))
+        assert jobs[0].status == JobStatus.DONE
+        assert len(ffmpeg_args) == 1 and len(spawned) == 1
+
+    @pytest.mark.asyncio
+    async def test_failure_keeps_worker(self, tmp_path, spawned):
+        """変換に失敗してもエラーが報告され、同じワーカーで次のファイルを変換することのテスト"""
+        broken = tmp_path / "broken.mp4"
+        broken.write_bytes(b"not a video")
+        inputs = [str(broken), _write_aac(tmp_path / "a.mp4")]
+        engine = ConversionEngine(use_manifest=False, longest_first=False, backend=PyAVBackend(encode=True))
+        # 解析できない入力も変換を試みる（ffprobeと同じくNoneになる）
+        assert await engine.backend.probe(str(broken)) is None
+
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")), max_workers=1)
+
+        assert jobs[0].status == JobStatus.FAILED
+        assert jobs[0].error_message
+        assert jobs[1].status == JobStatus.DONE
+        assert len(spawned) == 1
+        assert sorted(os.listdir(tmp_path / "out")) == ["a.mp3"]
+
+    @pytest.mark.asyncio
+    async def test_cancel_stops_worker(self, tmp_path):
+        """取り消すとワーカーが止められ、書きかけの出力が残らないことのテスト"""
+        input_file = _write_aac(tmp_path / "long.mp4", seconds=120.0)
+        engine = ConversionEngine(use_manifest=False, backend=PyAVBackend(encode=True))
+        pids = []
+
+        def on_event(event):
+            if event.kind == EventKind.PROGRESS and not pids:
+                pids.extend(engine._processes)
+                engine.cancel()
+
+        engine.add_listener(on_event)
+        jobs = await engine.run(make_jobs([input_file], str(tmp_path / "out")))
+
+        assert jobs[0].status == JobStatus.CANCELLED
+        assert len(pids) == 1
+        with pytest.raises(OSError):
+            os.kill(pids[0], 0)
+        assert os.listdir(tmp_path / "out") == []
+        assert engine.backend._idle == [] and not engine._processes
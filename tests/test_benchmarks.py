@@ -0,0 +1,84 @@
+import pytest
+
+from benchmarks.fixtures import DEFAULT_FIXTURES, FixtureSpec, fixture_args
+from benchmarks.run_benchmarks import BenchmarkError, compare_results, run_conversion
+
+
+def _results(files_per_second: float, realtime_factor: float) -> dict:
+    return {
+        'meta': {'fixture_set': 'default', 'copies': 4},
+        'runs': [{'concurrency': 4, 'files_per_second': files_per_second}],
+        'fixtures': [{'name': 'aac_44k_stereo_30s', 'realtime_factor': realtime_factor}],
+    }
+
+
+class TestFixtures:
+    """フィクスチャ生成のテストクラス"""
+
+    def test_fixture_args(self):
+        """lavfiソースから指定どおりのMP4を作るコマンドのテスト"""
+        spec = FixtureSpec('opus_48k_mono_5s', 'opus', 48000, 1, 5.0)
+        args = fixture_args(spec, "out.mp4")
+
+        assert args[0] == 'ffmpeg'
+        assert any('anoisesrc' in arg and 'sample_rate=48000' in arg and 'seed=1' in arg for arg in args)
+        assert args[args.index('-ac') + 1] == '1'
+        assert args[args.index('-c:a') + 1] == 'libopus'
+        assert args[-1] == "out.mp4"
+
+    def test_default_fixtures_cover_codecs(self):
+        """既定のフィクスチャがAAC・MP3・Opusを含むことのテスト"""
+        assert {spec.codec for spec in DEFAULT_FIXTURES} == {'aac', 'mp3', 'opus'}
+        assert len({spec.name for spec in DEFAULT_FIXTURES}) == len(DEFAULT_FIXTURES)
+
+
+class TestCompareResults:
+    """結果比較のテストクラス"""
+
+    def test_regression_is_reported(self):
+        """許容範囲を超えて遅くなった項目が報告されることのテスト"""
+        regressions = compare_results(_results(10.0, 50.0), _results(8.0, 49.0), 0.10)
+        assert len(regressions) == 1
+        assert regressions[0].startswith("files/sec @ -j 4")
+
+    def test_improvement_is_not_reported(self):
+        """速くなった項目は報告されないことのテスト"""
+        assert compare_results(_results(10.0, 50.0), _results(12.0, 60.0), 0.10) == []
+
+    def test_presets_are_compared(self):
+        """プリセットごとの実時間比も比較されることのテスト"""
+        baseline = {**_results(10.0, 50.0), 'presets': [{'preset': 'speech', 'realtime_factor': 150.0}]}
+        current = {**_results(10.0, 50.0), 'presets': [{'preset': 'speech', 'realtime_factor': 100.0}]}
+
+        regressions = compare_results(baseline, current, 0.10)
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith("realtime x preset speech")
+
+    def test_backends_are_compared(self):
+        """バックエンドごとの処理ファイル数/秒も比較されることのテスト"""
+        baseline = {**_results(10.0, 50.0), 'backends': [{'backend': 'pyav', 'files_per_second': 40.0}]}
+        current = {**_results(10.0, 50.0), 'backends': [{'backend': 'pyav', 'files_per_second': 20.0}]}
+
+        regressions = compare_results(baseline, current, 0.10)
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith("files/sec backend pyav")
+
+    def test_different_batches_skip_run_comparison(self):
+        """フィクスチャの組み合わせが違う場合はバッチの比較を省くことのテスト"""
+        current = _results(1.0, 50.0)
+        current['meta']['fixture_set'] = 'short_clips'
+        assert compare_results(_results(10.0, 50.0), current, 0.10) == []
+
+
+class TestRunConversion:
+    """変換コマンドの測定のテストクラス"""
+
+    def test_failed_conversion_is_not_measured(self, tmp_path):
+        """変換コマンドが失敗した場合は測定値を返さずにエラーになることのテスト"""
+        input_file = tmp_path / "a.mp4"
+        input_file.write_bytes(b"video")
+
+        with pytest.raises(BenchmarkError, match="終了コード 2"):
+            run_conversion([str(input_file)], str(tmp_path / "out"), 1, ['--no-such-option'])
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, EventKind, JobStatus, MediaInfo, make_jobs
+
+# 進捗を1度だけ出して止まる（入力名に"hang"を含む場合）か、すぐに出力を書いて終わるffmpegの代わり
+FAKE_FFMPEG = f"""#!{sys.executable}
+import os, sys, time
+args = sys.argv[1:]
+source = args[args.index('-i') + 1]
+with open(args[-1], 'wb') as f:
+    f.write(b"partial")
+with open(source + ".pid", 'w') as f:
+    f.write(str(os.getpid()))
+print("out_time_us=1000000", flush=True)
+print("progress=continue", flush=True)
+if 'hang' in os.path.basename(source):
+    time.sleep(60)
+print("progress=end", flush=True)
+"""
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """偽のffmpegを使うエンジンを作成するフィクスチャ"""
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    with patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 10.0)):
+        yield ConversionEngine(use_manifest=False, longest_first=False, ffmpeg_path=str(ffmpeg))
+
+
+def _inputs(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"video")
+        paths.append(str(path))
+    return paths
+
+
+def _assert_stopped(input_file: str):
+    """ffmpegが終了し、書きかけの出力が残っていないことを確かめる"""
+    with open(input_file + ".pid") as f:
+        pid = int(f.read())
+    with pytest.raises(OSError):
+        os.kill(pid, 0)
+    output_dir = os.path.join(os.path.dirname(input_file), "out")
+    assert not any(name.endswith(".mp3") for name in os.listdir(output_dir))
+
+
+class TestCancel:
+    """変換の取り消しのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_cancel_batch(self, engine, tmp_path):
+        """バッチ全体を取り消すと実行中のffmpegが止まり、残りのジョブは実行されないことのテスト"""
+        inputs = _inputs(tmp_path, "hang.mp4", "b.mp4", "c.mp4")
+        engine.add_listener(lambda event: event.kind == EventKind.PROGRESS and engine.cancel())
+
+        started = time.monotonic()
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")), max_workers=1)
+
+        assert time.monotonic() - started < 10
+        assert [job.status for job in jobs] == [JobStatus.CANCELLED] * 3
+        assert not os.path.exists(inputs[1] + ".pid")
+        _assert_stopped(inputs[0])
+        assert not engine._processes
+
+    @pytest.mark.asyncio
+    async def test_cancel_single_job(self, engine, tmp_path):
+        """1つのジョブを取り消してもほかのジョブは変換されることのテスト"""
+        inputs = _inputs(tmp_path, "hang.mp4", "b.mp4")
+
+        def on_event(event):
+            if event.kind == EventKind.PROGRESS and "hang" in event.job.input_file:
+                engine.cancel(event.job)
+
+        engine.add_listener(on_event)
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")), max_workers=2)
+
+        assert [job.status for job in jobs] == [JobStatus.CANCELLED, JobStatus.DONE]
+        assert os.path.exists(jobs[1].output_file)
+        with open(inputs[0] + ".pid") as f:
+            with pytest.raises(OSError):
+                os.kill(int(f.read()), 0)
+
+    @pytest.mark.asyncio
+    async def test_caller_cancellation_stops_ffmpeg(self, engine, tmp_path):
+        """呼び出し側ごと止められた場合もffmpegが終了し、書きかけの出力が消されることのテスト"""
+        inputs = _inputs(tmp_path, "hang.mp4")
+        jobs = make_jobs(inputs, str(tmp_path / "out"))
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(engine.run(jobs), timeout=1.0)
+
+        assert jobs[0].status == JobStatus.CANCELLED
+        _assert_stopped(inputs[0])
+
+    def test_cancel_outside_batch_is_ignored(self, engine):
+        """バッチの実行中でなければ取り消しが次のバッチに残らないことのテスト"""
+        engine.cancel()
+        assert not engine._cancel_all
+
+
+class TestStallWatchdog:
+    """進捗の止まったffmpegの監視のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_stalled_job_fails(self, engine, tmp_path):
+        """進捗が止まったffmpegは止められ、ジョブは失敗し、ほかのジョブは続くことのテスト"""
+        engine.stall_timeout = 0.5
+        inputs = _inputs(tmp_path, "hang.mp4", "b.mp4")
+
+        started = time.monotonic()
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")), max_workers=1)
+
+        assert time.monotonic() - started < 10
+        assert jobs[0].status == JobStatus.FAILED
+        assert "進捗がないため中止しました" in jobs[0].error_message
+        assert jobs[1].status == JobStatus.DONE
+        with open(inputs[0] + ".pid") as f:
+            with pytest.raises(OSError):
+                os.kill(int(f.read()), 0)
+        assert not os.path.exists(os.path.join(str(tmp_path / "out"), ".hang.partial.mp3"))
+
+
+class TestSigterm:
+    """SIGTERMで止めたときの後片付けのテストクラス（コマンドラインの各モード）"""
+
+    @pytest.fixture
+    def tools(self, tmp_path):
+        """偽のffmpegと、常に失敗するffprobeを作るフィクスチャ"""
+        ffmpeg = tmp_path / "ffmpeg"
+        ffmpeg.write_text(FAKE_FFMPEG)
+        ffprobe = tmp_path / "ffprobe"
+        ffprobe.write_text(f"#!{sys.executable}\nimport sys\nsys.exit(1)\n")
+        for tool in (ffmpeg, ffprobe):
+            tool.chmod(0o755)
+        return ['--ffmpeg', str(ffmpeg), '--ffprobe', str(ffprobe), '--no-probe-index']
+
+    @staticmethod
+    def _start(*args: str) -> subprocess.Popen:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.Popen(
+            [sys.executable, '-m', 'mp4_to_mp3', *args], cwd=root,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+    @staticmethod
+    def _wait_for_ffmpeg(input_file: str) -> int:
+        deadline = time.monotonic() + 20
+        while not os.path.exists(input_file + ".pid"):
+            assert time.monotonic() < deadline, "ffmpegが起動しない"
+            time.sleep(0.05)
+        time.sleep(0.2)
+        with open(input_file + ".pid") as f:
+            return int(f.read())
+
+    @staticmethod
+    def _assert_cleaned_up(process: subprocess.Popen, ffmpeg_pid: int, output_dir: str):
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=20) == 0
+        with pytest.raises(OSError):
+            os.kill(ffmpeg_pid, 0)
+        assert [name for name in os.listdir(output_dir) if name.endswith(".mp3")] == []
+
+    def test_watch(self, tmp_path, tools):
+        """監視モードでSIGTERMを受け取るとffmpegが止まり、書きかけの出力が消えることのテスト"""
+        input_dir = tmp_path / "in"
+        input_dir.mkdir()
+        input_file = _inputs(input_dir, "hang.mp4")[0]
+        output_dir = str(tmp_path / "out")
+        process = self._start(str(input_dir), '-o', output_dir, '--watch', '--settle-seconds', '0.1', *tools)
+        try:
+            self._assert_cleaned_up(process, self._wait_for_ffmpeg(input_file), output_dir)
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_worker_and_coordinator(self, tmp_path, tools):
+        """ワーカーはSIGTERMでffmpegを止めて終わり、コーディネーターもSIGTERMで終わることのテスト"""
+        input_file = _inputs(tmp_path, "hang.mp4")[0]
+        output_dir = str(tmp_path / "out")
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        coordinator = self._start(input_file, '-o', output_dir, '--coordinator', f"127.0.0.1:{port}", *tools)
+        worker = self._start('--worker', f"http://127.0.0.1:{port}", *tools)
+        try:
+            self._assert_cleaned_up(worker, self._wait_for_ffmpeg(input_file), output_dir)
+            coordinator.send_signal(signal.SIGTERM)
+            coordinator.wait(timeout=20)
+        finally:
+            for process in (worker, coordinator):
+                process.kill()
+                process.wait()
@@ -0,0 +1,153 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.backends import PyAVBackend, pyav_available
+from mp4_to_mp3.cli import expand_inputs, main
+from mp4_to_mp3.engine import JobStatus
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def _touch(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b"dummy")
+
+
+class TestExpandInputs:
+    """入力指定の展開のテストクラス"""
+
+    def test_directory_is_searched_recursively(self, temp_dir):
+        """ディレクトリ内のMP4が再帰的に見つかることのテスト"""
+        _touch(os.path.join(temp_dir, "a.mp4"))
+        _touch(os.path.join(temp_dir, "sub", "b.MP4"))
+        _touch(os.path.join(temp_dir, "sub", "notes.txt"))
+
+        found = expand_inputs([temp_dir])
+
+        assert found == [
+            (os.path.join(temp_dir, "a.mp4"), ""),
+            (os.path.join(temp_dir, "sub", "b.MP4"), "sub"),
+        ]
+
+    def test_glob_and_duplicates(self, temp_dir):
+        """globパターンが展開され、重複が除かれることのテスト"""
+        first = os.path.join(temp_dir, "x1.mp4")
+        second = os.path.join(temp_dir, "x2.mp4")
+        _touch(first)
+        _touch(second)
+
+        found = expand_inputs([os.path.join(temp_dir, "x*.mp4"), first])
+
+        assert found == [(first, ""), (second, "")]
+
+
+class TestMain:
+    """コマンドラインのエントリーポイントのテストクラス"""
+
+    def test_converts_inputs_into_mirrored_directories(self, temp_dir, capsys):
+        """ディレクトリ構成を保った出力先でジョブが作られることのテスト"""
+        source = os.path.join(temp_dir, "in")
+        _touch(os.path.join(source, "sub", "b.mp4"))
+        output_dir = os.path.join(temp_dir, "out")
+        seen = []
+
+        async def fake_run(self, job):
+            seen.append(job.output_file)
+            job.status = JobStatus.DONE
+
+        with patch('mp4_to_mp3.engine.ConversionEngine._run_job', fake_run):
+            exit_code = main([source, "-o", output_dir, "-j", "2"])
+
+        assert exit_code == 0
+        assert seen == [os.path.join(output_dir, "sub", "b.mp3")]
+        assert "変換完了: 1/1" in capsys.readouterr().out
+
+    def test_failures_set_exit_code(self, temp_dir):
+        """失敗があれば終了コードが1になることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+
+        async def fake_run(self, job):
+            job.status = JobStatus.FAILED
+            job.error_message = "broken"
+
+        with patch('mp4_to_mp3.engine.ConversionEngine._run_job', fake_run):
+            assert main([input_file, "-o", temp_dir]) == 1
+
+    def test_preset_selects_profile(self, temp_dir):
+        """--presetのエンコード設定で変換され、--profileとは同時に使えないことのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+        profiles = []
+
+        async def fake_run(self, job):
+            profiles.extend(self.profiles)
+            job.status = JobStatus.DONE
+
+        with patch('mp4_to_mp3.engine.ConversionEngine._run_job', fake_run):
+            assert main([input_file, "-o", temp_dir, "--preset", "speech"]) == 0
+        assert [(profile.name, profile.template, profile.quality) for profile in profiles] == [
+            ('speech', "{stem}.mp3", 7)
+        ]
+
+        with pytest.raises(SystemExit):
+            main([input_file, "-o", temp_dir, "--preset", "speech", "--profile", "podcast"])
+
+    def test_backend_requires_pyav(self, temp_dir):
+        """--backend pyavはPyAVがなければエラーになり、あればエンジンに渡されることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+
+        with patch('mp4_to_mp3.cli.pyav_available', return_value=False):
+            with pytest.raises(SystemExit):
+                main([input_file, "-o", temp_dir, "--backend", "pyav"])
+
+        if not pyav_available():
+            return
+        backends = []
+
+        async def fake_run(self, job):
+            backends.append(self.backend)
+            job.status = JobStatus.DONE
+
+        with patch('mp4_to_mp3.engine.ConversionEngine._run_job', fake_run):
+            assert main([input_file, "-o", temp_dir, "--backend", "pyav", "--no-probe-index"]) == 0
+        assert [type(backend) for backend in backends] == [PyAVBackend]
+
+    def test_writes_run_report(self, temp_dir):
+        """出力ディレクトリに実行レポートが書き込まれることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+        output_dir = os.path.join(temp_dir, "out")
+        textfile = os.path.join(temp_dir, "mp4_to_mp3.prom")
+
+        async def fake_run(self, job):
+            job.status = JobStatus.DONE
+
+        with patch('mp4_to_mp3.engine.ConversionEngine._run_job', fake_run):
+            main([input_file, "-o", output_dir, "--prometheus-textfile", textfile])
+
+        assert os.path.exists(os.path.join(output_dir, "conversion_report.json"))
+        assert os.path.exists(os.path.join(output_dir, "conversion_report.csv"))
+        with open(textfile, encoding='utf-8') as f:
+            assert 'mp4_to_mp3_batch_files{status="done"} 1' in f.read()
+
+    def test_engine_does_not_import_tkinter(self):
+        """エンジンとCLIがtkinterなしで読み込めることのテスト"""
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = "import sys, mp4_to_mp3, mp4_to_mp3.cli; sys.exit('tkinter' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], cwd=root)
+        assert result.returncode == 0
@@ -0,0 +1,168 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.dedup import group_same_content, materialize
+from mp4_to_mp3.engine import ConversionEngine, EventKind, JobStatus, MediaInfo, make_jobs
+from mp4_to_mp3.manifest import SAMPLE_BLOCK_SIZE, SAMPLE_BLOCKS, file_sha256
+
+
+@pytest.fixture
+def encodes():
+    """ffmpegの実行を置き換え、エンコードした入力を記録するフィクスチャ"""
+    inputs = []
+
+    async def fake_ffmpeg(self, args, on_progress=None):
+        input_file = args[args.index('-i') + 1]
+        inputs.append(os.path.basename(input_file))
+        if input_file.endswith("broken.mp4"):
+            return 1, ["Invalid data found when processing input"]
+        with open(input_file, 'rb') as source, open(args[-1], 'wb') as f:
+            f.write(b"mp3:" + source.read())
+        return 0, []
+
+    with patch.object(ConversionEngine, '_run_ffmpeg', fake_ffmpeg), \
+         patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 10.0)):
+        yield inputs
+
+
+def _write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestGroupSameContent:
+    """同じ内容の入力の検出のテストクラス"""
+
+    def test_groups_identical_files(self, tmp_path):
+        """名前が違っても内容が同じファイルがまとめられることのテスト"""
+        paths = [
+            _write(tmp_path / "a.mp4", b"lecture"),
+            _write(tmp_path / "b.mp4", b"another"),
+            _write(tmp_path / "a-copy.mp4", b"lecture"),
+            _write(tmp_path / "a-again.mp4", b"lecture"),
+            str(tmp_path / "missing.mp4"),
+        ]
+
+        assert group_same_content(paths) == [[0, 2, 3]]
+
+    def test_full_hash_breaks_sample_ties(self, tmp_path):
+        """抜き出したブロックが一致しても、全体が違えば別の内容とされることのテスト"""
+        size = SAMPLE_BLOCK_SIZE * SAMPLE_BLOCKS * 4
+        original = bytearray(size)
+        changed = bytearray(size)
+        # 抜き出すブロックの間（先頭ブロックの直後）だけを変える
+        changed[SAMPLE_BLOCK_SIZE + 10] = 1
+        paths = [
+            _write(tmp_path / "a.mp4", bytes(original)),
+            _write(tmp_path / "b.mp4", bytes(changed)),
+        ]
+
+        with patch('mp4_to_mp3.dedup.file_sha256', wraps=file_sha256) as mock_sha:
+            assert group_same_content(paths) == []
+        assert mock_sha.call_count == 2
+
+
+class TestMaterialize:
+    """出力の作り方のテストクラス"""
+
+    def test_hardlink(self, tmp_path):
+        """ハードリンクで作られ、作り直しても壊れないことのテスト"""
+        source = _write(tmp_path / "a.mp3", b"mp3")
+        destination = str(tmp_path / "b.mp3")
+
+        assert materialize(source, destination) == 'hardlink'
+        assert os.path.samefile(source, destination)
+        assert materialize(source, destination) == 'hardlink'
+        assert sorted(os.listdir(tmp_path)) == ["a.mp3", "b.mp3"]
+
+    def test_falls_back_to_copy(self, tmp_path):
+        """リンクできない場合はコピーになることのテスト"""
+        source = _write(tmp_path / "a.mp3", b"mp3")
+        destination = _write(tmp_path / "b.mp3", b"old")
+
+        with patch('os.link', side_effect=OSError("cross-device link")), \
+             patch('mp4_to_mp3.dedup._reflink', side_effect=OSError("not supported")):
+            assert materialize(source, destination) == 'copy'
+
+        assert not os.path.samefile(source, destination)
+        assert open(destination, 'rb').read() == b"mp3"
+        assert sorted(os.listdir(tmp_path)) == ["a.mp3", "b.mp3"]
+
+
+class TestEngineDedup:
+    """エンジンでの重複の省略のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_identical_inputs_are_encoded_once(self, tmp_path, encodes):
+        """バッチ内の同じ内容の入力は1度だけエンコードされることのテスト"""
+        inputs = [
+            _write(tmp_path / "a.mp4", b"lecture"),
+            _write(tmp_path / "b.mp4", b"another"),
+            _write(tmp_path / "c.mp4", b"lecture"),
+        ]
+        output_dir = str(tmp_path / "out")
+        engine = ConversionEngine(dedup=True, longest_first=False)
+
+        jobs = await engine.run(make_jobs(inputs, output_dir))
+
+        assert sorted(encodes) == ["a.mp4", "b.mp4"]
+        assert [job.status for job in jobs] == [JobStatus.DONE] * 3
+        assert jobs[2].duplicate_of == inputs[0]
+        assert os.path.samefile(jobs[0].output_file, jobs[2].output_file)
+        assert open(jobs[2].output_file, 'rb').read() == b"mp3:lecture"
+
+        # 2回目は変換記録により、リンクで作った出力も省略される
+        again = await ConversionEngine(dedup=True).run(make_jobs(inputs, output_dir))
+        assert [job.status for job in again] == [JobStatus.SKIPPED] * 3
+
+    @pytest.mark.asyncio
+    async def test_previous_batches_are_reused(self, tmp_path, encodes):
+        """以前のバッチで変換した同じ内容の入力の出力が使われることのテスト"""
+        output_dir = str(tmp_path / "out")
+        first = _write(tmp_path / "a.mp4", b"lecture")
+        await ConversionEngine().run(make_jobs([first], output_dir))
+
+        reupload = _write(tmp_path / "a (1).mp4", b"lecture")
+        jobs = await ConversionEngine(dedup=True).run(make_jobs([reupload], output_dir))
+
+        assert encodes == ["a.mp4"]
+        assert jobs[0].status == JobStatus.DONE
+        assert jobs[0].duplicate_of == os.path.abspath(first)
+        assert os.path.samefile(jobs[0].output_file, os.path.join(output_dir, "a.mp3"))
+
+    @pytest.mark.asyncio
+    async def test_failure_is_shared(self, tmp_path, encodes):
+        """エンコードに失敗した内容は、同じ内容の入力でもエンコードし直さないことのテスト"""
+        inputs = [
+            _write(tmp_path / "broken.mp4", b"broken"),
+            _write(tmp_path / "copy.mp4", b"broken"),
+        ]
+        engine = ConversionEngine(dedup=True, use_manifest=False)
+
+        jobs = await engine.run(make_jobs(inputs, str(tmp_path / "out")))
+
+        assert encodes == ["broken.mp4"]
+        assert [job.status for job in jobs] == [JobStatus.FAILED] * 2
+        assert "broken.mp4" in jobs[1].error_message
+
+    @pytest.mark.asyncio
+    async def test_cancellation_is_shared(self, tmp_path, encodes):
+        """エンコードを取り消した内容は、同じ内容の入力も失敗ではなく取り消しになることのテスト"""
+        inputs = [
+            _write(tmp_path / "a.mp4", b"lecture"),
+            _write(tmp_path / "b.mp4", b"lecture"),
+        ]
+        engine = ConversionEngine(dedup=True, use_manifest=False, longest_first=False)
+        jobs = make_jobs(inputs, str(tmp_path / "out"))
+
+        def on_event(event):
+            if event.kind == EventKind.STARTED and event.job is jobs[0]:
+                engine.cancel(jobs[0])
+
+        engine.add_listener(on_event)
+        await engine.run(jobs)
+
+        assert encodes == []
+        assert [job.status for job in jobs] == [JobStatus.CANCELLED] * 2
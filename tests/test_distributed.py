@@ -0,0 +1,166 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.distributed import Coordinator, Worker
+from mp4_to_mp3.engine import ConversionEngine, JobStatus, MediaInfo, make_jobs
+
+
+async def fake_ffmpeg(self, args, on_progress=None):
+    """出力先（最後の引数）に入力の内容を書き出す"""
+    with open(args[args.index('-i') + 1], 'rb') as source, open(args[-1], 'wb') as f:
+        f.write(b"mp3:" + source.read())
+    return 0, []
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """入力ファイルを作成するフィクスチャ"""
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    paths = []
+    for name in ("a", "b", "c"):
+        path = input_dir / f"{name}.mp4"
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture(autouse=True)
+def fake_tools():
+    with patch.object(ConversionEngine, '_run_ffmpeg', fake_ffmpeg), \
+         patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 10.0)):
+        yield
+
+
+async def _run_batch(coordinator: Coordinator, worker_count: int):
+    coordinator.start('127.0.0.1', 0)
+    workers = [Worker(coordinator.url, f"w{n}", poll_interval=0.05) for n in range(worker_count)]
+    results = await asyncio.gather(coordinator.run(), *(worker.run() for worker in workers))
+    return results[0], results[1:]
+
+
+class TestDistributedConversion:
+    """コーディネーターとワーカーによる分散変換のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_workers_share_storage(self, tmp_path, inputs):
+        """共有ストレージ上のジョブが複数のワーカーで変換され、記録されることのテスト"""
+        output_dir = str(tmp_path / "out")
+        engine = ConversionEngine(manifest_dir=output_dir)
+
+        jobs, counts = await _run_batch(Coordinator(engine, make_jobs(inputs, output_dir)), 2)
+
+        assert [job.status for job in jobs] == [JobStatus.DONE] * 3
+        assert sum(counts) == 3
+        assert open(os.path.join(output_dir, "b.mp3"), 'rb').read() == b"mp3:b"
+
+        # 2回目は変換記録により、ワーカーに渡さずに省略される
+        again = Coordinator(ConversionEngine(manifest_dir=output_dir), make_jobs(inputs, output_dir))
+        jobs, _ = await _run_batch(again, 0)
+        assert [job.status for job in jobs] == [JobStatus.SKIPPED] * 3
+
+    @pytest.mark.asyncio
+    async def test_transfer_mode(self, tmp_path, inputs):
+        """入出力をHTTPで送受信するモードのテスト"""
+        output_dir = str(tmp_path / "out")
+        coordinator = Coordinator(ConversionEngine(), make_jobs(inputs, output_dir), transfer=True)
+
+        jobs, _ = await _run_batch(coordinator, 1)
+
+        assert all(job.status == JobStatus.DONE for job in jobs)
+        assert jobs[0].output_file == os.path.join(output_dir, "a.mp3")
+        assert sorted(os.listdir(output_dir)) == [
+            ".mp4_to_mp3_manifest.json", "a.mp3", "b.mp3", "c.mp3"
+        ]
+        assert open(os.path.join(output_dir, "c.mp3"), 'rb').read() == b"mp3:c"
+
+    @pytest.mark.asyncio
+    async def test_expired_lease_is_retried(self, tmp_path, inputs):
+        """応答のないワーカーのジョブが貸し出し直され、古い結果は拒否されることのテスト"""
+        coordinator = Coordinator(
+            ConversionEngine(use_manifest=False), make_jobs(inputs[:1], str(tmp_path / "out")),
+            lease_seconds=0.05, max_attempts=2
+        )
+        coordinator.start('127.0.0.1', 0)
+        results = coordinator.iter_results()
+        first_result = asyncio.ensure_future(results.__anext__())
+        while coordinator.lease({'worker': 'probe'})[0] != 200:
+            await asyncio.sleep(0.01)
+
+        await asyncio.sleep(0.1)
+        status, lease = coordinator.lease({'worker': 'b'})
+        assert status == 200 and lease['attempt'] == 2
+        stale = {'worker': 'probe', 'index': 0, 'attempt': 1, 'result': {'status': JobStatus.DONE}}
+        assert coordinator.complete(stale)[0] == 409
+
+        # 上限の回数まで失効したジョブは失敗として返る
+        await asyncio.sleep(0.1)
+        assert coordinator.lease({'worker': 'c'})[0] == 410
+        job = await first_result
+        assert job.status == JobStatus.FAILED
+        assert "2回" in job.error_message
+        await results.aclose()
+
+
+    @pytest.mark.asyncio
+    async def test_cancel(self, tmp_path, inputs):
+        """取り消すと未完了のジョブがCANCELLEDで返り、貸し出しが止まることのテスト"""
+        coordinator = Coordinator(ConversionEngine(use_manifest=False), make_jobs(inputs, str(tmp_path / "out")))
+        coordinator.start('127.0.0.1', 0)
+        results = coordinator.iter_results()
+        first_result = asyncio.ensure_future(results.__anext__())
+        while coordinator.lease({'worker': 'w'})[0] != 200:
+            await asyncio.sleep(0.01)
+
+        coordinator.cancel()
+
+        jobs = [await first_result] + [job async for job in results]
+        assert [job.status for job in jobs] == [JobStatus.CANCELLED] * 3
+        assert coordinator._server is None
+        stale = {'worker': 'w', 'index': jobs[0].index, 'attempt': 1, 'result': {'status': JobStatus.DONE}}
+        assert coordinator.complete(stale)[0] == 409
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_cancels_encoding(self, tmp_path, inputs):
+        """リースを失ったワーカーは変換を取り消し、一時ファイルは試行ごとに別の名前になることのテスト"""
+        coordinator = Coordinator(
+            ConversionEngine(use_manifest=False), make_jobs(inputs[:1], str(tmp_path / "out")),
+            lease_seconds=0.3
+        )
+        coordinator.start('127.0.0.1', 0)
+        results = coordinator.iter_results()
+        first_result = asyncio.ensure_future(results.__anext__())
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+        encodes = []
+
+        async def hanging_ffmpeg(self, args, on_progress=None):
+            encodes.append(args[-1])
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return 0, []
+
+        worker = Worker(coordinator.url, "w", poll_interval=0.05)
+        with patch.object(ConversionEngine, '_run_ffmpeg', hanging_ffmpeg):
+            running = asyncio.ensure_future(worker.run())
+            await asyncio.wait_for(started.wait(), 5)
+            # リースを失効させて別のワーカーに貸し出す
+            with coordinator._lock:
+                coordinator._leases[0] = coordinator._leases[0]._replace(deadline=0.0)
+            assert coordinator.lease({'worker': 'other'})[1]['attempt'] == 2
+            await asyncio.wait_for(cancelled.wait(), 5)
+            worker.cancel()
+            await asyncio.wait_for(running, 5)
+
+        assert os.path.basename(encodes[0]) == ".a.attempt1.partial.mp3"
+        assert not os.path.exists(encodes[0])
+        coordinator.cancel()
+        assert (await first_result).status == JobStatus.CANCELLED
+        await results.aclose()
@@ -0,0 +1,318 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mp4_to_mp3.engine import (
+    STDERR_TAIL_LINES,
+    ConversionEngine,
+    ConversionEvent,
+    ConversionJob,
+    EventKind,
+    JobStatus,
+    MediaInfo,
+    _parse_duration,
+    _parse_out_time,
+    _parse_probe_output,
+    make_jobs,
+)
+from mp4_to_mp3.manifest import ConversionManifest
+
+
+def _stream(data: bytes) -> asyncio.StreamReader:
+    """指定したバイト列を返して終端するStreamReaderを作成する"""
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def _make_process(stdout: bytes = b"", stderr: bytes = b"", returncode: int = 0) -> MagicMock:
+    """ffmpegプロセスのモックを作成する"""
+    process = MagicMock()
+    process.stdout = _stream(stdout)
+    process.stderr = _stream(stderr)
+    process.returncode = returncode
+
+    async def mock_wait():
+        return returncode
+    process.wait = mock_wait
+    return process
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+class TestConversionEngineConvertFile:
+    """ファイル変換機能のテストクラス"""
+
+    @pytest.fixture
+    def engine(self):
+        """変換記録を使わないConversionEngineを作成するフィクスチャ"""
+        return ConversionEngine(use_manifest=False)
+
+    @pytest.mark.asyncio
+    async def test_convert_file_success(self, engine, temp_dir):
+        """ファイル変換の成功テスト"""
+        input_file = os.path.join(temp_dir, "test.mp4")
+        output_file = os.path.join(temp_dir, "test.mp3")
+
+        with open(input_file, 'w') as f:
+            f.write("dummy content")
+
+        with patch('asyncio.create_subprocess_exec') as mock_subprocess, \
+             patch('mp4_to_mp3.engine.probe_audio', return_value=None):
+            mock_subprocess.return_value = _make_process(
+                stdout=b"out_time_us=5000000\nspeed=10x\nprogress=continue\n"
+                       b"out_time_us=10000000\nspeed=10x\nprogress=end\n",
+                stderr=b"  Duration: 00:00:10.00, start: 0.000000, bitrate: 128 kb/s\n",
+                returncode=0
+            )
+
+            # 変換後の一時ファイルの確認ではTrueを返し、出力ファイルへの置き換えは行わない
+            with patch('mp4_to_mp3.engine.os.path.exists', return_value=True), \
+                 patch('mp4_to_mp3.engine.replace_durably') as mock_replace, \
+                 patch('mp4_to_mp3.engine.os.path.getsize', return_value=1234):
+
+                result_file, success, error = await engine.convert_file(input_file, output_file)
+
+                assert success is True, f"Expected success=True, got success={success}, error='{error}'"
+                assert result_file == input_file
+                assert error == ""
+                mock_subprocess.assert_called_once()
+                mock_replace.assert_called_once_with(
+                    os.path.join(temp_dir, ".test.partial.mp3"), output_file
+                )
+
+    @pytest.mark.asyncio
+    async def test_convert_file_failure(self, engine, temp_dir):
+        """ファイル変換の失敗テスト"""
+        input_file = os.path.join(temp_dir, "test.mp4")
+        output_file = os.path.join(temp_dir, "test.mp3")
+
+        with patch('asyncio.create_subprocess_exec', side_effect=Exception("Test error")):
+            result_file, success, error = await engine.convert_file(input_file, output_file)
+
+            assert success is False
+            assert result_file == input_file
+            assert error == "Test error"
+
+    @pytest.mark.asyncio
+    async def test_convert_file_reports_progress(self, engine, temp_dir):
+        """進捗がPROGRESSイベントとして逐次通知されることのテスト"""
+        input_file = os.path.join(temp_dir, "test.mp4")
+        output_file = os.path.join(temp_dir, "test.mp3")
+        process = _make_process(
+            stdout=b"out_time_us=2500000\nspeed=5.0x\nprogress=continue\n"
+                   b"out_time_us=10000000\nspeed=5.0x\nprogress=end\n",
+            stderr=b"  Duration: 00:00:10.00, start: 0.000000, bitrate: 128 kb/s\n"
+        )
+        events = []
+        engine.add_listener(events.append)
+
+        with patch('asyncio.create_subprocess_exec', return_value=process), \
+             patch('mp4_to_mp3.engine.probe_audio', return_value=None), \
+             patch('mp4_to_mp3.engine.os.path.exists', return_value=False):
+            await engine.convert_file(input_file, output_file)
+
+        progress = [(e.fraction, e.speed) for e in events if e.kind == EventKind.PROGRESS]
+        assert progress == [(0.25, "5.0x"), (1.0, "5.0x")]
+        assert [e.kind for e in events][0] == EventKind.STARTED
+        assert [e.kind for e in events][-1] == EventKind.FINISHED
+
+    @pytest.mark.asyncio
+    async def test_convert_file_keeps_stderr_tail(self, engine, temp_dir):
+        """失敗時に標準エラー出力の末尾だけが返ることのテスト"""
+        input_file = os.path.join(temp_dir, "test.mp4")
+        output_file = os.path.join(temp_dir, "test.mp3")
+        stderr = b"".join(f"line {i}\n".encode() for i in range(1000))
+        process = _make_process(stderr=stderr, returncode=1)
+
+        with patch('asyncio.create_subprocess_exec', return_value=process), \
+             patch('mp4_to_mp3.engine.probe_audio', return_value=None), \
+             patch('mp4_to_mp3.engine.os.path.exists', return_value=False):
+            _, success, error = await engine.convert_file(input_file, output_file)
+
+        assert success is False
+        lines = error.splitlines()
+        assert len(lines) == STDERR_TAIL_LINES
+        assert lines[-1] == "line 999"
+
+    def test_parse_duration(self):
+        """ffmpegログからの長さ取得のテスト"""
+        assert _parse_duration("  Duration: 01:02:03.50, start: 0.0") == 3723.5
+        assert _parse_duration("Stream #0:0: Audio: aac") is None
+
+    def test_parse_out_time(self):
+        """進捗ブロックからの出力時間取得のテスト"""
+        assert _parse_out_time({'out_time_us': '1500000'}) == 1.5
+        assert _parse_out_time({'out_time_ms': '2000000'}) == 2.0
+        assert _parse_out_time({'out_time_us': 'N/A'}) is None
+
+
+class TestConversionEnginePlanOutput:
+    """コーデックに応じた変換方法選択のテストクラス"""
+
+    def test_parse_probe_output(self):
+        """ffprobeのJSON出力解析のテスト"""
+        output = (
+            '{"streams": [{"codec_name": "aac", "sample_rate": "48000", "channels": 2}],'
+            ' "format": {"duration": "12.5"}}'
+        )
+        assert _parse_probe_output(output) == MediaInfo("aac", 48000, 2, 12.5)
+        assert _parse_probe_output('{"streams": []}') is None
+        assert _parse_probe_output('not json') is None
+
+    def test_mp3_audio_is_stream_copied(self):
+        """MP3音声は再エンコードせずにコピーされることのテスト"""
+        media = MediaInfo("mp3", 44100, 2, 10.0)
+        output_file, args = ConversionEngine().plan_output("/out/a.mp3", media)
+        assert output_file == "/out/a.mp3"
+        assert args == ['-c:a', 'copy']
+
+    def test_aac_is_reencoded_by_default(self):
+        """AAC音声は既定ではMP3へ再エンコードされることのテスト"""
+        media = MediaInfo("aac", 44100, 2, 10.0)
+        output_file, args = ConversionEngine().plan_output("/out/a.mp3", media)
+        assert output_file == "/out/a.mp3"
+        assert 'libmp3lame' in args
+
+    def test_aac_passthrough_extracts_m4a(self):
+        """aac_passthrough有効時はAAC音声を.m4aへ抽出することのテスト"""
+        media = MediaInfo("aac", 44100, 2, 10.0)
+        engine = ConversionEngine(aac_passthrough=True)
+        output_file, args = engine.plan_output("/out/a.mp3", media)
+        assert output_file == "/out/a.m4a"
+        assert args == ['-c:a', 'copy']
+
+    def test_unknown_codec_falls_back_to_encode(self):
+        """ffprobeが使えない場合は再エンコードすることのテスト"""
+        engine = ConversionEngine(aac_passthrough=True)
+        output_file, args = engine.plan_output("/out/a.mp3", None)
+        assert output_file == "/out/a.mp3"
+        assert 'libmp3lame' in args
+
+
+class TestConversionEngineScheduling:
+    """ワーカープールによるジョブ実行のテストクラス"""
+
+    @pytest.fixture
+    def engine(self):
+        """変換記録を使わないConversionEngineを作成するフィクスチャ"""
+        return ConversionEngine(use_manifest=False)
+
+    @pytest.mark.asyncio
+    async def test_run_respects_max_workers(self, engine):
+        """同時実行数がmax_workersを超えないことのテスト"""
+        running = 0
+        peak = 0
+
+        async def fake_run(job):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            job.status = JobStatus.DONE
+
+        jobs = make_jobs([f"in{i}.mp4" for i in range(10)], "/out")
+        with patch.object(engine, '_run_job', side_effect=fake_run):
+            results = await engine.run(jobs, max_workers=3)
+
+        assert peak == 3
+        assert [job.input_file for job in results] == [f"in{i}.mp4" for i in range(10)]
+        assert all(job.success for job in results)
+
+    @pytest.mark.asyncio
+    async def test_iter_results_yields_in_completion_order(self, engine):
+        """終わったジョブから順に結果が返ることのテスト"""
+        async def fake_run(job):
+            await asyncio.sleep(0.01 * (3 - job.index))
+            job.status = JobStatus.DONE
+
+        jobs = make_jobs([f"in{i}.mp4" for i in range(3)], "/out")
+        with patch.object(engine, '_run_job', side_effect=fake_run):
+            order = [job.index async for job in engine.iter_results(jobs, max_workers=3)]
+
+        assert order == [2, 1, 0]
+
+    @pytest.mark.asyncio
+    async def test_listener_errors_do_not_stop_batch(self, engine):
+        """リスナーの例外が警告に変わりバッチが続行されることのテスト"""
+        warnings = []
+
+        def listener(event: ConversionEvent):
+            if event.kind == EventKind.WARNING:
+                warnings.append(event)
+            elif event.kind == EventKind.FINISHED:
+                raise RuntimeError("sink down")
+
+        async def fake_run(job):
+            job.status = JobStatus.DONE
+
+        engine.add_listener(listener)
+        jobs = make_jobs(["a.mp4", "b.mp4"], "/out")
+        with patch.object(engine, '_run_job', side_effect=fake_run):
+            results = await engine.run(jobs)
+
+        assert all(job.success for job in results)
+        assert len(warnings) == 2
+
+    def test_make_jobs_derives_output_names(self):
+        """出力ファイル名が入力のベース名から作られることのテスト"""
+        jobs = make_jobs(["/in/a.mp4", "/in/sub/b.MP4"], "/out")
+        assert [job.output_file for job in jobs] == [
+            os.path.join("/out", "a.mp3"),
+            os.path.join("/out", "b.mp3"),
+        ]
+        assert [job.index for job in jobs] == [0, 1]
+
+
+class TestConversionEngineManifest:
+    """変換記録との連携のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_convert_file_skips_converted_input(self, temp_dir):
+        """変換済みの入力ではffmpegを起動しないことのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        output_file = os.path.join(temp_dir, "a.mp3")
+        for path, data in ((input_file, b"video"), (output_file, b"audio")):
+            with open(path, 'wb') as f:
+                f.write(data)
+        engine = ConversionEngine()
+        engine.manifest_for(temp_dir).record(input_file, output_file, engine.encoding_params())
+
+        with patch('asyncio.create_subprocess_exec') as mock_subprocess:
+            job = ConversionJob(input_file, output_file)
+            await engine.run_job(job)
+            assert job.status == JobStatus.SKIPPED
+            mock_subprocess.assert_not_called()
+
+            engine.force = True
+            mock_subprocess.side_effect = Exception("forced")
+            _, success, _ = await engine.convert_file(input_file, output_file)
+            assert success is False
+
+    @pytest.mark.asyncio
+    async def test_manifest_saved_after_batch(self, temp_dir):
+        """バッチ終了時に変換記録が保存されることのテスト"""
+        engine = ConversionEngine()
+        manifest = engine.manifest_for(temp_dir)
+
+        async def fake_run(job):
+            manifest.dirty = True
+            job.status = JobStatus.DONE
+
+        with patch.object(engine, '_run_job', side_effect=fake_run), \
+             patch.object(ConversionManifest, 'save') as mock_save:
+            await engine.run(make_jobs(["a.mp4"], temp_dir))
+
+        mock_save.assert_called_once()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, ConversionJob, JobStatus, MediaInfo, partial_path_for
+from mp4_to_mp3.journal import JOURNAL_FILENAME, JobJournal
+from mp4_to_mp3.manifest import ConversionManifest
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def _touch(path: str, data: bytes = b"data"):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestJobJournal:
+    """ジャーナルのテストクラス"""
+
+    def test_torn_last_line_is_ignored(self, temp_dir):
+        """書き込み途中で途切れた行が無視されることのテスト"""
+        journal = JobJournal(os.path.join(temp_dir, JOURNAL_FILENAME))
+        journal.append({'state': 'started', 'input': '/in/a.mp4'})
+        journal.append({'state': 'done', 'input': '/in/a.mp4'}, durable=True)
+        with open(journal.path, 'a', encoding='utf-8') as f:
+            f.write('{"state": "sta')
+
+        assert [record['state'] for record in journal.replay()] == ['started', 'done']
+
+    def test_manifest_recovers_from_journal(self, temp_dir):
+        """保存前に落ちても完了した記録と中断したジョブが復元されることのテスト"""
+        done_input = os.path.join(temp_dir, "a.mp4")
+        running_input = os.path.join(temp_dir, "b.mp4")
+        output_file = os.path.join(temp_dir, "a.mp3")
+        for path in (done_input, running_input, output_file):
+            _touch(path)
+
+        manifest = ConversionManifest.load(temp_dir)
+        manifest.mark(done_input, 'started')
+        manifest.mark(running_input, 'started')
+        manifest.record(done_input, output_file, {})
+        # save()を呼ばずに終了した状態から読み込み直す
+
+        recovered = ConversionManifest.load(temp_dir)
+        assert recovered.lookup(done_input, {}) == output_file
+        assert recovered.interrupted == [os.path.abspath(running_input)]
+
+        recovered.save()
+        assert not os.path.exists(os.path.join(temp_dir, JOURNAL_FILENAME))
+        assert ConversionManifest.load(temp_dir).lookup(done_input, {}) == output_file
+
+    def test_interrupted_partials_are_removed(self, temp_dir):
+        """中断したジョブの書きかけの一時ファイルが次回の読み込みで削除されることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        partial = partial_path_for(os.path.join(temp_dir, "sub", "a.m4a"))
+        other = partial_path_for(os.path.join(temp_dir, "sub", "b.mp3"))
+        os.makedirs(os.path.dirname(partial))
+        for path in (input_file, partial, other):
+            _touch(path)
+
+        ConversionManifest.load(temp_dir).mark(input_file, 'started', partials=[partial])
+        ConversionManifest.load(temp_dir)
+
+        assert not os.path.exists(partial)
+        # ジャーナルにない一時ファイル（実行中の別の変換のものかもしれない）は残す
+        assert os.path.exists(other)
+
+
+class TestAtomicOutput:
+    """一時ファイル経由の出力のテストクラス"""
+
+    @pytest.fixture
+    def input_file(self, temp_dir):
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file, b"video")
+        return input_file
+
+    @pytest.mark.asyncio
+    async def test_output_is_renamed_into_place(self, temp_dir, input_file):
+        """完成した一時ファイルが出力ファイルへ置き換えられることのテスト"""
+        output_file = os.path.join(temp_dir, "a.mp3")
+        _touch(output_file, b"old")
+        engine = ConversionEngine()
+        written = []
+
+        async def fake_ffmpeg(args, on_progress=None):
+            written.append(args[-1])
+            # エンコード中も以前の出力はそのまま残っている
+            assert open(output_file, 'rb').read() == b"old"
+            _touch(args[-1], b"new audio")
+            return 0, []
+
+        with patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 1.0)), \
+             patch.object(engine, '_run_ffmpeg', side_effect=fake_ffmpeg):
+            job = await engine.run_job(ConversionJob(input_file, output_file))
+
+        assert job.status == JobStatus.DONE
+        assert written == [partial_path_for(output_file)]
+        assert open(output_file, 'rb').read() == b"new audio"
+        assert not os.path.exists(partial_path_for(output_file))
+
+    @pytest.mark.asyncio
+    async def test_failure_removes_partial_output(self, temp_dir, input_file):
+        """失敗時に書きかけの一時ファイルが消え、ジャーナルに失敗が残ることのテスト"""
+        output_file = os.path.join(temp_dir, "a.mp3")
+        engine = ConversionEngine()
+
+        async def fake_ffmpeg(args, on_progress=None):
+            _touch(args[-1], b"half")
+            return 1, ["Conversion failed!"]
+
+        with patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 1.0)), \
+             patch.object(engine, '_run_ffmpeg', side_effect=fake_ffmpeg):
+            job = await engine.run_job(ConversionJob(input_file, output_file))
+
+        assert job.status == JobStatus.FAILED
+        assert sorted(os.listdir(temp_dir)) == sorted(["a.mp4", JOURNAL_FILENAME])
+        states = [record['state'] for record in JobJournal(os.path.join(temp_dir, JOURNAL_FILENAME)).replay()]
+        assert states == ['started', 'failed']
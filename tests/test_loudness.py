@@ -0,0 +1,169 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, JobStatus, MediaInfo, make_jobs
+from mp4_to_mp3.loudness import LoudnessMeasurement, LoudnessTarget, loudness_args, parse_measurement
+from mp4_to_mp3.probe_index import ProbeIndex
+from mp4_to_mp3.profiles import OutputProfile
+
+# loudnormのprint_format=jsonの出力（ffmpeg 7.0）
+ANALYSIS_STDERR = [
+    "[Parsed_loudnorm_0 @ 0x7efec4001d80] ",
+    "{",
+    '\t"input_i" : "-26.29",',
+    '\t"input_tp" : "-12.59",',
+    '\t"input_lra" : "0.10",',
+    '\t"input_thresh" : "-36.29",',
+    '\t"output_i" : "-16.00",',
+    '\t"output_tp" : "-2.31",',
+    '\t"output_lra" : "0.10",',
+    '\t"output_thresh" : "-26.00",',
+    '\t"normalization_type" : "dynamic",',
+    '\t"target_offset" : "0.00"',
+    "}",
+    "[out#0/null @ 0xe0e93c0] video:0KiB audio:3762KiB subtitle:0KiB other streams:0KiB",
+]
+
+MEASUREMENT = LoudnessMeasurement(-26.29, -12.59, 0.1, -36.29)
+
+
+@pytest.fixture
+def ffmpeg_calls():
+    """ffmpegの実行を置き換え、解析とエンコードの引数を記録するフィクスチャ"""
+    calls = []
+
+    async def fake_ffmpeg(self, args, on_progress=None):
+        calls.append(args)
+        if args[-3:] == ['-f', 'null', '-']:
+            return 0, ANALYSIS_STDERR
+        with open(args[-1], 'wb') as f:
+            f.write(b"mp3")
+        return 0, []
+
+    with patch.object(ConversionEngine, '_run_ffmpeg', fake_ffmpeg), \
+         patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("mp3", 48000, 2, 10.0)):
+        yield calls
+
+
+def _analyses(calls):
+    return [args for args in calls if args[-1] == '-']
+
+
+class TestLoudnessFilter:
+    """loudnormの指定と解析結果の読み取りのテストクラス"""
+
+    def test_parse_measurement(self):
+        """解析の出力から入力の値だけが取り出されることのテスト"""
+        assert parse_measurement(ANALYSIS_STDERR) == MEASUREMENT
+        assert parse_measurement(["Invalid data found when processing input"]) is None
+
+    def test_silence_is_not_measured(self):
+        """無音で値が-infになった場合は測定値なしとされることのテスト"""
+        silent = [line.replace('"-26.29"', '"-inf"') for line in ANALYSIS_STDERR]
+        assert parse_measurement(silent) is None
+
+    def test_filter(self):
+        """測定値があれば2パス目の指定（linear）に、なければ1パスの指定になることのテスト"""
+        target = LoudnessTarget(-16.0, -1.5, 11.0)
+        assert target.filter() == "loudnorm=I=-16:TP=-1.5:LRA=11"
+        assert target.filter(MEASUREMENT) == (
+            "loudnorm=I=-16:TP=-1.5:LRA=11:measured_I=-26.29:measured_TP=-12.59"
+            ":measured_LRA=0.1:measured_thresh=-36.29:linear=true"
+        )
+
+    def test_sample_rate_is_restored(self):
+        """プロファイルがサンプルレートを指定しなければ入力のサンプルレートに戻すことのテスト"""
+        target = LoudnessTarget()
+        assert loudness_args(target, None, ['-b:a', '192k'], 48000)[2:] == ['-ar', '48000']
+        assert loudness_args(target, None, ['-ar', '24000'], 48000) == ['-af', target.filter()]
+
+
+class TestEngineLoudness:
+    """エンジンでの音量の正規化のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_measurement_is_cached(self, ffmpeg_calls, tmp_path):
+        """解析は入力ごとに1度だけ行われ、プロファイルを変えた再変換では保存した値を使うことのテスト"""
+        input_file = tmp_path / "a.mp4"
+        input_file.write_bytes(b"video")
+        index = ProbeIndex(str(tmp_path / "index.sqlite3"))
+        engine = ConversionEngine(use_manifest=False, probe_index=index, loudness=LoudnessTarget())
+
+        jobs = await engine.run(make_jobs([str(input_file)], str(tmp_path / "out")))
+        assert jobs[0].status == JobStatus.DONE
+        assert 'analyze' in jobs[0].timings
+        assert len(_analyses(ffmpeg_calls)) == 1
+        assert index.lookup_loudness(str(input_file)) == MEASUREMENT
+
+        engine.profiles = [OutputProfile("low", bitrate="64k")]
+        jobs = await engine.run(make_jobs([str(input_file)], str(tmp_path / "out2")))
+        assert jobs[0].status == JobStatus.DONE
+        assert len(_analyses(ffmpeg_calls)) == 1
+        encode = ffmpeg_calls[-1]
+        assert encode[encode.index('-af') + 1] == LoudnessTarget().filter(MEASUREMENT)
+        assert encode[encode.index('-ar') + 1] == '48000'
+
+    @pytest.mark.asyncio
+    async def test_measurement_is_kept_in_manifest(self, ffmpeg_calls, tmp_path):
+        """probe_indexがなくても、変換記録に残した測定値で同じ出力先への再変換の解析を省くことのテスト"""
+        input_file = tmp_path / "a.mp4"
+        input_file.write_bytes(b"video")
+        output_dir = str(tmp_path / "out")
+        engine = ConversionEngine(probe_index=None, loudness=LoudnessTarget())
+
+        jobs = await engine.run(make_jobs([str(input_file)], output_dir))
+        assert jobs[0].status == JobStatus.DONE
+        assert len(_analyses(ffmpeg_calls)) == 1
+
+        engine = ConversionEngine(
+            probe_index=None, loudness=LoudnessTarget(), profiles=[OutputProfile("low", bitrate="64k")]
+        )
+        jobs = await engine.run(make_jobs([str(input_file)], output_dir))
+        assert jobs[0].status == JobStatus.DONE
+        assert len(_analyses(ffmpeg_calls)) == 1
+        encode = ffmpeg_calls[-1]
+        assert encode[encode.index('-af') + 1] == LoudnessTarget().filter(MEASUREMENT)
+
+        # 入力が変わったら測り直す
+        input_file.write_bytes(b"edited video")
+        jobs = await engine.run(make_jobs([str(input_file)], output_dir))
+        assert jobs[0].status == JobStatus.DONE
+        assert len(_analyses(ffmpeg_calls)) == 2
+
+    @pytest.mark.asyncio
+    async def test_single_pass_skips_analysis(self, ffmpeg_calls, tmp_path):
+        """1パスでは解析せず、ストリームコピーもしないことのテスト"""
+        input_file = tmp_path / "a.mp4"
+        input_file.write_bytes(b"video")
+        engine = ConversionEngine(use_manifest=False, loudness=LoudnessTarget(single_pass=True))
+
+        jobs = await engine.run(make_jobs([str(input_file)], str(tmp_path / "out")))
+
+        assert jobs[0].status == JobStatus.DONE
+        assert _analyses(ffmpeg_calls) == []
+        encode = ffmpeg_calls[0]
+        assert 'copy' not in encode
+        assert encode[encode.index('-af') + 1] == LoudnessTarget().filter()
+
+    @pytest.mark.asyncio
+    async def test_failed_analysis_fails_job(self, tmp_path):
+        """解析のffmpegが失敗したらエンコードせずにジョブが失敗することのテスト"""
+        input_file = tmp_path / "a.mp4"
+        input_file.write_bytes(b"video")
+        calls = []
+
+        async def fake_ffmpeg(self, args, on_progress=None):
+            calls.append(args)
+            return 1, ["Invalid data found when processing input"]
+
+        with patch.object(ConversionEngine, '_run_ffmpeg', fake_ffmpeg), \
+             patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 10.0)):
+            engine = ConversionEngine(use_manifest=False, loudness=LoudnessTarget())
+            jobs = await engine.run(make_jobs([str(input_file)], str(tmp_path / "out")))
+
+        assert jobs[0].status == JobStatus.FAILED
+        assert "Invalid data" in jobs[0].error_message
+        assert len(calls) == 1
+        assert not os.listdir(tmp_path / "out")
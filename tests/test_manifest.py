@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from mp4_to_mp3.manifest import MANIFEST_FILENAME, ConversionManifest
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+class TestConversionManifest:
+    """変換記録のテストクラス"""
+
+    PARAMS = {'codec': 'libmp3lame', 'bitrate': '192k', 'aac_passthrough': False}
+
+    @pytest.fixture
+    def converted(self, temp_dir):
+        """変換済みの入力と出力を作成するフィクスチャ"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        output_file = os.path.join(temp_dir, "a.mp3")
+        with open(input_file, 'wb') as f:
+            f.write(b"video")
+        with open(output_file, 'wb') as f:
+            f.write(b"audio")
+        return input_file, output_file
+
+    def test_record_and_lookup(self, temp_dir, converted):
+        """記録した入力が再読み込み後もスキップ対象になることのテスト"""
+        input_file, output_file = converted
+        manifest = ConversionManifest.load(temp_dir)
+        manifest.record(input_file, output_file, self.PARAMS)
+        manifest.save()
+        assert os.path.exists(os.path.join(temp_dir, MANIFEST_FILENAME))
+
+        reloaded = ConversionManifest.load(temp_dir)
+        assert reloaded.lookup(input_file, self.PARAMS) == output_file
+        assert reloaded.lookup(input_file, self.PARAMS, verify_output=True) == output_file
+
+    def test_lookup_rejects_changed_input_or_params(self, temp_dir, converted):
+        """入力や設定が変わった場合は再変換対象になることのテスト"""
+        input_file, output_file = converted
+        manifest = ConversionManifest(temp_dir)
+        manifest.record(input_file, output_file, self.PARAMS)
+
+        assert manifest.lookup(input_file, dict(self.PARAMS, bitrate='128k')) is None
+        with open(input_file, 'ab') as f:
+            f.write(b"more")
+        assert manifest.lookup(input_file, self.PARAMS) is None
+
+    def test_lookup_rejects_corrupt_output(self, temp_dir, converted):
+        """出力が書き換えられた場合は再変換対象になることのテスト"""
+        input_file, output_file = converted
+        manifest = ConversionManifest(temp_dir)
+        manifest.record(input_file, output_file, self.PARAMS)
+        with open(output_file, 'wb') as f:
+            f.write(b"AUDIO")
+
+        assert manifest.lookup(input_file, self.PARAMS) == output_file
+        assert manifest.lookup(input_file, self.PARAMS, verify_output=True) is None
+
+    def test_content_hash_survives_touch(self, temp_dir, converted):
+        """内容ハッシュがあれば更新日時の変化だけでは再変換しないことのテスト"""
+        input_file, output_file = converted
+        manifest = ConversionManifest(temp_dir, hash_inputs=True)
+        manifest.record(input_file, output_file, self.PARAMS)
+        stat = os.stat(input_file)
+        os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert manifest.lookup(input_file, self.PARAMS) == output_file
+
+    def test_prune_removes_stale_entries(self, temp_dir, converted):
+        """入力や出力が失われた記録が削除されることのテスト"""
+        input_file, output_file = converted
+        manifest = ConversionManifest(temp_dir)
+        manifest.record(input_file, output_file, self.PARAMS)
+        assert manifest.prune() == []
+
+        os.remove(output_file)
+        assert manifest.prune() == [os.path.abspath(input_file)]
+        assert manifest.entries == {}
+
+    def test_prune_checks_modification_time(self, temp_dir, converted):
+        """同じ大きさのまま書き換えられた入力の記録は、内容ハッシュが一致しなければ削除されることのテスト"""
+        input_file, output_file = converted
+        hashed = ConversionManifest(temp_dir, hash_inputs=True)
+        hashed.record(input_file, output_file, self.PARAMS)
+        plain = ConversionManifest(temp_dir)
+        plain.record(input_file, output_file, self.PARAMS)
+        stat = os.stat(input_file)
+        os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert hashed.prune() == []
+        assert plain.prune() == [os.path.abspath(input_file)]
+
+        with open(input_file, 'wb') as f:
+            f.write(b"VIDEO")
+        assert hashed.prune() == [os.path.abspath(input_file)]
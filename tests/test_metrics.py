@@ -0,0 +1,163 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEvent, ConversionJob, EventKind, JobStatus, MediaInfo
+from mp4_to_mp3.metrics import (
+    REPORT_CSV_FILENAME,
+    REPORT_JSON_FILENAME,
+    BatchReport,
+    EtaEstimator,
+    format_eta,
+    job_realtime_factor,
+    percentile,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def _job(index: int, status: str, latency: float, duration: float = 60.0) -> ConversionJob:
+    """計測値を埋めた完了済みのジョブを作る"""
+    job = ConversionJob(f"/in/{index}.mp4", f"/out/{index}.mp3", index, status=status)
+    job.media = MediaInfo("aac", 44100, 2, duration)
+    job.queued_at = 100.0
+    job.started_at = 100.0 + latency / 2
+    job.finished_at = 100.0 + latency
+    job.timings = {'queue_wait': latency / 2, 'probe': 0.1, 'encode': latency / 2 - 0.2, 'finalize': 0.1}
+    job.returncode = 0 if status == JobStatus.DONE else 1
+    job.output_size = 1000 if status == JobStatus.DONE else None
+    if status == JobStatus.FAILED:
+        job.error_message = "Invalid data"
+        job.stderr_tail = ["Invalid data"]
+    return job
+
+
+def _report(jobs) -> BatchReport:
+    report = BatchReport()
+    report.start()
+    for job in jobs:
+        report(ConversionEvent(EventKind.STARTED, job))
+        report(ConversionEvent(EventKind.FINISHED, job))
+    report.finish()
+    # 経過時間を固定して集計値を確かめやすくする
+    report.started_at, report.finished_at = 0.0, 10.0
+    return report
+
+
+class TestBatchReport:
+    """実行レポートのテストクラス"""
+
+    def test_percentile(self):
+        """最近傍順位法のパーセンタイルのテスト"""
+        values = [float(v) for v in range(1, 21)]
+        assert percentile(values, 0.5) == 10.0
+        assert percentile(values, 0.95) == 19.0
+        assert percentile([], 0.5) is None
+
+    def test_summary(self):
+        """状態別の件数、実時間比、レイテンシの集計のテスト"""
+        jobs = [_job(i, JobStatus.DONE, float(i + 1)) for i in range(4)]
+        jobs.append(_job(4, JobStatus.FAILED, 1.0))
+        summary = _report(jobs).summary()
+
+        assert summary['files'] == 5
+        assert summary['files_by_status'] == {'done': 4, 'skipped': 0, 'failed': 1}
+        assert summary['wall_seconds'] == 10.0
+        assert summary['media_seconds'] == 240.0
+        assert summary['realtime_factor'] == 24.0
+        assert summary['latency_p50_seconds'] == 2.0
+        assert summary['latency_p95_seconds'] == 4.0
+        assert summary['stage_seconds']['queue_wait'] == pytest.approx(5.5)
+
+    def test_write_reports(self, temp_dir):
+        """JSONとCSVのレポートが入力順に書き込まれることのテスト"""
+        jobs = [_job(1, JobStatus.FAILED, 2.0), _job(0, JobStatus.DONE, 4.0)]
+        paths = _report(jobs).write_reports(temp_dir)
+
+        assert paths == [
+            os.path.join(temp_dir, REPORT_JSON_FILENAME),
+            os.path.join(temp_dir, REPORT_CSV_FILENAME),
+        ]
+        with open(paths[0], encoding='utf-8') as f:
+            report = json.load(f)
+        assert [job['input_file'] for job in report['jobs']] == ["/in/0.mp4", "/in/1.mp4"]
+        assert report['jobs'][1]['stderr_tail'] == ["Invalid data"]
+        assert report['jobs'][0]['realtime_factor'] == 30.0
+
+        with open(paths[1], encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert rows[0]['status'] == 'done' and rows[0]['output_bytes'] == '1000'
+        assert rows[1]['returncode'] == '1' and rows[1]['error'] == "Invalid data"
+
+    def test_realtime_factor_only_for_encoded_jobs(self):
+        """スキップや同じ内容へのリンクで終わったジョブには実時間比を出さないことのテスト"""
+        skipped = _job(0, JobStatus.SKIPPED, 0.004)
+        linked = _job(1, JobStatus.DONE, 0.004)
+        linked.duplicate_of = "/in/0.mp4"
+
+        assert job_realtime_factor(_job(2, JobStatus.DONE, 4.0)) == 30.0
+        assert job_realtime_factor(skipped) is None
+        assert job_realtime_factor(linked) is None
+
+    def test_prometheus_text(self, temp_dir):
+        """textfile collector形式でメトリクスが書き込まれることのテスト"""
+        path = os.path.join(temp_dir, "mp4_to_mp3.prom")
+        report = _report([_job(0, JobStatus.DONE, 4.0)])
+        report.write_prometheus(path)
+
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        assert 'mp4_to_mp3_batch_files{status="done"} 1' in lines
+        assert 'mp4_to_mp3_batch_wall_seconds 10.0' in lines
+        assert 'mp4_to_mp3_job_latency_seconds{quantile="0.95"} 4.0' in lines
+        assert '# TYPE mp4_to_mp3_batch_stage_seconds gauge' in lines
+        assert os.listdir(temp_dir) == ["mp4_to_mp3.prom"]
+
+
+class TestEtaEstimator:
+    """残り時間の見積もりのテストクラス"""
+
+    def test_remaining_seconds_from_running_rate(self):
+        """処理済みの長さと経過時間から残り時間が求まることのテスト"""
+        jobs = [ConversionJob(f"/in/{i}.mp4", f"/out/{i}.mp3", i) for i in range(3)]
+        for job, duration in zip(jobs, (600.0, 300.0, 100.0)):
+            job.media = MediaInfo("aac", 44100, 2, duration)
+        eta = EtaEstimator(jobs)
+        assert eta.remaining_seconds() is None
+
+        eta(ConversionEvent(EventKind.STARTED, jobs[0]))
+        eta.started_at = 0.0
+        eta(ConversionEvent(EventKind.PROGRESS, jobs[0], fraction=0.5))
+        # 10秒で300秒分を処理した（実時間比30倍）ので残り700秒分は約23秒
+        assert eta.realtime_factor(now=10.0) == 30.0
+        assert eta.remaining_seconds(now=10.0) == pytest.approx(700.0 / 30.0)
+
+    def test_skipped_jobs_are_excluded(self):
+        """省略されたジョブは残りの長さにも処理速度にも含めないことのテスト"""
+        jobs = [ConversionJob(f"/in/{i}.mp4", f"/out/{i}.mp3", i) for i in range(2)]
+        for job in jobs:
+            job.media = MediaInfo("aac", 44100, 2, 100.0)
+        eta = EtaEstimator(jobs)
+        eta(ConversionEvent(EventKind.STARTED, jobs[0]))
+        eta.started_at = 0.0
+        jobs[0].status = JobStatus.SKIPPED
+        eta(ConversionEvent(EventKind.FINISHED, jobs[0]))
+        eta(ConversionEvent(EventKind.PROGRESS, jobs[1], fraction=0.25))
+
+        assert eta.remaining_seconds(now=5.0) == pytest.approx(15.0)
+
+    def test_format_eta(self):
+        """残り時間の表示形式のテスト"""
+        assert format_eta(None) == ""
+        assert format_eta(125.4) == "2:05"
+        assert format_eta(3723.0) == "1:02:03"
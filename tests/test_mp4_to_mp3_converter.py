@@ -1,105 +1,207 @@
-import asyncio
-import os
-import shutil
-import tempfile
+import threading
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from mp4_to_mp3_converter import MP4ToMP3Converter
+from mp4_to_mp3 import ConversionEvent, ConversionJob, EventKind, FfmpegCapabilities, JobStatus
+from mp4_to_mp3_converter import FileListModel, MP4ToMP3Converter, UiUpdates, VirtualFileList
 
 
-class TestMP4ToMP3ConverterCheckFfmpeg:
-    """ffmpegチェック機能のテストクラス"""
+CAPABILITIES = FfmpegCapabilities(
+    "/opt/ffmpeg/ffmpeg", "/opt/ffmpeg/ffprobe", "7.0.2", ("aac", "libmp3lame"), ("file", "pipe"), ("file", "pipe")
+)
 
-    def test_check_ffmpeg_success(self):
+
+class TestMP4ToMP3ConverterFfmpegProbe:
+    """ffmpegの確認のテストクラス"""
+
+    @pytest.fixture
+    def converter(self):
+        """MP4ToMP3Converterのインスタンスを作成するフィクスチャ"""
+        with patch('tkinter.Tk'), \
+             patch.object(MP4ToMP3Converter, '_start_ffmpeg_probe'), \
+             patch.object(MP4ToMP3Converter, '_create_widgets'), \
+             patch.object(MP4ToMP3Converter, '_setup_async_loop'):
+            converter = MP4ToMP3Converter()
+            converter.ffmpeg_info = MagicMock()
+            converter.convert_btn = MagicMock()
+            return converter
+
+    def test_probe_does_not_block_startup(self):
+        """ffmpegの確認を待たずに画面が作られることのテスト"""
+        release = threading.Event()
+
+        def slow_probe():
+            release.wait(5)
+            return CAPABILITIES
+
+        with patch('tkinter.Tk'), \
+             patch('mp4_to_mp3_converter.load_capabilities', side_effect=slow_probe), \
+             patch.object(MP4ToMP3Converter, '_create_widgets') as mock_create, \
+             patch.object(MP4ToMP3Converter, '_setup_async_loop'):
+            converter = MP4ToMP3Converter()
+            mock_create.assert_called_once()
+            assert converter.ffmpeg_capabilities is None
+
+            converter.ffmpeg_info = MagicMock()
+            converter.convert_btn = MagicMock()
+            release.set()
+            assert converter._ffmpeg_probe_queue.get(timeout=5) == CAPABILITIES
+
+    def test_ffmpeg_found(self, converter):
         """ffmpegが利用可能な場合のテスト"""
-        with patch('subprocess.run') as mock_run:
-            mock_run.return_value.returncode = 0
-            
-            with patch('tkinter.Tk'), \
-                 patch.object(MP4ToMP3Converter, '_create_widgets'), \
-                 patch.object(MP4ToMP3Converter, '_setup_async_loop'):
-                converter = MP4ToMP3Converter()
-                result = converter._check_ffmpeg()
-                assert result is True
-
-    def test_check_ffmpeg_failure(self):
+        converter._on_ffmpeg_probed(CAPABILITIES)
+
+        assert converter.engine.ffmpeg_path == "/opt/ffmpeg/ffmpeg"
+        assert converter.engine.ffprobe_path == "/opt/ffmpeg/ffprobe"
+        converter.convert_btn.config.assert_called_once_with(state='normal')
+
+    def test_ffmpeg_without_libmp3lame(self, converter):
+        """MP3エンコーダーがない場合は変換を有効にしないことのテスト"""
+        converter._on_ffmpeg_probed(CAPABILITIES._replace(encoders=("aac",)))
+
+        converter.convert_btn.config.assert_not_called()
+        assert "libmp3lame" in converter.ffmpeg_info.config.call_args.kwargs['text']
+
+    def test_ffmpeg_not_found(self, converter):
         """ffmpegが利用不可能な場合のテスト"""
-        with patch('subprocess.run', side_effect=FileNotFoundError):
-            with patch('tkinter.Tk'), \
-                 patch.object(MP4ToMP3Converter, '_create_widgets'), \
-                 patch.object(MP4ToMP3Converter, '_setup_async_loop'):
-                converter = MP4ToMP3Converter()
-                result = converter._check_ffmpeg()
-                assert result is False
+        with patch('tkinter.messagebox.showerror') as mock_error:
+            converter._on_ffmpeg_probed(None)
 
+        mock_error.assert_called_once()
+        converter.window.destroy.assert_called_once()
 
-class TestMP4ToMP3ConverterConvertFile:
-    """ファイル変換機能のテストクラス"""
 
-    @pytest.fixture
-    def temp_dir(self):
-        """一時ディレクトリを作成するフィクスチャ"""
-        temp_dir = tempfile.mkdtemp()
-        yield temp_dir
-        shutil.rmtree(temp_dir)
+class TestMP4ToMP3ConverterEngineEvents:
+    """エンジンとの連携のテストクラス"""
 
     @pytest.fixture
     def converter(self):
         """MP4ToMP3Converterのインスタンスを作成するフィクスチャ"""
         with patch('tkinter.Tk'), \
-             patch.object(MP4ToMP3Converter, '_check_ffmpeg', return_value=True), \
+             patch.object(MP4ToMP3Converter, '_start_ffmpeg_probe'), \
              patch.object(MP4ToMP3Converter, '_create_widgets'), \
              patch.object(MP4ToMP3Converter, '_setup_async_loop'):
             converter = MP4ToMP3Converter()
             return converter
 
-    @pytest.mark.asyncio
-    async def test_convert_file_success(self, converter, temp_dir):
-        """ファイル変換の成功テスト"""
-        input_file = os.path.join(temp_dir, "test.mp4")
-        output_file = os.path.join(temp_dir, "test.mp3")
-        
-        with open(input_file, 'w') as f:
-            f.write("dummy content")
-        
-        with patch('asyncio.create_subprocess_exec') as mock_subprocess, \
-             patch('os.remove') as mock_remove:
-            
-            mock_process = MagicMock()
-            # communicateメソッドを非同期コルーチンとしてモック
-            async def mock_communicate():
-                return (b'stdout', b'stderr')
-            mock_process.communicate = mock_communicate
-            mock_process.returncode = 0  # 成功を示すリターンコード
-            mock_subprocess.return_value = mock_process
-            
-            # _convert_file内でos.path.existsが呼ばれるタイミングで出力ファイルが存在すると仮定
-            with patch('mp4_to_mp3_converter.os.path.exists') as mock_exists:
-                # 最初の呼び出し（既存ファイルチェック）ではFalse、
-                # 2回目の呼び出し（変換後チェック）ではTrueを返す
-                mock_exists.side_effect = [False, True]
-                
-                result_file, success, error = await converter._convert_file(input_file, output_file)
-                
-                assert success is True, f"Expected success=True, got success={success}, error='{error}'"
-                assert result_file == input_file
-                assert error == ""
-                mock_subprocess.assert_called_once()
+    def test_progress_event_is_queued(self, converter):
+        """進捗イベントがファイル一覧とステータスの更新として積まれることのテスト"""
+        job = ConversionJob("/in/a.mp4", "/out/a.mp3", 3)
+        converter._on_engine_event(ConversionEvent(EventKind.PROGRESS, job, fraction=0.25, speed="5.0x"))
+        assert converter.ui_updates.drain().status == "a.mp4: 25% (5.0x)"
+
+        converter._on_engine_event(ConversionEvent(EventKind.PROGRESS, job, speed="N/A"))
+        pending = converter.ui_updates.drain()
+        assert pending.status == "a.mp4: 変換中 (N/A)"
+        assert pending.rows == {3: ("変換中", "N/A")}
+
+    def test_finished_event_updates_row(self, converter):
+        """完了・失敗・スキップが行の状態になることのテスト"""
+        done = ConversionJob("/in/a.mp4", "/out/a.mp3", 0, status=JobStatus.DONE)
+        failed = ConversionJob("/in/b.mp4", "/out/b.mp3", 1, status=JobStatus.FAILED, error_message="壊れています\n詳細")
+        skipped = ConversionJob("/in/c.mp4", "/out/c.mp3", 2, status=JobStatus.SKIPPED)
+        converter._on_engine_event(ConversionEvent(EventKind.SKIPPED, skipped, message="変換済みのためスキップ"))
+        for job in (done, failed, skipped):
+            converter._on_engine_event(ConversionEvent(EventKind.FINISHED, job))
+
+        assert converter.ui_updates.drain().rows == {
+            0: ("完了", ""), 1: ("失敗", "壊れています"), 2: ("スキップ", "変換済みのためスキップ")
+        }
 
     @pytest.mark.asyncio
-    async def test_convert_file_failure(self, converter, temp_dir):
-        """ファイル変換の失敗テスト"""
-        input_file = os.path.join(temp_dir, "test.mp4")
-        output_file = os.path.join(temp_dir, "test.mp3")
-        
-        with patch('asyncio.create_subprocess_exec', side_effect=Exception("Test error")):
-            result_file, success, error = await converter._convert_file(input_file, output_file)
-            
-            assert success is False
-            assert result_file == input_file
-            assert error == "Test error"
+    async def test_convert_all_files_reports_each_result(self, converter):
+        """変換のスレッドはウィジェットに触れず、結果はTkのスレッドで反映されることのテスト"""
+        converter.selected_files = ["/in/a.mp4", "/in/b.mp4"]
+        converter.output_dir = "/out"
+        converter.progress = MagicMock()
+        converter.status_label = MagicMock()
+        converter.file_list = MagicMock()
+
+        async def fake_run(job):
+            job.status = JobStatus.DONE if job.input_file.endswith("a.mp4") else JobStatus.FAILED
+            job.error_message = "" if job.success else "error"
+
+        with patch.object(converter.engine, '_run_job', side_effect=fake_run), \
+             patch('tkinter.messagebox.showwarning') as mock_warning:
+            await converter._convert_all_files()
+            converter.status_label.config.assert_not_called()
+            mock_warning.assert_not_called()
+
+            converter._flush_ui_updates()
+
+        mock_warning.assert_called_once()
+        converter.status_label.config.assert_called_once_with(text="変換完了: 1/2 ファイル")
+        converter.progress.configure.assert_called_once_with(value=2, maximum=2)
+        converter.file_list.update_rows.assert_called_once_with({0: ("完了", ""), 1: ("失敗", "error")})
+        converter.window.after.assert_called_with(50, converter._flush_ui_updates)
+
+
+class TestUiUpdates:
+    """画面の更新をまとめる仕組みのテストクラス"""
+
+    def test_updates_are_coalesced(self):
+        """同じ対象への更新は最後のものだけが残ることのテスト"""
+        updates = UiUpdates()
+        for percent in range(100):
+            updates.set_row(7, "変換中", f"{percent}%")
+            updates.set_status(f"{percent}%")
+            updates.set_progress(percent, 100)
+        updates.set_row(8, "完了")
+        calls = []
+        updates.call(lambda: calls.append(1))
+
+        pending = updates.drain()
+        assert pending.rows == {7: ("変換中", "99%"), 8: ("完了", "")}
+        assert pending.status == "99%"
+        assert pending.progress == (99, 100)
+        assert len(pending.calls) == 1
+
+        assert updates.drain() == ({}, None, None, [])
+
+
+class TestFileList:
+    """ファイル一覧のテストクラス"""
+
+    FILES = [f"/videos/{n:05d}.mp4" for n in range(20000)]
+
+    def test_model_window(self):
+        """表示している範囲だけを返し、スクロールは端で止まることのテスト"""
+        model = FileListModel(visible_rows=8)
+        model.set_files(self.FILES)
+
+        assert model.window()[0] == ["00000.mp4", "待機中", ""]
+        assert len(model.window()) == 8
+        assert model.update({100: ("完了", "")}) is False
+        assert model.update({3: ("変換中", "10%")}) is True
+
+        assert model.scroll_to(100) is True
+        assert model.window()[0] == ["00100.mp4", "完了", ""]
+        assert model.scroll_to(10 ** 9) is True
+        assert model.first == 20000 - 8
+        assert model.fraction() == (19992 / 20000, 1.0)
+        assert model.scroll_to(-5) is True and model.first == 0
+
+    def test_view_keeps_only_visible_items(self):
+        """Treeviewには表示している行だけを置き、スクロールでは値を書き換えることのテスト"""
+        view = VirtualFileList.__new__(VirtualFileList)
+        view.model = FileListModel(visible_rows=3)
+        view.tree = MagicMock()
+        view.tree.get_children.return_value = ()
+        view.scrollbar = MagicMock()
+
+        view.set_files(self.FILES)
+        assert view.tree.insert.call_count == 3
+
+        view.tree.get_children.return_value = ("row0", "row1", "row2")
+        view._on_scrollbar("moveto", "0.5")
+        assert view.tree.insert.call_count == 3
+        view.tree.item.assert_any_call("row0", values=["10000.mp4", "待機中", ""])
+        view.scrollbar.set.assert_called_with(0.5, 10003 / 20000)
+
+        view.tree.item.reset_mock()
+        view.update_rows({0: ("完了", "")})
+        view.tree.item.assert_not_called()
 
 
 class TestMP4ToMP3ConverterOpenOutputDir:
@@ -109,7 +211,7 @@ class TestMP4ToMP3ConverterOpenOutputDir:
     def converter(self):
         """MP4ToMP3Converterのインスタンスを作成するフィクスチャ"""
         with patch('tkinter.Tk'), \
-             patch.object(MP4ToMP3Converter, '_check_ffmpeg', return_value=True), \
+             patch.object(MP4ToMP3Converter, '_start_ffmpeg_probe'), \
              patch.object(MP4ToMP3Converter, '_create_widgets'), \
              patch.object(MP4ToMP3Converter, '_setup_async_loop'):
             converter = MP4ToMP3Converter()
@@ -138,4 +240,46 @@ class TestMP4ToMP3ConverterOpenOutputDir:
              patch('tkinter.messagebox.showwarning') as mock_warning:
             converter._open_output_dir()
             mock_startfile.assert_not_called()
-            mock_warning.assert_called_once() 
\ No newline at end of file
+            mock_warning.assert_called_once() 
+
+class TestMP4ToMP3ConverterCancel:
+    """変換の中止と終了時の後片付けのテストクラス"""
+
+    @pytest.fixture
+    def converter(self):
+        """MP4ToMP3Converterのインスタンスを作成するフィクスチャ"""
+        with patch('tkinter.Tk'), \
+             patch.object(MP4ToMP3Converter, '_start_ffmpeg_probe'), \
+             patch.object(MP4ToMP3Converter, '_create_widgets'), \
+             patch.object(MP4ToMP3Converter, '_setup_async_loop'):
+            converter = MP4ToMP3Converter()
+            converter.loop = MagicMock()
+            converter.cancel_btn = MagicMock()
+            converter.status_label = MagicMock()
+            converter.is_converting = True
+            return converter
+
+    def test_cancel_is_sent_to_event_loop(self, converter):
+        """中止はイベントループのスレッドでエンジンに渡されることのテスト"""
+        converter._cancel_conversion()
+        converter.loop.call_soon_threadsafe.assert_called_once_with(converter.engine.cancel)
+
+        job = ConversionJob("/in/b.mp4", "/out/b.mp3", 1)
+        converter.jobs = [ConversionJob("/in/a.mp4", "/out/a.mp3", 0), job]
+        converter._menu_row = 1
+        converter._cancel_selected_row()
+        converter.loop.call_soon_threadsafe.assert_called_with(converter.engine.cancel, job)
+
+    def test_closing_stops_conversion(self, converter):
+        """終了時は変換の取り消しを待ち、終わらなければffmpegを強制終了することのテスト"""
+        converter._conversion_thread = MagicMock()
+        converter._conversion_thread.is_alive.return_value = True
+
+        with patch('tkinter.messagebox.askyesno', return_value=True), \
+             patch.object(converter.engine, 'kill_processes') as mock_kill:
+            converter._on_closing()
+
+        converter.loop.call_soon_threadsafe.assert_called_once_with(converter.engine.cancel)
+        converter._conversion_thread.join.assert_called_once()
+        mock_kill.assert_called_once()
+        converter.window.destroy.assert_called_once()
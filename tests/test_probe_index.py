@@ -0,0 +1,118 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, JobStatus, MediaInfo, make_jobs, order_longest_first
+from mp4_to_mp3.probe_index import ProbeIndex
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def _touch(path: str, data: bytes = b"video"):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestProbeIndex:
+    """ffprobe結果のキャッシュのテストクラス"""
+
+    def test_store_and_lookup(self, temp_dir):
+        """保存した結果が再度開いた後も取り出せることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+        index_path = os.path.join(temp_dir, "cache", "index.sqlite3")
+        media = MediaInfo("aac", 44100, 2, 12.5)
+
+        index = ProbeIndex(index_path)
+        index.store(input_file, media)
+        index.close()
+
+        assert ProbeIndex(index_path).lookup(input_file) == media
+
+    def test_changed_file_is_not_returned(self, temp_dir):
+        """サイズや更新時刻が変わったファイルは再解析の対象になることのテスト"""
+        input_file = os.path.join(temp_dir, "a.mp4")
+        _touch(input_file)
+        index = ProbeIndex()
+        index.store(input_file, MediaInfo("aac", 44100, 2, 12.5))
+
+        _touch(input_file, b"replaced video")
+
+        assert index.lookup(input_file) is None
+        assert index.lookup(os.path.join(temp_dir, "missing.mp4")) is None
+
+
+class TestLongestFirst:
+    """長さに基づくスケジューリングのテストクラス"""
+
+    def test_order_longest_first(self):
+        """長い順に並び、長さ不明のジョブは最後に回ることのテスト"""
+        jobs = make_jobs(["short.mp4", "unknown.mp4", "long.mp4", "mid.mp4"], "/out")
+        jobs[0].media = MediaInfo("aac", 44100, 2, 10.0)
+        jobs[2].media = MediaInfo("aac", 44100, 2, 3 * 3600.0)
+        jobs[3].media = MediaInfo("aac", 44100, 2, 600.0)
+
+        ordered = order_longest_first(jobs)
+
+        assert [job.input_file for job in ordered] == [
+            "long.mp4", "mid.mp4", "short.mp4", "unknown.mp4"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_probe_jobs_uses_index(self, temp_dir):
+        """変更のないファイルはffprobeを起動せずに解析結果が設定されることのテスト"""
+        paths = [os.path.join(temp_dir, name) for name in ("a.mp4", "b.mp4")]
+        for path in paths:
+            _touch(path)
+        index = ProbeIndex()
+        index.store(paths[0], MediaInfo("aac", 44100, 2, 30.0))
+        engine = ConversionEngine(probe_index=index)
+        jobs = make_jobs(paths, temp_dir)
+
+        async def fake_probe(input_file, ffprobe="ffprobe"):
+            return MediaInfo("mp3", 48000, 2, 60.0)
+
+        with patch('mp4_to_mp3.engine.probe_audio', side_effect=fake_probe) as mock_probe:
+            await engine.probe_jobs(jobs)
+            assert mock_probe.call_count == 1
+            # 2回目はすべてインデックスから取り出す
+            await engine.probe_jobs(make_jobs(paths, temp_dir))
+            assert mock_probe.call_count == 1
+
+        assert [job.media.duration for job in jobs] == [30.0, 60.0]
+
+    @pytest.mark.asyncio
+    async def test_batch_starts_with_longest_job(self, temp_dir):
+        """バッチが長い入力から実行されることのテスト"""
+        paths = [os.path.join(temp_dir, f"{i}.mp4") for i in range(3)]
+        for path in paths:
+            _touch(path)
+        durations = {paths[0]: 5.0, paths[1]: 7200.0, paths[2]: 60.0}
+        started = []
+
+        async def fake_probe(input_file, ffprobe="ffprobe"):
+            return MediaInfo("aac", 44100, 2, durations[input_file])
+
+        async def fake_run(job):
+            started.append(job.input_file)
+            await asyncio.sleep(0)
+            job.status = JobStatus.DONE
+
+        engine = ConversionEngine(use_manifest=False)
+        jobs = make_jobs(paths, temp_dir)
+        with patch('mp4_to_mp3.engine.probe_audio', side_effect=fake_probe), \
+             patch.object(engine, '_run_job', side_effect=fake_run):
+            results = await engine.run(jobs, max_workers=1)
+
+        assert started == [paths[1], paths[2], paths[0]]
+        assert [job.input_file for job in results] == paths
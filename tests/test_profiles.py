@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, ConversionJob, JobStatus, MediaInfo
+from mp4_to_mp3.manifest import ConversionManifest
+from mp4_to_mp3.profiles import (
+    DEFAULT_PROFILE,
+    PRESETS,
+    OutputProfile,
+    parse_profile,
+    preset_profile,
+    validate_profiles,
+)
+
+PODCAST = OutputProfile('podcast', "{stem}.podcast.mp3", '64k', channels=1)
+ARCHIVE = OutputProfile('archive', "{stem}.mp3", '192k', channels=2)
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+class TestOutputProfile:
+    """出力プロファイルのテストクラス"""
+
+    def test_parse_profile(self):
+        """コマンドラインの指定が解釈されることのテスト"""
+        profile = parse_profile("podcast,bitrate=64k,channels=mono,sample_rate=22050")
+        assert profile == OutputProfile('podcast', "{stem}_{name}.mp3", '64k', 1, 22050)
+        assert profile.filename("/in/talk.mp4") == "talk_podcast.mp3"
+        assert profile.codec_args() == [
+            '-acodec', 'libmp3lame', '-b:a', '64k', '-ac', '1', '-ar', '22050'
+        ]
+
+    def test_encoder_options(self):
+        """VBRの品質とアルゴリズム品質がffmpegの引数になることのテスト"""
+        profile = parse_profile("lecture,preset=speech,quality=6,compression_level=9")
+        assert profile.codec_args() == [
+            '-acodec', 'libmp3lame', '-q:a', '6', '-compression_level', '9', '-ac', '1', '-ar', '24000'
+        ]
+        assert profile.filename("/in/talk.mp4") == "talk_lecture.mp3"
+        assert PRESETS['archive'].codec_args() == [
+            '-acodec', 'libmp3lame', '-b:a', '320k', '-compression_level', '2'
+        ]
+
+    def test_presets(self):
+        """プリセットから同じ名前の出力ファイルのプロファイルが作られることのテスト"""
+        assert preset_profile('default') == DEFAULT_PROFILE
+        assert preset_profile('speech').filename("/in/talk.mp4") == "talk.mp3"
+        with pytest.raises(ValueError):
+            preset_profile('tiny')
+
+    def test_params_match_older_records(self):
+        """エンコーダー設定を使わないプロファイルは以前と同じ設定として記録されることのテスト"""
+        assert PODCAST.params() == {
+            'name': 'podcast', 'template': "{stem}.podcast.mp3", 'bitrate': '64k',
+            'channels': 1, 'sample_rate': None, 'stream_copy': False,
+        }
+        assert PRESETS['vbr'].params()['quality'] == 2
+
+    @pytest.mark.parametrize("spec", [
+        "", "bitrate=64k", "podcast,bitrate", "podcast,volume=2",
+        "podcast,channels=many", "podcast,template={missing}.mp3",
+        "podcast,preset=tiny", "podcast,quality=10", "podcast,compression_level=fast",
+    ])
+    def test_parse_profile_errors(self, spec):
+        """誤った指定がValueErrorになることのテスト"""
+        with pytest.raises(ValueError):
+            parse_profile(spec)
+
+    def test_duplicate_filenames_are_rejected(self):
+        """出力ファイル名が重なるプロファイルの組み合わせを拒否することのテスト"""
+        validate_profiles([PODCAST, ARCHIVE])
+        with pytest.raises(ValueError):
+            validate_profiles([ARCHIVE, DEFAULT_PROFILE])
+        with pytest.raises(ValueError):
+            ConversionEngine(profiles=[PODCAST, PODCAST])
+
+
+class TestMultiOutput:
+    """1回のffmpeg実行で複数の出力を書き出す処理のテストクラス"""
+
+    def test_plan_outputs(self):
+        """プロファイルごとの出力ファイルと引数が決まることのテスト"""
+        engine = ConversionEngine(profiles=[PODCAST, ARCHIVE])
+        job = ConversionJob("/in/talk.mp4", "/out/sub/talk.mp3")
+        job.media = MediaInfo("mp3", 44100, 2, 60.0)
+
+        plans = engine.plan_outputs(job)
+
+        assert plans == [
+            (os.path.join("/out/sub", "talk.podcast.mp3"), PODCAST.codec_args()),
+            # stream_copyでないプロファイルはMP3でも再エンコードする
+            (os.path.join("/out/sub", "talk.mp3"), ARCHIVE.codec_args()),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_single_ffmpeg_run_writes_all_outputs(self, temp_dir):
+        """1つのffmpegプロセスで全プロファイルが出力され、記録されることのテスト"""
+        input_file = os.path.join(temp_dir, "talk.mp4")
+        with open(input_file, 'wb') as f:
+            f.write(b"video")
+        engine = ConversionEngine(profiles=[PODCAST, ARCHIVE], manifest_dir=temp_dir)
+        job = ConversionJob(input_file, os.path.join(temp_dir, "talk.mp3"))
+        commands = []
+
+        async def fake_ffmpeg(args, on_progress=None):
+            commands.append(args)
+            for output_file in (args[-1], args[args.index('-y') + 1]):
+                with open(output_file, 'wb') as f:
+                    f.write(b"audio")
+            return 0, []
+
+        with patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 60.0)), \
+             patch.object(engine, '_run_ffmpeg', side_effect=fake_ffmpeg):
+            await engine.run_job(job)
+            assert job.status == JobStatus.DONE
+            assert len(commands) == 1
+            assert commands[0].count('-i') == 1
+            assert job.output_file == os.path.join(temp_dir, "talk.podcast.mp3")
+            assert job.extra_outputs == [os.path.join(temp_dir, "talk.mp3")]
+            assert job.output_size == 10
+            engine.save_manifests()
+
+            # 2回目は全出力が揃っているので省略される
+            again = ConversionJob(input_file, os.path.join(temp_dir, "talk.mp3"))
+            await ConversionEngine(profiles=[PODCAST, ARCHIVE], manifest_dir=temp_dir).run_job(again)
+            assert again.status == JobStatus.SKIPPED
+            assert again.extra_outputs == job.extra_outputs
+
+    def test_missing_extra_output_forces_reconversion(self, temp_dir):
+        """2つ目以降の出力が失われた場合は再変換の対象になることのテスト"""
+        input_file = os.path.join(temp_dir, "talk.mp4")
+        outputs = [os.path.join(temp_dir, name) for name in ("talk.podcast.mp3", "talk.mp3")]
+        for path in [input_file, *outputs]:
+            with open(path, 'wb') as f:
+                f.write(b"data")
+        manifest = ConversionManifest(temp_dir)
+        manifest.record(input_file, outputs[0], {}, outputs[1:])
+        assert manifest.lookup(input_file, {}) == outputs[0]
+
+        os.remove(outputs[1])
+
+        assert manifest.lookup(input_file, {}) is None
+        assert manifest.prune() == [os.path.abspath(input_file)]
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, MediaInfo
+from mp4_to_mp3.profiles import PRESETS
+from mp4_to_mp3.segmented import (
+    FRAME_SAMPLES,
+    LAME_DELAY,
+    plan_segments,
+    segment_args,
+    segment_count_for,
+    split_frames,
+    trim_segment,
+)
+
+ENCODE_ARGS = ['-acodec', 'libmp3lame', '-b:a', '192k']
+
+
+def _frame(bitrate_bits: int = 0x9, padding: bool = False) -> bytes:
+    """MPEG-1 Layer III、44.1kHzのフレームを作る（既定は128kbps）"""
+    header = bytes([0xFF, 0xFB, (bitrate_bits << 4) | (0x02 if padding else 0), 0x00])
+    length = 144 * 128000 // 44100 + (1 if padding else 0)
+    return header + bytes(length - 4)
+
+
+class TestPlanSegments:
+    """区間分割のテストクラス"""
+
+    def test_boundaries_are_frame_aligned(self):
+        """区間の境界がエンコード後のフレーム境界に一致することのテスト"""
+        sample_rate = 44100
+        segments = plan_segments(sample_rate * 600, sample_rate, 4)
+        assert len(segments) == 4
+
+        for segment in segments[1:]:
+            kept_start = segment.start_sample + segment.drop_frames * FRAME_SAMPLES - LAME_DELAY
+            assert (kept_start + LAME_DELAY) % FRAME_SAMPLES == 0
+            assert kept_start > segment.start_sample
+
+    def test_kept_frames_are_contiguous(self):
+        """残すフレームが区間をまたいで連続することのテスト"""
+        sample_rate = 48000
+        segments = plan_segments(sample_rate * 600, sample_rate, 3)
+
+        position = -LAME_DELAY
+        for segment in segments[:-1]:
+            kept_start = segment.start_sample + segment.drop_frames * FRAME_SAMPLES - LAME_DELAY
+            assert kept_start == position
+            position += segment.keep_frames * FRAME_SAMPLES
+            # 末尾の余分なエンコードが残す範囲を覆っている
+            assert segment.start_sample + segment.sample_count > position
+        last = segments[-1]
+        assert last.start_sample + last.drop_frames * FRAME_SAMPLES - LAME_DELAY == position
+        assert last.sample_count is None and last.keep_frames is None
+
+    def test_mpeg2_sample_rates_use_half_frames(self):
+        """22.05kHzでは576サンプルのフレーム単位で数えることのテスト"""
+        segments = plan_segments(22050 * 600, 22050, 2)
+        assert segments[1].drop_frames == 2 * (segments[1].drop_frames // 2)
+        assert segments[0].keep_frames % 2 == 0
+
+    def test_short_input_is_not_split(self):
+        """助走と末尾の余分を取れないほど短い入力は分割しないことのテスト"""
+        assert len(plan_segments(4000, 44100, 8)) == 1
+        assert segment_count_for(90.0, 8) == 1
+        assert segment_count_for(3 * 3600.0, 8) == 8
+
+    def test_segment_args(self):
+        """区間のffmpeg引数のテスト"""
+        segment = plan_segments(44100 * 600, 44100, 2)[1]
+        args = segment_args("in.mp4", segment, 44100, ENCODE_ARGS, "seg.mp3")
+        assert args[:2] == ['-ss', f"{segment.start_sample / 44100:.6f}"]
+        assert ['-reservoir', '0'] == args[args.index('-reservoir'):args.index('-reservoir') + 2]
+        assert args[-1] == "seg.mp3"
+
+
+class TestFrames:
+    """MP3フレーム処理のテストクラス"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """一時ディレクトリを作成するフィクスチャ"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        shutil.rmtree(temp_dir)
+
+    def test_split_frames(self):
+        """フレーム長がヘッダーから求まることのテスト"""
+        data = _frame() + _frame(padding=True) + _frame()
+        frames = split_frames(data)
+        assert [length for _, length in frames] == [417, 418, 417]
+        assert frames[2][0] == 835
+
+    def test_trim_segment(self, temp_dir):
+        """先頭と末尾のフレームが取り除かれることのテスト"""
+        path = os.path.join(temp_dir, "seg.mp3")
+        frames = [_frame(padding=bool(i % 2)) for i in range(6)]
+        with open(path, 'wb') as f:
+            f.write(b"".join(frames))
+
+        trim_segment(path, 2, 3)
+
+        with open(path, 'rb') as f:
+            assert f.read() == b"".join(frames[2:5])
+
+
+class TestEngineSplitMode:
+    """エンジンの分割モード判定のテストクラス"""
+
+    def test_split_only_above_threshold(self):
+        """しきい値を超える再エンコードだけが分割されることのテスト"""
+        engine = ConversionEngine(split_threshold=1800, segments=4)
+        long_aac = MediaInfo("aac", 44100, 2, 3 * 3600.0)
+
+        assert len(engine._plan_segments(long_aac, ENCODE_ARGS)) == 4
+        assert engine._plan_segments(MediaInfo("aac", 44100, 2, 600.0), ENCODE_ARGS) == []
+        assert engine._plan_segments(long_aac, ['-c:a', 'copy']) == []
+        assert ConversionEngine()._plan_segments(long_aac, ENCODE_ARGS) == []
+
+    def test_resampling_and_vbr_are_not_split(self):
+        """リサンプリングやVBRのプロファイルは分割されないことのテスト"""
+        engine = ConversionEngine(split_threshold=1800, segments=4)
+        long_aac = MediaInfo("aac", 44100, 2, 3 * 3600.0)
+
+        assert engine._plan_segments(long_aac, PRESETS['speech-fast'].codec_args()) == []
+        assert engine._plan_segments(long_aac, PRESETS['vbr'].codec_args()) == []
+        assert len(engine._plan_segments(long_aac, PRESETS['fast'].codec_args())) == 4
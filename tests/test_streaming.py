@@ -0,0 +1,180 @@
+import asyncio
+import io
+import os
+import struct
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, MediaInfo
+from mp4_to_mp3.loudness import LoudnessTarget
+from mp4_to_mp3.streaming import (
+    StreamConversionError,
+    _iter_chunks,
+    iter_mp3,
+    scan_mp4_head,
+    stream_mp3,
+)
+
+# 入力を読み、どこから読んだかと内容をそのまま標準出力へ返すffmpegの代わり
+FAKE_FFMPEG = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+source = args[args.index('-i') + 1]
+if source == 'pipe:0':
+    data = sys.stdin.buffer.read()
+    kind = b'pipe'
+else:
+    data = open(source, 'rb').read()
+    kind = b'spool' if '.mp4_to_mp3-stream-' in source else b'file'
+if b'broken' in data:
+    sys.stderr.write('Invalid data found when processing input\\n')
+    sys.exit(1)
+if b'args' in data:
+    sys.stdout.write(' '.join(args))
+    sys.exit(0)
+if b'endless' in data:
+    while True:
+        sys.stdout.buffer.write(b'x' * 65536)
+sys.stdout.buffer.write(kind + b':' + data)
+"""
+
+
+def _box(kind: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+FASTSTART = _box(b'ftyp', b'isom') + _box(b'moov', b'index') + _box(b'mdat', b'audio')
+MOOV_AT_END = _box(b'ftyp', b'isom') + _box(b'mdat', b'audio') + _box(b'moov', b'index')
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """偽のffmpegを使うエンジンを作成するフィクスチャ"""
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    return ConversionEngine(use_manifest=False, ffmpeg_path=str(ffmpeg))
+
+
+async def _collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+async def _async_chunks(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        await asyncio.sleep(0)
+        yield data[start:start + size]
+
+
+class TestScanMp4Head:
+    """moovの位置の判定のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_moov_position(self):
+        """moovが先頭側ならパイプで、mdatが先ならパイプでは変換できないと判定されることのテスト"""
+        head, streamable = await scan_mp4_head(_async_chunks(FASTSTART))
+        assert streamable and FASTSTART.startswith(head)
+
+        head, streamable = await scan_mp4_head(_async_chunks(MOOV_AT_END))
+        assert not streamable and MOOV_AT_END.startswith(head)
+
+    @pytest.mark.asyncio
+    async def test_large_box_and_other_formats(self):
+        """64ビットの大きさのボックスを読み飛ばし、MP4以外はパイプで変換することのテスト"""
+        large = struct.pack('>I4sQ', 1, b'free', 16 + 3) + b"pad"
+        data = _box(b'ftyp') + large + _box(b'moov')
+        assert (await scan_mp4_head(_async_chunks(data)))[1] is True
+
+        assert (await scan_mp4_head(_async_chunks(b"ID3\x04 mp3 data")))[1] is True
+
+
+class TestIterChunks:
+    """入力の読み込みのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_sources(self):
+        """バイト列、ファイルオブジェクト、イテラブル、非同期の読み込みを同じように読めることのテスト"""
+        data = b"0123456789" * 10
+
+        class AsyncReader:
+            def __init__(self):
+                self.buffer = io.BytesIO(data)
+
+            async def read(self, size):
+                return self.buffer.read(size)
+
+        sources = [data, io.BytesIO(data), [data[:50], b"", data[50:]], _async_chunks(data), AsyncReader()]
+        for source in sources:
+            chunks = [chunk async for chunk in _iter_chunks(source, 16)]
+            assert b"".join(chunks) == data
+            assert max(len(chunk) for chunk in chunks) <= 16 or isinstance(source, list)
+
+
+class TestStreamMp3:
+    """ストリーミング変換のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_streamable_input_is_piped(self, engine):
+        """moovが先頭側の入力は一時ファイルを作らずにパイプで渡されることのテスト"""
+        output = await _collect(stream_mp3(_async_chunks(FASTSTART), engine=engine))
+        assert output == b"pipe:" + FASTSTART
+
+    @pytest.mark.asyncio
+    async def test_moov_at_end_is_spooled(self, engine, tmp_path):
+        """moovが末尾の入力は一時ファイルに書き出され、終わったら消されることのテスト"""
+        spool_dir = tmp_path / "spool"
+        spool_dir.mkdir()
+
+        output = await _collect(stream_mp3(io.BytesIO(MOOV_AT_END), engine=engine, spool_dir=str(spool_dir)))
+
+        assert output == b"spool:" + MOOV_AT_END
+        assert os.listdir(spool_dir) == []
+
+    @pytest.mark.asyncio
+    async def test_files_are_read_directly(self, engine, tmp_path):
+        """実在するファイルはffmpegに直接読ませることのテスト"""
+        path = tmp_path / "in.mp4"
+        path.write_bytes(MOOV_AT_END)
+
+        assert await _collect(stream_mp3(str(path), engine=engine)) == b"file:" + MOOV_AT_END
+        with open(path, 'rb') as f:
+            assert await _collect(stream_mp3(f, engine=engine)) == b"file:" + MOOV_AT_END
+
+    @pytest.mark.asyncio
+    async def test_error_is_raised(self, engine):
+        """ffmpegの失敗が終了コードと標準エラー出力付きで送出されることのテスト"""
+        with pytest.raises(StreamConversionError) as excinfo:
+            await _collect(stream_mp3(b"broken", engine=engine))
+        assert excinfo.value.returncode == 1
+        assert "Invalid data" in str(excinfo.value)
+
+    @pytest.mark.asyncio
+    async def test_closing_early_stops_ffmpeg(self, engine):
+        """取り出しをやめるとffmpegが終了させられることのテスト"""
+        chunks = stream_mp3(b"endless", engine=engine, chunk_size=1024)
+        first = await chunks.__anext__()
+        assert len(first) <= 1024
+
+        await asyncio.wait_for(chunks.aclose(), timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_loudness_keeps_sample_rate(self, engine, tmp_path):
+        """音量を正規化するとき、ファイルの入力はサンプルレートを調べて戻すことのテスト"""
+        path = tmp_path / "in.mp4"
+        path.write_bytes(b"args")
+        engine.loudness = LoudnessTarget()
+
+        with patch('mp4_to_mp3.engine.probe_audio', return_value=MediaInfo("aac", 44100, 2, 10.0)) as probe:
+            args = (await _collect(stream_mp3(str(path), engine=engine))).decode().split()
+            assert args[args.index('-ar') + 1] == '44100'
+            # パイプからはサンプルレートを調べられない
+            args = (await _collect(stream_mp3(b"args", engine=engine))).decode().split()
+            assert '-ar' not in args
+        assert probe.call_count == 1
+        assert args[args.index('-af') + 1] == LoudnessTarget().filter()
+
+    def test_sync_iterator(self, engine):
+        """同期版でも同じ出力が得られることのテスト"""
+        assert b"".join(iter_mp3(FASTSTART, engine=engine)) == b"pipe:" + FASTSTART
@@ -0,0 +1,96 @@
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.toolchain import (
+    FfmpegCapabilities,
+    _parse_encoders,
+    _parse_protocols,
+    _parse_version,
+    find_binary,
+    load_capabilities,
+)
+
+ENCODERS_OUTPUT = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D a64multi             Multicolor charset for Commodore 64 (codec a64_multi)
+ A....D aac                  AAC (Advanced Audio Coding)
+ A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3) (codec mp3)
+"""
+
+PROTOCOLS_OUTPUT = """Supported file protocols:
+Input:
+  file
+  http
+  pipe
+Output:
+  file
+  pipe
+"""
+
+
+def _executable(path: str) -> str:
+    with open(path, 'w') as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+class TestFfmpegCapabilities:
+    """ffmpegの検出と機能の確認のテストクラス"""
+
+    def test_parse_outputs(self):
+        """ffmpegの一覧表示からバージョン・エンコーダー・プロトコルを読み取ることのテスト"""
+        assert _parse_version("ffmpeg version 7.0.2-static https://... Copyright") == "7.0.2-static"
+        assert _parse_encoders(ENCODERS_OUTPUT) == ("aac", "libmp3lame")
+        assert _parse_protocols(PROTOCOLS_OUTPUT) == (("file", "http", "pipe"), ("file", "pipe"))
+
+    def test_find_binary_order(self, tmp_path, monkeypatch):
+        """明示的な指定、環境変数、アプリと同じフォルダ、PATHの順に探すことのテスト"""
+        app_dir = tmp_path / "app"
+        app_dir.mkdir()
+        bundled = _executable(str(app_dir / "ffmpeg"))
+        explicit = _executable(str(tmp_path / "my-ffmpeg"))
+        monkeypatch.setattr('sys.argv', [str(app_dir / "mp4_to_mp3_converter.py")])
+        monkeypatch.delenv('MP4_TO_MP3_FFMPEG', raising=False)
+
+        assert find_binary('ffmpeg', explicit) == explicit
+        assert find_binary('ffmpeg') == bundled
+        monkeypatch.setenv('MP4_TO_MP3_FFMPEG', explicit)
+        assert find_binary('ffmpeg') == explicit
+        assert find_binary('ffmpeg', str(tmp_path / "missing")) is None
+
+    def test_capabilities_are_cached_per_binary(self, tmp_path):
+        """2回目はffmpegを実行せず、バイナリが変わったら調べ直すことのテスト"""
+        ffmpeg = _executable(str(tmp_path / "ffmpeg"))
+        cache_path = str(tmp_path / "capabilities.json")
+        calls = []
+
+        async def fake_detect(ffmpeg_path, ffprobe_path=None):
+            calls.append(ffmpeg_path)
+            return FfmpegCapabilities(ffmpeg_path, ffprobe_path, "7.0", ("libmp3lame",), ("file",), ("file",))
+
+        with patch('mp4_to_mp3.toolchain.detect_capabilities', side_effect=fake_detect):
+            first = load_capabilities(ffmpeg, cache_path=cache_path)
+            second = load_capabilities(ffmpeg, cache_path=cache_path)
+            assert calls == [ffmpeg]
+            assert first == second and second.has_libmp3lame
+
+            os.utime(ffmpeg, ns=(0, 0))
+            load_capabilities(ffmpeg, cache_path=cache_path)
+            assert calls == [ffmpeg, ffmpeg]
+
+    @pytest.mark.parametrize("error", [OSError("exit 1"), TimeoutError()])
+    def test_unusable_ffmpeg(self, tmp_path, error):
+        """ffmpegが実行できない場合はNoneになり、結果がキャッシュされないことのテスト"""
+        ffmpeg = _executable(str(tmp_path / "ffmpeg"))
+        cache_path = str(tmp_path / "capabilities.json")
+
+        with patch('mp4_to_mp3.toolchain.detect_capabilities', side_effect=error):
+            assert load_capabilities(ffmpeg, cache_path=cache_path) is None
+        assert load_capabilities(str(tmp_path / "missing"), cache_path=cache_path) is None
+        assert not os.path.exists(cache_path)
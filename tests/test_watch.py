@@ -0,0 +1,159 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from mp4_to_mp3.engine import ConversionEngine, JobStatus
+from mp4_to_mp3.watch import FolderWatcher, StabilityTracker, watch_and_convert
+
+
+@pytest.fixture
+def temp_dir():
+    """一時ディレクトリを作成するフィクスチャ"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def _write(path: str, data: bytes = b"dummy"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+async def _collect(watcher: FolderWatcher, count: int, timeout: float = 5.0):
+    """監視結果をcount件集める"""
+    found = []
+
+    async def run():
+        async for item in watcher.watch():
+            found.append(item)
+            if len(found) == count:
+                return
+
+    await asyncio.wait_for(run(), timeout)
+    return found
+
+
+class TestStabilityTracker:
+    """書き込み完了の判定のテストクラス"""
+
+    def test_reports_after_settle_time(self, temp_dir):
+        """状態が一定時間変わらなかったファイルだけが通知されることのテスト"""
+        path = os.path.join(temp_dir, "a.mp4")
+        _write(path)
+        tracker = StabilityTracker(settle_seconds=2.0)
+
+        assert tracker.observe(path, 0.0) is False
+        assert tracker.observe(path, 1.0) is False
+        assert tracker.observe(path, 2.5) is True
+        # 同じ内容は再通知しない
+        assert tracker.observe(path, 10.0) is False
+
+    def test_growing_file_restarts_wait(self, temp_dir):
+        """書き込みが続いている間は通知されないことのテスト"""
+        path = os.path.join(temp_dir, "a.mp4")
+        _write(path)
+        tracker = StabilityTracker(settle_seconds=2.0)
+
+        tracker.observe(path, 0.0)
+        _write(path, b"more")
+        assert tracker.observe(path, 3.0) is False
+        assert tracker.observe(path, 5.0) is True
+
+    def test_empty_and_missing_files_are_ignored(self, temp_dir):
+        """空のファイルや消えたファイルは通知されないことのテスト"""
+        path = os.path.join(temp_dir, "a.mp4")
+        open(path, 'wb').close()
+        tracker = StabilityTracker(settle_seconds=0.0)
+
+        assert tracker.observe(path, 0.0) is False
+        assert tracker.observe(path, 1.0) is False
+        assert tracker.observe(os.path.join(temp_dir, "missing.mp4"), 1.0) is False
+        assert tracker.pending == {}
+
+    def test_vanished_files_are_forgotten(self, temp_dir):
+        """走査で見つからなくなったファイルの記録が捨てられることのテスト"""
+        paths = [os.path.join(temp_dir, name) for name in ("a.mp4", "b.mp4")]
+        for path in paths:
+            _write(path)
+        tracker = StabilityTracker(settle_seconds=0.0)
+        for path in paths:
+            tracker.observe(path, 0.0)
+            assert tracker.observe(path, 1.0) is True
+
+        tracker.retain(paths[1:])
+
+        assert list(tracker.reported) == paths[1:]
+        assert tracker.observe(paths[1], 2.0) is False
+
+
+class TestFolderWatcher:
+    """フォルダー監視のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_polling_finds_existing_and_new_files(self, temp_dir):
+        """再走査で既存と新規のファイルが見つかることのテスト"""
+        _write(os.path.join(temp_dir, "old.mp4"))
+        _write(os.path.join(temp_dir, "notes.txt"))
+        watcher = FolderWatcher([temp_dir], settle_seconds=0.05, poll_interval=0.05, use_inotify=False)
+
+        async def add_later():
+            await asyncio.sleep(0.2)
+            _write(os.path.join(temp_dir, "sub", "new.MP4"))
+
+        adding = asyncio.ensure_future(add_later())
+        found = await _collect(watcher, 2)
+        await adding
+
+        assert found == [
+            (os.path.join(temp_dir, "old.mp4"), ""),
+            (os.path.join(temp_dir, "sub", "new.MP4"), "sub"),
+        ]
+        assert watcher.mode == "polling"
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotifyはLinuxのみ")
+    @pytest.mark.asyncio
+    async def test_inotify_detects_new_subdirectory(self, temp_dir):
+        """inotifyで新しいサブディレクトリ内のファイルが見つかることのテスト"""
+        # 再走査に頼らずイベントで検出されることを確かめるため間隔を長くする
+        watcher = FolderWatcher([temp_dir], settle_seconds=0.05, poll_interval=60.0)
+
+        async def add_later():
+            await asyncio.sleep(0.1)
+            _write(os.path.join(temp_dir, "sub", "new.mp4"))
+
+        adding = asyncio.ensure_future(add_later())
+        with patch('mp4_to_mp3.watch.RESCAN_INTERVAL', 60.0):
+            found = await _collect(watcher, 1)
+        await adding
+
+        assert found == [(os.path.join(temp_dir, "sub", "new.mp4"), "sub")]
+        assert watcher.mode == "inotify"
+
+    @pytest.mark.asyncio
+    async def test_watch_and_convert(self, temp_dir):
+        """見つかったファイルがワーカーで変換されることのテスト"""
+        source = os.path.join(temp_dir, "in")
+        _write(os.path.join(source, "a.mp4"))
+        _write(os.path.join(source, "sub", "b.mp4"))
+        watcher = FolderWatcher([source], settle_seconds=0.05, poll_interval=0.05, use_inotify=False)
+        engine = ConversionEngine(max_workers=2, use_manifest=False)
+
+        async def fake_run(job):
+            job.status = JobStatus.DONE
+
+        outputs = []
+        with patch.object(engine, '_run_job', side_effect=fake_run):
+            results = watch_and_convert(engine, watcher, "/out")
+            async for job in results:
+                outputs.append(job.output_file)
+                if len(outputs) == 2:
+                    break
+            await results.aclose()
+
+        assert sorted(outputs) == [os.path.join("/out", "a.mp3"), os.path.join("/out", "sub", "b.mp3")]